@@ -0,0 +1,227 @@
+import os
+import math
+import time
+import wave
+import mimetypes
+from contextlib import asynccontextmanager
+
+from fairQueue import FairQueue
+from metrics import QUEUE_DEPTH, ADMISSION_REJECTIONS, ADMISSION_WAIT_SECONDS, ADMISSION_BACKLOG_SECONDS
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# work is measured per model in its own unit: seconds of audio for ASR, summaries for the LLM, texts for BERT.
+# the seconds per unit are only a starting point, they follow the observed cost of every finished stage.
+DEFAULT_LIMITS = {
+    "ASR": {"concurrency": 1, "max_queued": 8, "seconds_per_unit": 0.1},
+    "LLM": {"concurrency": int(os.getenv("LLM_PARALLEL", "4")) if os.getenv("LLM_ENGINE") == "batched" else 1, "max_queued": 8, "seconds_per_unit": 30},
+    "BERT": {"concurrency": 4, "max_queued": 64, "seconds_per_unit": 0.2}
+}
+
+# admitted work should start within this many seconds, anything that would wait longer is turned away with 503
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "300"))
+# weight of the newest observation in the seconds per unit average
+ADMISSION_SMOOTHING = 0.2
+
+# byte rates used to guess the duration of uploads whose header can't be read cheaply
+AUDIO_BYTES_PER_SECOND = int(os.getenv("ADMISSION_AUDIO_BYTES_PER_SECOND", "16000"))      # 128 kbps
+VIDEO_BYTES_PER_SECOND = int(os.getenv("ADMISSION_VIDEO_BYTES_PER_SECOND", "250000"))     # 2 Mbps
+
+class AdmissionRejected(RuntimeError):
+    def __init__(self, status_code, retry_after, message):
+        self.status_code = status_code
+        self.retry_after = retry_after
+        super().__init__(message)
+
+def _limit(model_key, name):
+    return type(DEFAULT_LIMITS[model_key][name])(os.getenv(f"ADMISSION_{model_key}_{name.upper()}", DEFAULT_LIMITS[model_key][name]))
+
+def media_category(content_type, name=None):
+    if not content_type or content_type == "application/octet-stream":
+        content_type = mimetypes.guess_type(name or "")[0] or ""
+    return content_type.split("/")[0]
+
+def media_seconds(content_type, size, name=None, fileobj=None):
+    '''
+    Estimates the duration of an audio/video upload. WAV headers are read when a file object is at hand, everything else is guessed
+    from the size.
+    '''
+    category = media_category(content_type, name)
+    if category not in ("audio", "video"):
+        return 0
+
+    if fileobj is not None and (name or "").lower().endswith(".wav"):
+        try:
+            position = fileobj.tell()
+            with wave.open(fileobj, "rb") as wav:
+                seconds = wav.getnframes() / wav.getframerate()
+            fileobj.seek(position)
+            return seconds
+        except (wave.Error, EOFError, OSError):
+            fileobj.seek(0)
+
+    return (size or 0) / (VIDEO_BYTES_PER_SECOND if category == "video" else AUDIO_BYTES_PER_SECOND)
+
+class _ModelQueue:
+    def __init__(self, model_key):
+        self.model_key = model_key
+        self.concurrency = _limit(model_key, "concurrency")
+        self.max_queued = _limit(model_key, "max_queued")
+        self.seconds_per_unit = _limit(model_key, "seconds_per_unit")
+        self.slots = FairQueue(model_key, self.concurrency)
+        self.reserved = {}      # ticket id -> units admitted but not yet finished
+        self.owners = {}        # ticket id -> owner of those units
+
+    def backlog_seconds(self, owner=None, exclude=None):
+        if owner is None:
+            return sum(self.reserved.values()) * self.seconds_per_unit / self.concurrency
+
+        # slots are shared fairly, so another owner's work only runs ahead of this owner's as far as this owner has work of its own
+        per_owner = {}
+        for ticket_id, units in self.reserved.items():
+            if ticket_id != id(exclude):
+                per_owner[self.owners[ticket_id]] = per_owner.get(self.owners[ticket_id], 0) + units
+        own = per_owner.pop(owner, 0)
+        return (own + sum(min(units, own) for units in per_owner.values())) * self.seconds_per_unit / self.concurrency
+
+    def discard(self, ticket):
+        self.reserved.pop(id(ticket), None)
+        self.owners.pop(id(ticket), None)
+
+    def observe(self, units, seconds):
+        if units > 0:
+            self.seconds_per_unit += ADMISSION_SMOOTHING * (seconds / units - self.seconds_per_unit)
+
+    def publish(self):
+        QUEUE_DEPTH.labels(f"admission_{self.model_key}").set(len(self.reserved))
+        ADMISSION_BACKLOG_SECONDS.labels(self.model_key).set(self.backlog_seconds())
+
+class AdmissionTicket:
+    '''
+    The AdmissionTicket class holds the work one request was admitted for. Each model stage is entered through stage(), which waits for
+    a free slot on that model; whatever has not run when the request ends is handed back by release(). Slots are shared fairly between
+    owners (see fairQueue.py), a request is owned by its user, or by its client address when it carries no token.
+    '''
+
+    def __init__(self, controller, owner="anonymous"):
+        self.__controller = controller
+        self.owner = owner
+        self.units = {}
+        self.streaming = False      # a streaming response outlives the request's dependencies and releases the ticket itself
+
+    def reserve(self, units):
+        self.__controller.reserve(self, {model_key: amount for model_key, amount in units.items() if amount})
+
+    # a stage runs the given units of the admitted work, all of what is left for the model by default. a batch enters one stage per
+    # file so that other owners are served in between. model is the model the stage leases, so a slot moving between owners on
+    # different models is handed over in turns rather than file by file
+    @asynccontextmanager
+    async def stage(self, model_key, units=None, model=None):
+        queue = self.__controller.queue(model_key)
+        remaining = self.units.get(model_key, 0)
+        units = remaining if units is None else min(units, remaining)
+
+        start = time.perf_counter()
+        await queue.slots.acquire(self.owner, units * queue.seconds_per_unit, None if model is None else str(getattr(model, "value", model)))
+        try:
+            ADMISSION_WAIT_SECONDS.labels(model_key).observe(time.perf_counter() - start)
+
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                queue.observe(units, time.perf_counter() - started)
+                remaining = self.units.get(model_key, 0) - units
+                if remaining > 0:
+                    queue.reserved[id(self)] = self.units[model_key] = remaining
+                else:
+                    queue.discard(self)
+                    self.units.pop(model_key, None)
+                queue.publish()
+        finally:
+            queue.slots.release(self.owner, more=self.units.get(model_key, 0) > 0)
+
+    # the admitted work of a model once it is known better than the estimate it was admitted on, without checking admission again
+    def revise(self, model_key, units):
+        queue = self.__controller.queue(model_key)
+        if units > 0:
+            queue.reserved[id(self)] = self.units[model_key] = units
+            queue.owners[id(self)] = self.owner
+        else:
+            queue.discard(self)
+            self.units.pop(model_key, None)
+        queue.publish()
+
+    def release(self):
+        for model_key in list(self.units):
+            queue = self.__controller.queue(model_key)
+            queue.discard(self)
+            queue.publish()
+        self.units = {}
+
+class AdmissionController:
+    '''
+    The AdmissionController class sits in front of the inference endpoints and decides, before any work starts, whether a request can
+    be served within ADMISSION_MAX_WAIT. It keeps the admitted but unfinished work of every model and turns new requests away with
+    429 when a model's queue is full or 503 when the work ahead of the request's owner would take too long to drain, each with a
+    Retry-After estimate. Limits apply per API process.
+    '''
+
+    def __init__(self, max_wait=ADMISSION_MAX_WAIT):
+        self.max_wait = max_wait
+        self.__queues = {}
+
+    def queue(self, model_key):
+        # created lazily so the slots belong to the running event loop
+        if model_key not in self.__queues:
+            self.__queues[model_key] = _ModelQueue(model_key)
+        return self.__queues[model_key]
+
+    def ticket(self, owner="anonymous"):
+        return AdmissionTicket(self, owner)
+
+    def reserve(self, ticket, units):
+        # check every model first so a request is either admitted for all of its stages or for none
+        for model_key, amount in units.items():
+            queue = self.queue(model_key)
+            backlog = queue.backlog_seconds(ticket.owner)
+
+            if len(queue.reserved) >= queue.concurrency + queue.max_queued:
+                self.__reject(model_key, 429, backlog / max(len(queue.reserved), 1), f"Too many requests queued for the {model_key} model")
+
+            if backlog > self.max_wait:
+                self.__reject(model_key, 503, backlog - self.max_wait, f"The {model_key} model is at capacity")
+
+        for model_key, amount in units.items():
+            queue = self.queue(model_key)
+            queue.reserved[id(ticket)] = queue.reserved.get(id(ticket), 0) + amount
+            queue.owners[id(ticket)] = ticket.owner
+            ticket.units[model_key] = ticket.units.get(model_key, 0) + amount
+            queue.publish()
+
+    def active_tickets(self, exclude=None):
+        # requests holding admitted but unfinished work on any model, optionally leaving one ticket out
+        return len({ticket_id for queue in self.__queues.values() for ticket_id in queue.reserved} - {id(exclude)})
+
+    def __reject(self, model_key, status_code, wait, message):
+        retry_after = min(max(math.ceil(wait), 1), 3600)
+        ADMISSION_REJECTIONS.labels(model_key, str(status_code)).inc()
+        logger.warning("request rejected by admission control", extra={"model_key": model_key, "status": status_code, "retry_after": retry_after})
+        raise AdmissionRejected(status_code, retry_after, f"{message}, retry in {retry_after} seconds")
+
+    def snapshot(self):
+        return {
+            model_key: {
+                "requests": len(queue.reserved),
+                "units": sum(queue.reserved.values()),
+                "backlog_seconds": round(queue.backlog_seconds(), 3),
+                "seconds_per_unit": round(queue.seconds_per_unit, 4),
+                "concurrency": queue.concurrency,
+                "max_queued": queue.max_queued,
+                "fair_queue": queue.slots.snapshot()
+            }
+            for model_key, queue in self.__queues.items()
+        }
+
+admission_controller = AdmissionController()
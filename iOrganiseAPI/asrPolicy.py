@@ -0,0 +1,108 @@
+import os
+import json
+import threading
+from collections import deque, namedtuple
+
+from admissionController import admission_controller
+from metrics import ASR_TIER_DECISIONS, ASR_LATENCY_SECONDS
+from utils import model_name
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# p95 seconds from choosing the ASR model for a request to its transcript, a request predicted to miss it is transcribed with a
+# faster model (0 always uses the model the user chose)
+ASR_LATENCY_TARGET = float(os.getenv("ASR_LATENCY_TARGET_SECONDS", "120"))
+# model -> the faster model used in its place, followed in turn until one is predicted to meet the target
+ASR_FALLBACKS = dict(
+    pair.strip().split(":") for pair in os.getenv("ASR_FALLBACKS", "medium:small").split(",") if pair.strip()
+)
+# "draft" re-transcribes stored files with the user's model once the node is idle, "downgrade" keeps the faster model's transcript
+ASR_TIERING = os.getenv("ASR_TIERING", "draft")
+# starting seconds of transcription per second of audio, they follow what every finished transcription took
+ASR_SECONDS_PER_AUDIO_SECOND = json.loads(os.getenv("ASR_SECONDS_PER_AUDIO_SECOND", '{"small": 0.1, "small_sg": 0.1, "medium": 0.3}'))
+# loading a model that isn't resident, paid before the first second of audio
+ASR_SWAP_SECONDS = float(os.getenv("ASR_SWAP_SECONDS", "10"))
+# weight of the newest observation in the seconds per audio second average
+ASR_SMOOTHING = 0.2
+# latencies kept for the observed p95
+ASR_LATENCY_WINDOW = 200
+
+Tier = namedtuple("Tier", ["requested", "model", "reason", "predicted_seconds"])
+
+def p95(values):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else None
+
+class AsrPolicy:
+    '''
+    The AsrPolicy class picks the ASR model a waiting request is transcribed with. It predicts the request's latency from the admitted
+    ASR work ahead of it, whether the model has to be loaded and the audio duration at each model's observed speed, and when the
+    user's model would miss the latency target it falls back to a faster one (ASR_FALLBACKS). Background work doesn't go through it.
+    '''
+
+    def __init__(self, target=ASR_LATENCY_TARGET, fallbacks=ASR_FALLBACKS, mode=ASR_TIERING, controller=admission_controller):
+        self.target = target
+        self.fallbacks = dict(fallbacks)
+        self.mode = mode
+        self.__controller = controller
+        self.__rates = dict(ASR_SECONDS_PER_AUDIO_SECOND)
+        self.__latencies = deque(maxlen=ASR_LATENCY_WINDOW)
+        self.__lock = threading.Lock()
+
+    @property
+    def upgrades_drafts(self):
+        return self.mode == "draft"
+
+    def rate(self, model):
+        return self.__rates.get(model, max(self.__rates.values()))
+
+    def predict(self, model, audio_seconds, wait_seconds, resident=None):
+        return wait_seconds + (0 if model == resident else ASR_SWAP_SECONDS) + audio_seconds * self.rate(model)
+
+    def choose(self, requested, audio_seconds, ticket, resident=None):
+        requested = model_name(requested)
+
+        # the admitted ASR work that fair sharing runs ahead of this request
+        wait = self.__controller.queue("ASR").backlog_seconds(ticket.owner, exclude=ticket)
+
+        model, reason = requested, "requested"
+        predicted = self.predict(model, audio_seconds, wait, resident)
+        if self.target > 0:
+            seen = {model}
+            while predicted > self.target and self.fallbacks.get(model) not in (None, *seen):
+                model = self.fallbacks[model]
+                seen.add(model)
+                predicted, reason = self.predict(model, audio_seconds, wait, resident), "latency_target"
+
+        ASR_TIER_DECISIONS.labels(requested, model).inc()
+        if model != requested:
+            logger.info("asr model downgraded", extra={"requested": requested, "model": model, "audio_seconds": round(audio_seconds, 1), "wait_seconds": round(wait, 1), "predicted_seconds": round(predicted, 1)})
+        return Tier(requested, model, reason, predicted)
+
+    def observe(self, tier, audio_seconds, transcribe_seconds, latency=None):
+        with self.__lock:
+            if audio_seconds > 0:
+                rate = self.rate(tier.model)
+                self.__rates[tier.model] = rate + ASR_SMOOTHING * (transcribe_seconds / audio_seconds - rate)
+            if latency is not None:
+                self.__latencies.append(latency)
+
+        if latency is not None:
+            ASR_LATENCY_SECONDS.labels(tier.model).observe(latency)
+
+    def snapshot(self):
+        with self.__lock:
+            latencies = list(self.__latencies)
+            rates = {model: round(rate, 4) for model, rate in self.__rates.items()}
+
+        return {
+            "target_seconds": self.target,
+            "p95_seconds": p95(latencies),
+            "requests": len(latencies),
+            "mode": self.mode,
+            "fallbacks": self.fallbacks,
+            "seconds_per_audio_second": rates
+        }
+
+asr_policy = AsrPolicy()
@@ -0,0 +1,101 @@
+import os
+import time
+import asyncio
+import argparse
+
+from fastapi.concurrency import run_in_threadpool
+
+from database import create_tables, db_get_after, db_get_by_attribute
+from model.User import User
+from model.FileUpload import FileUpload
+from model.UserSetting import UserSetting
+from derivedArtefacts import content_producer, get_artefacts, hash_file, stale_stages
+from admissionController import admission_controller
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+async def _no_wait():
+    pass
+
+async def backfill(after_id=0, batch=50, email=None, dry_run=False):
+    '''
+    Walks the library in id order and brings the derived artefacts of every file up to date with its owner's settings, redoing only
+    the stages whose producer or input changed. Files that are already current cost a hash of the upload. Progress is logged with the
+    last file id, which --after-id resumes from.
+    '''
+    # the app holds the models and the derivation pipeline
+    from main import derive_file, adoptable, adopt_artefacts
+
+    await create_tables()
+
+    filters = {}
+    if email:
+        user = next(iter(await db_get_by_attribute(User, "email", email) or []), None)
+        if user is None:
+            raise SystemExit(f"No user with email {email}")
+        filters["user_id"] = user.id
+
+    settings = {}
+    totals = {"files": 0, "current": 0, "stale": 0, "derived": 0, "failed": 0}
+    start = time.perf_counter()
+
+    while True:
+        files = await db_get_after(FileUpload, after_id, batch, **filters)
+        if not files:
+            break
+
+        for file in files:
+            after_id = file.id
+            totals["files"] += 1
+
+            if file.user_id not in settings:
+                settings[file.user_id] = next(iter(await db_get_by_attribute(UserSetting, "user_id", file.user_id) or []), None)
+            user_setting = settings[file.user_id]
+
+            producer = content_producer(file.path, user_setting.asr_model) if user_setting and os.path.exists(file.path) else None
+            if producer is None:
+                continue
+
+            # legacy files are adopted rather than re-derived, a dry run plans from what adopting them would record
+            artefacts = await get_artefacts(file.id)
+            if adoptable(file, artefacts):
+                artefacts = await adopt_artefacts(file, user_setting, record=not dry_run)
+
+            stages = stale_stages(artefacts, producer, await run_in_threadpool(hash_file, file.path), user_setting.llm)
+            if not stages:
+                totals["current"] += 1
+                continue
+
+            totals["stale"] += 1
+            logger.info("backfilling file", extra={"file_id": file.id, "file_name": file.name, "stages": stages, "dry_run": dry_run})
+            if dry_run:
+                continue
+
+            ticket = admission_controller.ticket("background")
+            try:
+                await derive_file(file.id, ticket, _no_wait)
+                totals["derived"] += 1
+            except Exception as e:
+                totals["failed"] += 1
+                logger.error("backfill failed", extra={"file_id": file.id, "error": str(e)})
+            finally:
+                ticket.release()
+
+        logger.info("backfill progress", extra={"after_id": after_id, "seconds": round(time.perf_counter() - start, 1), **totals})
+
+    return totals
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bring the derived content, subjects and summaries of the library up to date.")
+    parser.add_argument("--after-id", type=int, default=0, help="resume after this file id")
+    parser.add_argument("--batch", type=int, default=50, help="files read from the database at a time")
+    parser.add_argument("--user", default=None, help="only walk the files of the user with this email")
+    parser.add_argument("--dry-run", action="store_true", help="report the stale stages of every file without deriving them")
+    args = parser.parse_args(argv)
+
+    totals = asyncio.run(backfill(after_id=args.after_id, batch=args.batch, email=args.user, dry_run=args.dry_run))
+    print(totals)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.harness import summarise
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# simulated round trip of the OCR service
+OCR_SECONDS = 0
+
+class _OcrHandler(BaseHTTPRequestHandler):
+    # answers like the Hugging Face OCR space so that image uploads stay offline
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(OCR_SECONDS)
+        body = json.dumps({"prediction": "handwritten notes about vectors and matrices"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def configure_environment(work_dir):
+    '''
+    Points the API at throwaway SQLite/file storage and a local OCR stand-in. Must run before main is imported.
+    '''
+    ocr_port = _free_port()
+    ocr_server = ThreadingHTTPServer(("127.0.0.1", ocr_port), _OcrHandler)
+    threading.Thread(target=ocr_server.serve_forever, daemon=True).start()
+
+    os.makedirs(os.path.join(work_dir, "file_storage"), exist_ok=True)
+    os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(work_dir, 'bench.db')}")
+    os.environ["FILE_STORAGE_PATH"] = os.path.join(work_dir, "file_storage")
+    os.environ["OCR_URL"] = f"http://127.0.0.1:{ocr_port}/predict/"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+    return ocr_server
+
+class ApiServer:
+    def __init__(self, app):
+        import uvicorn
+
+        self.port = _free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return f"http://127.0.0.1:{self.port}"
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+async def _timed(latencies, errors, endpoint, request):
+    start = time.perf_counter()
+    try:
+        response = await request
+        if response.status_code >= 400:
+            errors[endpoint] = errors.get(endpoint, 0) + 1
+    except Exception:
+        errors[endpoint] = errors.get(endpoint, 0) + 1
+    latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+
+async def _user_session(client, index, contents, fixtures, iterations, latencies, errors):
+    email = f"bench{index}@example.com"
+    await client.post("/register", json={"name": f"bench{index}", "email": email, "password": "benchmark"})
+    login = await client.post("/login", data={"username": email, "password": "benchmark"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    def upload(kinds, prefix):
+        return [("files", (f"{prefix}_{os.path.basename(fixtures[kind])}", contents[kind])) for kind in kinds]
+
+    for iteration in range(iterations):
+        await _timed(latencies, errors, "/login", client.post("/login", data={"username": email, "password": "benchmark"}))
+        await _timed(latencies, errors, "/upload-files", client.post("/upload-files", files=upload(["pdf", "txt"], f"u{iteration}"), headers=headers))
+        await _timed(latencies, errors, "/smart-upload", client.post("/smart-upload", files=upload(["pdf", "docx", "wav", "png"], f"s{iteration}"), headers=headers))
+        await _timed(latencies, errors, "/get-files", client.get("/get-files", headers=headers))
+
+        files = (await client.get("/get-files", headers=headers)).json()["files"]
+        if files:
+            await _timed(latencies, errors, "/view-extract/{id}", client.post(f"/view-extract/{files[-1]['id']}", headers=headers))
+
+        await _timed(latencies, errors, "/predict-text", client.post("/predict-text", data={"text": "the derivative of a polynomial"}))
+
+async def _load_test(base_url, fixtures, users, iterations):
+    import httpx
+
+    latencies, errors = {}, {}
+    contents = {}
+    for kind, path in fixtures.items():
+        with open(path, "rb") as fixture:
+            contents[kind] = fixture.read()
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(_user_session(client, i, contents, fixtures, iterations, latencies, errors) for i in range(users)))
+        elapsed = time.perf_counter() - start
+
+    return [
+        {
+            "name": f"http {endpoint}",
+            "seconds": summarise(samples),
+            "requests": len(samples),
+            "errors": errors.get(endpoint, 0),
+            "requests_per_second": len(samples) / elapsed
+        }
+        for endpoint, samples in sorted(latencies.items())
+    ] + [{"name": "http total", "wall_seconds": elapsed, "users": users, "iterations": iterations}]
+
+def run(fixtures, work_dir, users=4, iterations=3):
+    ocr_server = configure_environment(work_dir)
+
+    import main
+
+    try:
+        with ApiServer(main.app) as base_url:
+            results = asyncio.run(_load_test(base_url, fixtures, users, iterations))
+
+        # the query counts recorded by the metrics hooks give DB round trips per endpoint for free
+        from metrics import DB_QUERIES_PER_REQUEST
+        for metric in DB_QUERIES_PER_REQUEST.collect():
+            sums = {sample.labels["endpoint"]: sample.value for sample in metric.samples if sample.name.endswith("_sum")}
+            counts = {sample.labels["endpoint"]: sample.value for sample in metric.samples if sample.name.endswith("_count")}
+            for result in results:
+                endpoint = result["name"].replace("http ", "")
+                if counts.get(endpoint):
+                    result["db_queries_per_request"] = sums[endpoint] / counts[endpoint]
+
+        return results
+    finally:
+        ocr_server.shutdown()
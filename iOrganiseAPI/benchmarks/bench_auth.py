@@ -0,0 +1,74 @@
+import time
+import asyncio
+
+from benchmarks.harness import summarise
+from benchmarks.bench_api import configure_environment, ApiServer
+
+async def _login_storm(base_url, users, seconds):
+    import httpx
+
+    logins, reads = [], []
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        login = await client.post("/login", data={"username": "reader@bench.local", "password": "benchmark"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        deadline = time.perf_counter() + seconds
+
+        async def storm(index):
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.post("/login", data={"username": f"storm{index}@bench.local", "password": "benchmark"})
+                logins.append(time.perf_counter() - start)
+
+        # a user who is already logged in keeps browsing their files throughout
+        async def reader():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get("/get-files", headers=headers)
+                reads.append(time.perf_counter() - start)
+
+        await asyncio.gather(reader(), *(storm(i) for i in range(users)))
+
+    return logins, reads
+
+async def _register(base_url, users):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        for email in ["reader@bench.local"] + [f"storm{i}@bench.local" for i in range(users)]:
+            await client.post("/register", json={"name": email.split("@")[0], "email": email, "password": "benchmark"})
+
+def run(fixtures, work_dir, users=8, seconds=5):
+    '''
+    Sends a storm of logins from `users` clients for `seconds` while another, logged in, client keeps listing its files. Runs once
+    with bcrypt on the event loop and JWTs decoded on every request, as before, and once with bcrypt on its worker pool and the
+    verified token cache. Reports login throughput and the latency of the other client's requests.
+    '''
+    ocr_server = configure_environment(work_dir)
+
+    import main
+    import utils
+
+    auth_pool, cache_size = utils.auth_pool, utils.TOKEN_CACHE_SIZE
+    results = []
+    try:
+        with ApiServer(main.app) as base_url:
+            asyncio.run(_register(base_url, users))
+
+            for name, pool, cache in (("bcrypt on the event loop", None, 0), ("bcrypt worker pool and token cache", auth_pool, cache_size)):
+                utils.auth_pool, utils.TOKEN_CACHE_SIZE = pool, cache
+                logins, reads = asyncio.run(_login_storm(base_url, users, seconds))
+                results.append({
+                    "name": name,
+                    "bcrypt_rounds": utils.BCRYPT_ROUNDS,
+                    "auth_workers": utils.AUTH_WORKERS if pool else 0,
+                    "logins_per_second": len(logins) / seconds,
+                    "login_seconds": summarise(logins),
+                    "seconds": summarise(reads),
+                    "other_requests": len(reads)
+                })
+
+        return results
+    finally:
+        utils.auth_pool, utils.TOKEN_CACHE_SIZE = auth_pool, cache_size
+        ocr_server.shutdown()
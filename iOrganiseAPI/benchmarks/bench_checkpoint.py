@@ -0,0 +1,79 @@
+import os
+import json
+import time
+import signal
+import functools
+import multiprocessing
+
+from benchmarks.fixtures import make_wav
+
+def _transcribe(path, interval, done):
+    import checkpoint
+    import manager.fasterwhisperManager as fasterwhisper
+    from modelLoader import ModelLoader
+
+    fasterwhisper.Checkpoint = functools.partial(checkpoint.Checkpoint, interval=interval)
+    manager = ModelLoader().load_asr("small", "cpu", 16, "int8")
+
+    start = time.perf_counter()
+    manager.transcribe(path)
+    done.value = time.perf_counter() - start
+
+def _worker(path, interval):
+    context = multiprocessing.get_context("fork")
+    done = context.Value("d", -1)
+    process = context.Process(target=_transcribe, args=(path, interval, done))
+    process.start()
+    return process, done
+
+def _resumable_seconds(directory):
+    # how far into the recording the journal left by the killed worker reaches
+    resumable = 0.0
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        with open(os.path.join(directory, name)) as journal:
+            for line in journal:
+                record = json.loads(line)
+                resumable = max(resumable, record.get("offset", record.get("end", 0.0)))
+    return resumable
+
+def run(work_dir, seconds=600, rate=100, kill_fraction=0.6, interval=1.0, real_models=False):
+    '''
+    Transcribes a `seconds` long recording in a worker process and kills it with SIGKILL `kill_fraction` of the way through, then
+    transcribes it again in a fresh worker, which picks up the killed worker's checkpoint. Runs once with a checkpoint written every
+    `interval` seconds and once without checkpoints. Reports how much audio the second worker had to redo and how long it took.
+    '''
+    import checkpoint
+
+    path = make_wav(os.path.join(work_dir, "long_lecture.wav"), seconds=seconds)
+    if not real_models:
+        from benchmarks import stubs
+        stubs.STUB_COSTS["asr_audio_seconds_per_second"] = rate
+
+    checkpoint_dir = checkpoint.CHECKPOINT_DIR
+    results = []
+    try:
+        for name, every in (("no checkpoints", 0), (f"checkpoint every {interval:g}s", interval)):
+            checkpoint.CHECKPOINT_DIR = os.path.join(work_dir, "checkpoints_" + str(every))
+
+            # timed from the start of the worker, so model load and decoding count towards the point it is killed at
+            process, _ = _worker(path, every)
+            time.sleep(kill_fraction * seconds / rate)
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+            done_before_kill = min(seconds, kill_fraction * seconds)
+            resumable = _resumable_seconds(checkpoint.CHECKPOINT_DIR)
+
+            process, done = _worker(path, every)
+            process.join()
+            results.append({
+                "name": name,
+                "audio_seconds": seconds,
+                "done_before_kill_seconds": done_before_kill,
+                "recovered_seconds": resumable,
+                "redone_seconds": done_before_kill - resumable,
+                "rerun_seconds": done.value
+            })
+
+        return results
+    finally:
+        checkpoint.CHECKPOINT_DIR = checkpoint_dir
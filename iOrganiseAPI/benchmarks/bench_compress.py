@@ -0,0 +1,72 @@
+import time
+
+from benchmarks.harness import measure, summarise
+
+def _prompt_tokens():
+    from metrics import LLM_TOKENS
+
+    return sum(sample.value for metric in LLM_TOKENS.collect() for sample in metric.samples
+               if sample.name.endswith("_total") and sample.labels.get("kind") == "prompt")
+
+def _variants(text, count):
+    # llama.cpp reuses the KV cache of a repeated prompt, so every timed summary gets the lines of the document in another rotation
+    lines = text.splitlines()
+    return ["\n".join(lines[i:] + lines[:i]) for i in range(0, len(lines), max(1, len(lines) // count))][:count]
+
+def run(fixtures, repeat=3, budgets=(1024, 2048), model="mistral_7b", real_models=False):
+    '''
+    Compresses the sample transcript and notes to each token budget, reporting the token reduction and the cost of compressing,
+    then summarises them with and without compression to show the end to end speedup.
+    '''
+    import promptCompressor
+    from manager.llamacppManager import LlamaCppManager
+    from utils import extract_text_from_txt
+
+    if not real_models:
+        # prompt evaluation only costs time once the stand-in llm has a token rate
+        from benchmarks import stubs
+        stubs.STUB_COSTS["llm_tokens_per_second"] = stubs.STUB_COSTS["llm_tokens_per_second"] or 200
+
+    documents = {name: extract_text_from_txt(fixtures[name]) for name in ("transcript", "txt")}
+
+    results = []
+    for name, text in documents.items():
+        for budget in budgets:
+            compressed = promptCompressor.compress(text, budget)
+            result = measure(f"compress {name} to {budget} tokens", lambda: promptCompressor.compress(text, budget), repeat=repeat)
+            result.update({
+                "units": len(promptCompressor.split_units(text)),
+                "kept_units": len(promptCompressor.split_units(compressed)),
+                "estimated_tokens": promptCompressor.estimate_tokens(text),
+                "compressed_tokens": promptCompressor.estimate_tokens(compressed),
+                "token_reduction": 1 - promptCompressor.estimate_tokens(compressed) / promptCompressor.estimate_tokens(text)
+            })
+            results.append(result)
+
+    manager = LlamaCppManager(model, "cpu")
+    try:
+        for name, text in documents.items():
+            baseline = None
+            for budget in (0,) + tuple(budgets):
+                promptCompressor.LLM_PROMPT_TOKEN_BUDGET = budget
+                tokens_before = _prompt_tokens()
+
+                latencies = []
+                for variant in _variants(text, repeat):
+                    start = time.perf_counter()
+                    manager.generate_summary(variant)
+                    latencies.append(time.perf_counter() - start)
+
+                seconds = summarise(latencies)
+                baseline = baseline or seconds["p50"]
+                results.append({
+                    "name": f"summarise {name}" + (f" compressed to {budget} tokens" if budget else " uncompressed"),
+                    "token_budget": budget,
+                    "seconds": seconds,
+                    "prompt_tokens": (_prompt_tokens() - tokens_before) / repeat,
+                    "speedup": baseline / seconds["p50"]
+                })
+    finally:
+        promptCompressor.LLM_PROMPT_TOKEN_BUDGET = 0
+
+    return results
@@ -0,0 +1,69 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def _timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return time.perf_counter() - start
+
+def run(fixtures, repeat=3, real_models=False):
+    '''
+    Transcribes the wav fixture and summarises the sample transcript at the same time, the way a smart-upload batch overlaps its ASR
+    and summarise stages. Runs once with every engine sized to the whole machine and once with the cores partitioned between the
+    engines by cpuManager.py. With the stubs, inference costs are burnt on each engine's threads instead of slept away.
+    '''
+    from modelLoader import ModelLoader
+    from cpuManager import cpu_manager, available_cores
+    from utils import extract_text_from_txt
+    from benchmarks import stubs
+
+    costs = dict(stubs.STUB_COSTS)
+    if not real_models:
+        # 30 s of audio and a summary both cost about a second of single core work
+        stubs.STUB_COSTS.update({"cpu_bound": True, "asr_audio_seconds_per_second": 30, "llm_tokens_per_second": 100})
+
+    transcript = extract_text_from_txt(fixtures["txt"])
+    enabled = cpu_manager.enabled
+    results = []
+    try:
+        for partitioned in (False, True):
+            cpu_manager.enabled = partitioned
+            model_loader = ModelLoader()
+            asr = model_loader.acquire_asr("small", "cpu", 16, "int8")
+            llm = model_loader.acquire_llm("mistral_7b", "cpu")
+            budgets = cpu_manager.snapshot()["budgets"]
+
+            try:
+                # the first summary also evaluates the cached prompt prefix
+                llm.generate_summary(transcript)
+
+                # each engine alone first, then both at once
+                alone = {"asr": _timed(lambda: asr.transcribe(fixtures["wav"]), repeat), "llm": _timed(lambda: llm.generate_summary(transcript), repeat)}
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(2) as pool:
+                    asr_run = pool.submit(_timed, lambda: asr.transcribe(fixtures["wav"]), repeat)
+                    llm_run = pool.submit(_timed, lambda: llm.generate_summary(transcript), repeat)
+                    together = {"asr": asr_run.result(), "llm": llm_run.result()}
+                makespan = time.perf_counter() - start
+            finally:
+                model_loader.release("ASR")
+                model_loader.release("LLM")
+                model_loader.del_all_models()
+
+            results.append({
+                "name": "partitioned cores" if partitioned else "every engine on all cores",
+                "cores": len(available_cores()),
+                "threads": {model_key: budget["threads"] for model_key, budget in budgets.items()},
+                "alone_seconds": alone,
+                "together_seconds": together,
+                "makespan_seconds": makespan,
+                "jobs_per_second": 2 * repeat / makespan
+            })
+
+        results[1]["speedup"] = results[0]["makespan_seconds"] / results[1]["makespan_seconds"]
+        return results
+    finally:
+        cpu_manager.enabled = enabled
+        stubs.STUB_COSTS.update(costs)
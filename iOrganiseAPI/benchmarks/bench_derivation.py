@@ -0,0 +1,76 @@
+import os
+import time
+import asyncio
+
+from benchmarks.harness import summarise
+from benchmarks.bench_api import configure_environment, ApiServer
+
+KINDS = ("pdf", "docx", "wav")
+
+async def _upload_and_view(base_url, fixtures, prefix, scheduler, drain):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        email = f"{prefix}@example.com"
+        await client.post("/register", json={"name": prefix, "email": email, "password": "benchmark"})
+        login = await client.post("/login", data={"username": email, "password": "benchmark"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        files = []
+        for kind in KINDS:
+            with open(fixtures[kind], "rb") as fixture:
+                files.append(("files", (f"{prefix}_{os.path.basename(fixtures[kind])}", fixture.read())))
+        await client.post("/upload-files", files=files, headers=headers)
+
+        # the user comes back once the background work has drained, or straight away
+        start = time.perf_counter()
+        while drain:
+            snapshot = scheduler.snapshot()
+            if not snapshot["pending"] and not snapshot["running"]:
+                break
+            await asyncio.sleep(0.1)
+        background = time.perf_counter() - start
+
+        latencies = []
+        for file in (await client.get("/get-files", headers=headers)).json()["files"]:
+            start = time.perf_counter()
+            await client.post(f"/view-extract/{file['id']}", headers=headers)
+            latencies.append(time.perf_counter() - start)
+
+        return latencies, background
+
+def run(fixtures, work_dir, real_models=False):
+    '''
+    Uploads a PDF, a DOCX and a recording through /upload-files and opens each of them with /view-extract, first straight away (the
+    files are derived while the user waits) and then after the idle-time scheduler has derived them in the background.
+    '''
+    ocr_server = configure_environment(work_dir)
+
+    import main
+
+    if not real_models:
+        # summaries only cost time once the stand-in llm has a token rate
+        from benchmarks import stubs
+        stubs.STUB_COSTS["llm_tokens_per_second"] = stubs.STUB_COSTS["llm_tokens_per_second"] or 200
+
+    scheduler = main.derivation_scheduler
+    idle_seconds = scheduler.idle_seconds
+    results = []
+    try:
+        with ApiServer(main.app) as base_url:
+            for name, drain in (("on first view", False), ("after background derivation", True)):
+                # an idle period that never comes keeps the scheduler out of the way of the first run
+                scheduler.idle_seconds = 0.5 if drain else 3600
+                latencies, background = asyncio.run(_upload_and_view(base_url, fixtures, "derive" + str(drain).lower(), scheduler, drain))
+                results.append({
+                    "name": f"view-extract {name}",
+                    "seconds": summarise(latencies),
+                    "files": len(latencies),
+                    "background_seconds": background
+                })
+
+        results[1]["speedup"] = results[0]["seconds"]["p50"] / results[1]["seconds"]["p50"]
+        return results
+    finally:
+        scheduler.idle_seconds = idle_seconds
+        ocr_server.shutdown()
@@ -0,0 +1,89 @@
+import os
+import resource
+import multiprocessing
+
+import fitz
+
+from benchmarks.harness import measure
+from benchmarks.fixtures import make_docx
+
+# words on a page of the synthetic documents, used to report their length in pages
+WORDS_PER_PAGE = 500
+
+def extract_text_from_docx_dom(docx_path: str) -> str:
+    # the python-docx extractor that extract_text_from_docx replaced, kept to benchmark against
+    from docx import Document
+
+    doc = Document(docx_path)
+    text = []
+
+    for section in doc.sections:
+        if section.header:
+            for para in section.header.paragraphs:
+                text.append(para.text)
+
+    for para in doc.paragraphs:
+        text.append(para.text)
+
+    for table in doc.tables:
+        for row in table.rows:
+            row_text = [cell.text.strip() for cell in row.cells]
+            if any(row_text):
+                text.append(" | ".join(row_text))
+
+    for section in doc.sections:
+        if section.footer:
+            for para in section.footer.paragraphs:
+                text.append(para.text)
+
+    return "\n".join(filter(None, text))
+
+def _peak_rss_growth(extractor, path, result):
+    # run in a fresh process so that one extractor's peak doesn't hide the other's, ru_maxrss is in KiB on linux
+    from utils import extract_text_from_docx
+
+    fn = extract_text_from_docx_dom if extractor == "dom" else extract_text_from_docx
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    fn(path)
+    result.value = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * 1024
+
+def peak_rss_growth(extractor, path):
+    context = multiprocessing.get_context("fork")
+    result = context.Value("d", 0)
+    process = context.Process(target=_peak_rss_growth, args=(extractor, path, result))
+    process.start()
+    process.join()
+    return result.value
+
+def run(fixtures, repeat=5, scale=1):
+    # imported lazily so that stubs can be installed before utils pulls in torch/tensorflow
+    from utils import get_file_type, extract_text_from_pdf, extract_text_from_docx, extract_text_from_txt
+
+    with fitz.open(fixtures["pdf"]) as doc:
+        pdf_pages = doc.page_count
+
+    results = [
+        measure("get_file_type", lambda: [get_file_type(path) for path in fixtures.values()], repeat=repeat, units=len(fixtures), unit="files"),
+        measure("extract_text_from_pdf", lambda: extract_text_from_pdf(fixtures["pdf"]), repeat=repeat, units=pdf_pages, unit="pages"),
+        measure("extract_text_from_docx", lambda: extract_text_from_docx(fixtures["docx"]), repeat=repeat, unit="documents"),
+        measure("extract_text_from_txt", lambda: extract_text_from_txt(fixtures["txt"]), repeat=repeat, unit="documents")
+    ]
+
+    for result, text in zip(results[1:], (extract_text_from_pdf(fixtures["pdf"]), extract_text_from_docx(fixtures["docx"]), extract_text_from_txt(fixtures["txt"]))):
+        result["output_chars"] = len(text)
+
+    # a long, table heavy document: python-docx against the streaming reader, and the streaming reader stopping at the budget
+    # /predict-text uses
+    path = make_docx(os.path.join(os.path.dirname(fixtures["docx"]), "long_notes.docx"), paragraphs=1000 * scale, tables=50 * scale)
+    pages = max(1, len(extract_text_from_docx(path).split()) // WORDS_PER_PAGE)
+    for name, extractor in (("docx python-docx", extract_text_from_docx_dom), ("docx streaming", extract_text_from_docx)):
+        result = measure(name, lambda: extractor(path), repeat=repeat, units=pages, unit="pages")
+        result["output_chars"] = len(extractor(path))
+        result["peak_rss_growth_bytes"] = peak_rss_growth("dom" if extractor is extract_text_from_docx_dom else "streaming", path)
+        results.append(result)
+
+    result = measure("docx streaming, 1024 token budget", lambda: extract_text_from_docx(path, 1024), repeat=repeat, units=pages, unit="pages")
+    result["output_chars"] = len(extract_text_from_docx(path, 1024))
+    results.append(result)
+
+    return results
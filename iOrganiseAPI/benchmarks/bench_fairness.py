@@ -0,0 +1,139 @@
+import time
+import asyncio
+
+from benchmarks.harness import summarise
+from benchmarks.bench_api import configure_environment, ApiServer
+
+async def _login(client, name):
+    email = f"{name}@bench.local"
+    await client.post("/register", json={"name": name, "email": email, "password": "benchmark"})
+    login = await client.post("/login", data={"username": email, "password": "benchmark"})
+    return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+async def _contend(base_url, fixtures, run_name, batches, batch_files):
+    import httpx
+
+    with open(fixtures["wav"], "rb") as fixture:
+        audio = fixture.read()
+    with open(fixtures["pdf"], "rb") as fixture:
+        pdf = fixture.read()
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=3600) as client:
+        heavy, light = await _login(client, f"heavy_{run_name}"), await _login(client, f"light_{run_name}")
+
+        # one user drops several batches of recordings into /smart-upload at once
+        async def batch(index):
+            files = [("files", (f"{run_name}_{index}_{i}.wav", audio, "audio/wav")) for i in range(batch_files)]
+            await client.post("/smart-upload", files=files, headers=heavy)
+
+        start = time.perf_counter()
+        batches_task = asyncio.gather(*(batch(i) for i in range(batches)))
+        await asyncio.sleep(0.5)
+
+        # meanwhile another user classifies some text and uploads a single pdf, one request after the other
+        predicts, uploads, rejected, i = [], [], 0, 0
+        while not batches_task.done():
+            request_start = time.perf_counter()
+            await client.post("/predict-text", data={"text": "vectors matrices and derivatives"})
+            predicts.append(time.perf_counter() - request_start)
+
+            request_start = time.perf_counter()
+            response = await client.post("/smart-upload", files=[("files", (f"{run_name}_light_{i}.pdf", pdf, "application/pdf"))], headers=light)
+            if response.status_code >= 400:
+                rejected += 1
+            else:
+                uploads.append(time.perf_counter() - request_start)
+            i += 1
+
+        await batches_task
+        return predicts, uploads, rejected, time.perf_counter() - start
+
+def _asr_loads():
+    from prometheus_client import REGISTRY
+
+    return sum(
+        sample.value for metric in REGISTRY.collect() if metric.name == "iorganise_model_load_seconds"
+        for sample in metric.samples if sample.name.endswith("_count") and sample.labels.get("model_key") == "ASR"
+    )
+
+async def _mixed_models(base_url, fixtures, run_name, batch_files):
+    import httpx
+
+    with open(fixtures["wav"], "rb") as fixture:
+        audio = fixture.read()
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=3600) as client:
+        # two users with different ASR models each upload a batch of recordings at the same time
+        async def batch(asr_model):
+            name = f"{asr_model}_{run_name}"
+            headers = await _login(client, name)
+            setting = (await client.get("/get-setting", headers=headers)).json()["setting"]
+            await client.put(f"/update-setting/{setting['id']}", headers=headers, json={
+                "name": name, "email": f"{name}@bench.local", "password": "benchmark", "asr_model": asr_model, "llm": setting["llm"]
+            })
+            files = [("files", (f"{name}_{i}.wav", audio, "audio/wav")) for i in range(batch_files)]
+            await client.post("/smart-upload", files=files, headers=headers)
+
+        start = time.perf_counter()
+        await asyncio.gather(batch("small"), batch("medium"))
+        return time.perf_counter() - start
+
+def run(fixtures, work_dir, batches=3, batch_files=4, real_models=False):
+    '''
+    One user sends `batches` concurrent /smart-upload requests of `batch_files` recordings each while another keeps calling
+    /predict-text and uploading a single PDF through /smart-upload. Runs once with every request sharing one FIFO per model, and once
+    with the model slots shared fairly between users. Reports the second user's latencies and how long the batches took.
+    Then two users whose settings pick different ASR models upload a batch each at the same time, with the slot handed over file by
+    file and in model turns, and reports how many times an ASR model was loaded and how long the batches took.
+    '''
+    ocr_server = configure_environment(work_dir)
+
+    import main
+    from asrPolicy import asr_policy
+    from admissionController import admission_controller
+
+    if not real_models:
+        # a 30 second recording transcribes in a second and a summary takes about as long
+        from benchmarks import stubs
+        stubs.STUB_COSTS["asr_audio_seconds_per_second"] = stubs.STUB_COSTS["asr_audio_seconds_per_second"] or 30
+        stubs.STUB_COSTS["llm_tokens_per_second"] = stubs.STUB_COSTS["llm_tokens_per_second"] or 200
+        stubs.STUB_COSTS["bert_seconds"] = stubs.STUB_COSTS["bert_seconds"] or 0.05
+
+    from benchmarks import stubs
+
+    load_seconds = stubs.STUB_COSTS["model_load_seconds"]
+    ticket_owner = main.ticket_owner
+    slots = admission_controller.queue("ASR").slots
+    model_turn, target = slots.model_turn, asr_policy.target
+    results = []
+    try:
+        with ApiServer(main.app) as base_url:
+            for name, owner in (("fifo", lambda request: "shared"), ("fair share", ticket_owner)):
+                main.ticket_owner = owner
+                predicts, uploads, rejected, makespan = asyncio.run(_contend(base_url, fixtures, name.replace(" ", "_"), batches, batch_files))
+                results.append({
+                    "name": name,
+                    "predict_text_seconds": summarise(predicts),
+                    "single_upload_seconds": summarise(uploads),
+                    "single_uploads_rejected": rejected,
+                    "batch_makespan_seconds": makespan,
+                    "batch_files": batches * batch_files
+                })
+
+            # every user is transcribed with their own model, the latency target would move them all onto the fastest one
+            main.ticket_owner, asr_policy.target = ticket_owner, 0
+            if not real_models:
+                # swapping models only costs something when loading one does, whisper takes a couple of seconds
+                stubs.STUB_COSTS["model_load_seconds"] = load_seconds or 2
+            for name, turn in (("mixed models, file by file", 0), ("mixed models, model turns", model_turn)):
+                slots.model_turn = turn
+                loads = _asr_loads()
+                makespan = asyncio.run(_mixed_models(base_url, fixtures, name.split(", ")[1].replace(" ", "_"), batch_files))
+                results.append({"name": name, "asr_loads": _asr_loads() - loads, "batch_makespan_seconds": makespan, "batch_files": 2 * batch_files})
+
+        return results
+    finally:
+        main.ticket_owner = ticket_owner
+        slots.model_turn, asr_policy.target = model_turn, target
+        stubs.STUB_COSTS["model_load_seconds"] = load_seconds
+        ocr_server.shutdown()
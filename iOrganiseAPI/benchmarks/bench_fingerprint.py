@@ -0,0 +1,126 @@
+import os
+import time
+import wave
+
+from benchmarks.harness import measure, summarise
+
+SAMPLE_RATE = 16000
+
+def _write(path, samples):
+    import numpy as np
+
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes((np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes())
+    return path
+
+def _other_speech(seconds, seed):
+    import numpy as np
+
+    # harmonic bursts like the wav fixture, drawn from another seed so they share nothing with it
+    rng = np.random.default_rng(seed)
+    parts, total = [], int(seconds * SAMPLE_RATE)
+    while sum(len(part) for part in parts) < total:
+        t = np.arange(int(rng.uniform(0.3, 1.5) * SAMPLE_RATE)) / SAMPLE_RATE
+        pitch = rng.uniform(110, 220)
+        envelope = 0.5 * (1 - np.cos(2 * np.pi * t / t[-1]))
+        parts.append(sum(np.sin(2 * np.pi * pitch * k * t) / k for k in (1, 2, 3)) * envelope * 0.25)
+    return np.concatenate(parts)[:total]
+
+def _variants(fixtures, work_dir):
+    import numpy as np
+    from faster_whisper import decode_audio
+
+    directory = os.path.join(work_dir, "fingerprint")
+    os.makedirs(directory, exist_ok=True)
+
+    audio = decode_audio(fixtures["wav"], sampling_rate=SAMPLE_RATE)
+    seconds = len(audio) / SAMPLE_RATE
+    rng = np.random.default_rng(0)
+
+    return {
+        # the same lecture uploaded again
+        "identical copy": fixtures["wav"],
+        # the first and last 15% cut off
+        "trimmed copy": _write(os.path.join(directory, "trimmed.wav"), audio[int(0.15 * len(audio)):int(0.85 * len(audio))]),
+        # quieter and with background noise, like a second microphone
+        "noisy copy": _write(os.path.join(directory, "noisy.wav"), 0.6 * audio + rng.normal(0, 0.01, len(audio))),
+        # the lecture with a third as much new material after it
+        "extended copy": _write(os.path.join(directory, "extended.wav"), np.concatenate([audio, _other_speech(seconds / 3, 1)])),
+        # a different recording altogether
+        "unrelated recording": _write(os.path.join(directory, "unrelated.wav"), _other_speech(seconds, 2)),
+        # the same lecture recorded by someone else on another phone
+        "another user's copy": _write(os.path.join(directory, "another.wav"), 0.8 * audio + rng.normal(0, 0.005, len(audio)))
+    }, seconds
+
+def run(fixtures, work_dir, repeat=3, real_models=False):
+    '''
+    Transcribes variants of the wav fixture after the original has been transcribed, with the fingerprint index and without it, and
+    reports how much of each variant's transcript was reused from the original.
+    '''
+    from prometheus_client import REGISTRY
+
+    from modelLoader import ModelLoader
+    from fingerprint import fingerprint, fingerprint_index
+    from faster_whisper import decode_audio
+    from benchmarks import stubs
+
+    costs = dict(stubs.STUB_COSTS)
+    if not real_models:
+        # transcription has to cost something for reuse to save anything, 30x real time
+        stubs.STUB_COSTS["asr_audio_seconds_per_second"] = stubs.STUB_COSTS["asr_audio_seconds_per_second"] or 30
+
+    enabled = fingerprint_index.enabled
+    model_loader = ModelLoader()
+    asr = model_loader.load_asr("small", "cpu", 16, "int8")
+    variants, seconds = _variants(fixtures, work_dir)
+
+    def counter(name):
+        return REGISTRY.get_sample_value(name, {"model": "small"}) or 0
+
+    def transcribe_full(path):
+        fingerprint_index.enabled = False
+        asr.transcribe(path, 2, 1)
+
+    try:
+        audio = decode_audio(fixtures["wav"], sampling_rate=SAMPLE_RATE)
+        results = [measure("fingerprint", lambda: fingerprint(audio, SAMPLE_RATE), repeat=repeat, units=seconds, unit="audio_seconds")]
+
+        for name, path in variants.items():
+            with wave.open(path, "rb") as wav:
+                audio_seconds = wav.getnframes() / wav.getframerate()
+
+            full = measure(f"{name} transcribed in full", lambda: transcribe_full(path), repeat=repeat, warmup=0, units=audio_seconds, unit="audio_seconds")
+
+            fingerprint_index.enabled = True
+            samples, reused, transcribed = [], 0, 0
+            for _ in range(repeat):
+                # every run starts from an index holding only the original, which is not timed
+                fingerprint_index.clear()
+                asr.transcribe(fixtures["wav"], 1, 1)
+
+                before = counter("iorganise_asr_reused_seconds_total"), counter("iorganise_asr_audio_seconds_total")
+                start = time.perf_counter()
+                asr.transcribe(path, 2, 2 if name == "another user's copy" else 1)
+                samples.append(time.perf_counter() - start)
+                reused += (counter("iorganise_asr_reused_seconds_total") - before[0]) / repeat
+                transcribed += (counter("iorganise_asr_audio_seconds_total") - before[1]) / repeat
+
+            results.append({
+                "name": f"{name} with fingerprints",
+                "audio_seconds": audio_seconds,
+                "reused_seconds": round(reused, 2),
+                "transcribed_seconds": round(transcribed, 2),
+                "seconds": summarise(samples),
+                "speedup": full["seconds"]["p50"] / summarise(samples)["p50"]
+            })
+            results.append(full)
+
+        return results
+    finally:
+        fingerprint_index.enabled = enabled
+        fingerprint_index.clear()
+        model_loader.del_models("ASR")
+        stubs.STUB_COSTS.update(costs)
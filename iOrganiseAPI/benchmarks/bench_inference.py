@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import subprocess
+import urllib.request
+
+import psutil
+
+from benchmarks.bench_api import configure_environment, _free_port, _load_test
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _wait_for(predicate, timeout, what):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if predicate():
+                return
+        except Exception:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Timed out waiting for {what}")
+
+def _status(socket_path):
+    from inferenceProtocol import send_message, recv_message
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        send_message(sock, {"id": "status", "op": "status", "args": {}})
+        return recv_message(sock)["result"]
+
+class InferenceDeployment:
+    '''
+    Runs inferenceServer.py and a multi-worker uvicorn API as separate processes on this machine, the way they are deployed on one host.
+    '''
+
+    def __init__(self, work_dir, workers=2, real_models=False):
+        self.socket_path = os.path.join(work_dir, "inference.sock")
+        self.workers = workers
+        self.real_models = real_models
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.server = None
+        self.api = None
+
+    def __enter__(self):
+        env = dict(os.environ, INFERENCE_SOCKET=self.socket_path)
+
+        server_args = [sys.executable, "-m", "benchmarks.inference_server", "--socket", self.socket_path]
+        self.server = subprocess.Popen(server_args + (["--real-models"] if self.real_models else []), cwd=API_DIR, env=env)
+        _wait_for(lambda: os.path.exists(self.socket_path), 120, "the inference server socket")
+
+        # create the schema once up front, otherwise every worker races to create it on startup
+        from database import create_tables, engine
+
+        async def prepare():
+            await create_tables()
+            await engine.dispose()
+        asyncio.run(prepare())
+
+        app = "main:app" if self.real_models else "benchmarks.stubbed_app:app"
+        self.api = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(self.port), "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=API_DIR, env=env
+        )
+        _wait_for(lambda: urllib.request.urlopen(f"{self.url}/get-device", timeout=1).status == 200, 120, "the API workers")
+
+        return self
+
+    def __exit__(self, *exc):
+        for process in (self.api, self.server):
+            if process and process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    def memory(self):
+        api = psutil.Process(self.api.pid)
+        return {
+            "inference_server_rss_bytes": psutil.Process(self.server.pid).memory_info().rss,
+            "api_worker_rss_bytes": [child.memory_info().rss for child in api.children(recursive=True)]
+        }
+
+    def status(self):
+        return _status(self.socket_path)
+
+def run(fixtures, work_dir, users=4, iterations=3, workers=2, real_models=False):
+    ocr_server = configure_environment(work_dir)
+
+    try:
+        with InferenceDeployment(work_dir, workers=workers, real_models=real_models) as deployment:
+            results = asyncio.run(_load_test(deployment.url, fixtures, users, iterations))
+            status = deployment.status()
+
+            results.append({
+                "name": "inference deployment",
+                "api_workers": workers,
+                **deployment.memory(),
+                "loaded_models": status["loaded_models"],
+                "served": status["served"]
+            })
+
+        return results
+    finally:
+        ocr_server.shutdown()
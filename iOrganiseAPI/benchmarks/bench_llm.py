@@ -0,0 +1,170 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.harness import summarise
+
+def _tokens(kind):
+    from metrics import LLM_TOKENS
+
+    return sum(sample.value for metric in LLM_TOKENS.collect() for sample in metric.samples
+               if sample.name.endswith("_total") and sample.labels.get("kind") == kind)
+
+def _completion_tokens():
+    return _tokens("completion")
+
+def _round(manager, transcripts):
+    latencies = []
+
+    def summarise_one(transcript):
+        start = time.perf_counter()
+        manager.generate_summary(transcript)
+        latencies.append(time.perf_counter() - start)
+
+    tokens_before = _completion_tokens()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(transcripts)) as pool:
+        list(pool.map(summarise_one, transcripts))
+    elapsed = time.perf_counter() - start
+
+    return elapsed, latencies, _completion_tokens() - tokens_before
+
+def run(fixtures, repeat=3, concurrency=(1, 4, 8), model="mistral_7b", real_models=False):
+    '''
+    Summarises 1, 4 and 8 transcripts at once with the single sequence engine and the batched engine, and reports aggregate
+    throughput and per summary latency for each. Then it streams summaries to measure the time to the first visible token, and
+    checks the effect of the prompt prefix cache on short documents.
+    '''
+    from manager.llamacppManager import LlamaCppManager
+    from manager.llamacppBatchManager import LlamaCppBatchManager
+    from utils import extract_text_from_txt
+
+    if not real_models:
+        # the stand-ins are infinitely fast by default, batching only shows once a decode step has a cost
+        from benchmarks import stubs
+        stubs.STUB_COSTS["llm_tokens_per_second"] = stubs.STUB_COSTS["llm_tokens_per_second"] or 200
+
+    text = extract_text_from_txt(fixtures["txt"])
+    words = text.split()
+    transcripts = [" ".join(words[i * 200:(i + 1) * 200]) or text for i in range(max(concurrency))]
+
+    engines = {
+        "single": lambda: LlamaCppManager(model, "cpu"),
+        "batched": lambda: LlamaCppBatchManager(model, "cpu", parallel=max(concurrency))
+    }
+
+    results = []
+    for engine, factory in engines.items():
+        manager = factory()
+        try:
+            manager.generate_summary(transcripts[0])     # warm up
+
+            for n in concurrency:
+                walls, latencies, tokens = [], [], 0
+                for _ in range(repeat):
+                    elapsed, round_latencies, round_tokens = _round(manager, transcripts[:n])
+                    walls.append(elapsed)
+                    latencies += round_latencies
+                    tokens += round_tokens
+
+                results.append({
+                    "name": f"llm {engine} x{n}",
+                    "engine": engine,
+                    "concurrency": n,
+                    "seconds": summarise(walls),
+                    "latency_seconds": summarise(latencies),
+                    "summaries_per_second": n * repeat / sum(walls),
+                    "tokens_per_second": tokens / sum(walls)
+                })
+        finally:
+            if hasattr(manager, "unload"):
+                manager.unload()
+
+    results += _streaming(transcripts, repeat, model, (1, max(concurrency)))
+    results += _prefix_cache(transcripts, repeat, model)
+    return results
+
+def _streaming(transcripts, repeat, model, concurrency):
+    '''
+    Streams summaries and reports the time to the first visible token next to the time to the whole summary.
+    '''
+    from manager.llamacppManager import LlamaCppManager
+    from manager.llamacppBatchManager import LlamaCppBatchManager
+
+    engines = {
+        "single": lambda: LlamaCppManager(model, "cpu"),
+        "batched": lambda: LlamaCppBatchManager(model, "cpu", parallel=max(concurrency))
+    }
+
+    results = []
+    for engine, factory in engines.items():
+        manager = factory()
+        try:
+            for n in concurrency:
+                first_tokens, latencies = [], []
+
+                def stream_one(transcript):
+                    start = time.perf_counter()
+                    for i, _ in enumerate(manager.stream_summary(transcript)):
+                        if i == 0:
+                            first_tokens.append(time.perf_counter() - start)
+                    latencies.append(time.perf_counter() - start)
+
+                for _ in range(repeat):
+                    with ThreadPoolExecutor(n) as pool:
+                        list(pool.map(stream_one, transcripts[:n]))
+
+                results.append({
+                    "name": f"llm {engine} streamed x{n}",
+                    "engine": engine,
+                    "concurrency": n,
+                    "first_visible_token_seconds": summarise(first_tokens),
+                    "latency_seconds": summarise(latencies)
+                })
+        finally:
+            if hasattr(manager, "unload"):
+                manager.unload()
+
+    return results
+
+def _prefix_cache(transcripts, repeat, model):
+    '''
+    Summarises short documents one at a time with and without reusing the KV state of the instruction prefix.
+    '''
+    from manager import llamacppManager, llamacppBatchManager
+
+    short = [" ".join(transcript.split()[:20]) for transcript in transcripts]
+    engines = {
+        "single": lambda: llamacppManager.LlamaCppManager(model, "cpu"),
+        "batched": lambda: llamacppBatchManager.LlamaCppBatchManager(model, "cpu", parallel=1)
+    }
+
+    results = []
+    for engine, factory in engines.items():
+        for cached in (False, True):
+            llamacppManager.LLM_PREFIX_CACHE = llamacppBatchManager.LLM_PREFIX_CACHE = cached
+            manager = factory()
+            try:
+                manager.generate_summary(short[0])     # warm up
+                prompt_before, cached_before = _tokens("prompt"), _tokens("prompt_cached")
+
+                latencies = []
+                for _ in range(repeat):
+                    for transcript in short:
+                        start = time.perf_counter()
+                        manager.generate_summary(transcript)
+                        latencies.append(time.perf_counter() - start)
+
+                prompt_tokens = _tokens("prompt") - prompt_before
+                results.append({
+                    "name": f"llm {engine} short documents, prefix cache {'on' if cached else 'off'}",
+                    "engine": engine,
+                    "prefix_cache": cached,
+                    "latency_seconds": summarise(latencies),
+                    "cached_prompt_fraction": (_tokens("prompt_cached") - cached_before) / prompt_tokens if prompt_tokens else 0
+                })
+            finally:
+                llamacppManager.LLM_PREFIX_CACHE = llamacppBatchManager.LLM_PREFIX_CACHE = True
+                if hasattr(manager, "unload"):
+                    manager.unload()
+
+    return results
@@ -0,0 +1,36 @@
+import wave
+
+from benchmarks.harness import measure
+from benchmarks.fixtures import sentences
+
+def run(fixtures, repeat=5):
+    from modelLoader import ModelLoader
+    from utils import extract_text_from_txt
+
+    with wave.open(fixtures["wav"], "rb") as wav:
+        audio_seconds = wav.getnframes() / wav.getframerate()
+
+    transcript_text = extract_text_from_txt(fixtures["txt"])
+    short_text = " ".join(sentences(10))
+
+    model_loader = ModelLoader()
+    results = [
+        measure("model_loader.load_asr", lambda: (model_loader.load_asr("small", "cpu", 16, "int8"), model_loader.del_models("ASR")), repeat=repeat),
+        measure("model_loader.load_bert", lambda: (model_loader.load_bert(), model_loader.del_models("BERT")), repeat=repeat),
+        measure("model_loader.load_llm", lambda: (model_loader.load_llm("mistral_7b", "cpu"), model_loader.del_models("LLM")), repeat=repeat)
+    ]
+
+    asr = model_loader.load_asr("small", "cpu", 16, "int8")
+    results.append(measure("FasterWhisperManager.transcribe", lambda: asr.transcribe(fixtures["wav"]), repeat=repeat, units=audio_seconds, unit="audio_seconds"))
+    model_loader.del_models("ASR")
+
+    bert = model_loader.load_bert()
+    results.append(measure("DistilBertManager.predict", lambda: bert.predict(short_text), repeat=repeat, units=1, unit="predictions"))
+    model_loader.del_models("BERT")
+
+    for model in ("mistral_7b", "deepseek_14b"):
+        llm = model_loader.load_llm(model, "cpu")
+        results.append(measure(f"LlamaCppManager.generate_summary[{model}]", lambda: llm.generate_summary(transcript_text), repeat=repeat, unit="summaries"))
+        model_loader.del_models("LLM")
+
+    return results
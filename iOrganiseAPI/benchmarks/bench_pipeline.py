@@ -0,0 +1,70 @@
+import os
+import time
+import asyncio
+
+from benchmarks.harness import summarise
+from benchmarks import bench_api
+
+# files of one smart-upload batch
+BATCH = ("pdf", "pdf", "docx", "wav", "wav", "png", "png", "png")
+
+async def _batches(base_url, fixtures, mode, repeat):
+    import httpx
+
+    contents = {}
+    for kind in set(BATCH):
+        with open(fixtures[kind], "rb") as fixture:
+            contents[kind] = fixture.read()
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        email = f"pipeline_{mode}@example.com"
+        await client.post("/register", json={"name": mode, "email": email, "password": "benchmark"})
+        login = await client.post("/login", data={"username": email, "password": "benchmark"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        latencies = []
+        for iteration in range(repeat):
+            files = [("files", (f"{mode}{iteration}_{i}_{os.path.basename(fixtures[kind])}", contents[kind])) for i, kind in enumerate(BATCH)]
+            start = time.perf_counter()
+            response = await client.post("/smart-upload", files=files, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+        return latencies
+
+def run(fixtures, work_dir, repeat=3, real_models=False):
+    '''
+    Sends the same mixed batch (documents, recordings and images) to /smart-upload with its stages run one after another, as before,
+    and as a pipeline, and reports the makespan of each.
+    '''
+    ocr_server = bench_api.configure_environment(work_dir)
+
+    import main
+    from benchmarks import stubs
+
+    costs = dict(stubs.STUB_COSTS)
+    if not real_models:
+        # give every stage a cost so there is something to overlap: a slow OCR service, ASR at 30x real time, BERT and LLM time
+        bench_api.OCR_SECONDS = 0.3
+        stubs.STUB_COSTS.update({
+            "asr_audio_seconds_per_second": stubs.STUB_COSTS["asr_audio_seconds_per_second"] or 30,
+            "bert_seconds": stubs.STUB_COSTS["bert_seconds"] or 0.05,
+            "llm_tokens_per_second": stubs.STUB_COSTS["llm_tokens_per_second"] or 200
+        })
+
+    mode = main.SMART_UPLOAD_PIPELINE
+    results = []
+    try:
+        with bench_api.ApiServer(main.app) as base_url:
+            for pipeline in ("sequential", "concurrent"):
+                main.SMART_UPLOAD_PIPELINE = pipeline
+                latencies = asyncio.run(_batches(base_url, fixtures, pipeline, repeat))
+                results.append({"name": f"smart-upload makespan {pipeline}", "seconds": summarise(latencies), "files": len(BATCH)})
+
+        results[1]["speedup"] = results[0]["seconds"]["p50"] / results[1]["seconds"]["p50"]
+        return results
+    finally:
+        main.SMART_UPLOAD_PIPELINE = mode
+        bench_api.OCR_SECONDS = 0
+        stubs.STUB_COSTS.update(costs)
+        ocr_server.shutdown()
@@ -0,0 +1,92 @@
+import os
+import time
+import asyncio
+
+from benchmarks.harness import measure, summarise
+from benchmarks.bench_api import configure_environment, ApiServer
+from benchmarks.fixtures import make_wav, make_music_wav
+
+# a batch with nothing to transcribe in it: music clips and a silent recording
+BATCH = ("music", "silence", "music")
+
+def _asr_loads():
+    from prometheus_client import REGISTRY
+
+    return sum(
+        sample.value for metric in REGISTRY.collect() if metric.name == "iorganise_model_load_seconds"
+        for sample in metric.samples if sample.name.endswith("_count") and sample.labels.get("model_key") == "ASR"
+    )
+
+async def _upload(base_url, recordings, run_name, repeat):
+    import httpx
+
+    contents = {}
+    for kind, path in recordings.items():
+        with open(path, "rb") as recording:
+            contents[kind] = recording.read()
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        email = f"speech_{run_name}@bench.local"
+        await client.post("/register", json={"name": run_name, "email": email, "password": "benchmark"})
+        login = await client.post("/login", data={"username": email, "password": "benchmark"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        latencies = []
+        for iteration in range(repeat):
+            files = [("files", (f"{run_name}{iteration}_{i}_{kind}.wav", contents[kind], "audio/wav")) for i, kind in enumerate(BATCH)]
+            start = time.perf_counter()
+            response = await client.post("/smart-upload", files=files, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+        return latencies
+
+def run(work_dir, seconds=60, repeat=3, real_models=False):
+    '''
+    Probes a lecture recording, a music clip and a silent recording for speech and reports the verdict, speech ratio and cost of each.
+    Then sends a /smart-upload batch of music and silence with the probe off and on, and reports how long it took and how many
+    times an ASR model was loaded for it.
+    '''
+    ocr_server = configure_environment(work_dir)
+
+    import main
+    import speechProbe
+    from benchmarks import stubs
+
+    recordings = {
+        "speech": make_wav(os.path.join(work_dir, "probe_speech.wav"), seconds=seconds),
+        "music": make_music_wav(os.path.join(work_dir, "probe_music.wav"), seconds=seconds),
+        "silence": make_wav(os.path.join(work_dir, "probe_silence.wav"), seconds=seconds, speech_ratio=0)
+    }
+
+    results = []
+    for kind, path in recordings.items():
+        result = measure(f"probe {kind}", lambda: speechProbe.probe(path), repeat=repeat, units=seconds, unit="audio seconds")
+        probed = speechProbe.probe(path)
+        result.update({"verdict": probed.verdict, "speech_seconds": probed.speech_seconds, "speech_ratio": probed.speech_ratio})
+        results.append(result)
+
+    costs = dict(stubs.STUB_COSTS)
+    if not real_models:
+        # loading whisper takes a few seconds, and transcribing at 30x real time leaves a transcript to classify and summarise
+        stubs.STUB_COSTS.update({
+            "model_load_seconds": stubs.STUB_COSTS["model_load_seconds"] or 2,
+            "asr_audio_seconds_per_second": stubs.STUB_COSTS["asr_audio_seconds_per_second"] or 30,
+            "bert_seconds": stubs.STUB_COSTS["bert_seconds"] or 0.05,
+            "llm_tokens_per_second": stubs.STUB_COSTS["llm_tokens_per_second"] or 200
+        })
+
+    enabled = main.SPEECH_PROBE
+    try:
+        with ApiServer(main.app) as base_url:
+            for name, probing in (("smart-upload without probe", False), ("smart-upload with probe", True)):
+                main.SPEECH_PROBE = probing
+                loads = _asr_loads()
+                latencies = asyncio.run(_upload(base_url, recordings, "probe" if probing else "noprobe", repeat))
+                results.append({"name": name, "seconds": summarise(latencies), "files": len(BATCH), "asr_loads": (_asr_loads() - loads) / repeat})
+
+        return results
+    finally:
+        main.SPEECH_PROBE = enabled
+        stubs.STUB_COSTS.update(costs)
+        ocr_server.shutdown()
@@ -0,0 +1,49 @@
+import sys
+import json
+import argparse
+
+def _load(path):
+    with open(path) as report:
+        data = json.load(report)
+    return data, {
+        (suite, result["name"]): result
+        for suite, results in data["suites"].items()
+        for result in results
+    }
+
+def _p50(result):
+    seconds = result.get("seconds")
+    return seconds.get("p50") if isinstance(seconds, dict) else result.get("wall_seconds")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports produced by benchmarks.run.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative p50 slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    baseline_report, baseline = _load(args.baseline)
+    candidate_report, candidate = _load(args.candidate)
+
+    print(f"baseline:  {baseline_report['environment'].get('commit')}")
+    print(f"candidate: {candidate_report['environment'].get('commit')}")
+    print(f"{'benchmark':60} {'base p50':>10} {'cand p50':>10} {'change':>8}")
+
+    regressions = 0
+    for key in sorted(baseline.keys() & candidate.keys()):
+        before, after = _p50(baseline[key]), _p50(candidate[key])
+        if not before or after is None:
+            continue
+
+        change = (after - before) / before
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+
+        print(f"{key[0] + ': ' + key[1]:60} {before:10.4f} {after:10.4f} {change:+8.1%}{flag}")
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import os
+import math
+import wave
+import zlib
+import struct
+import random
+import shutil
+import subprocess
+from array import array
+
+# fixed seed so that every run (and every commit) benchmarks the exact same inputs
+SEED = 1234
+
+WORDS = (
+    "the quick student reviewed lecture notes on algebra photosynthesis grammar vectors "
+    "energy cells essays equations matrices poetry velocity atoms molecules calculus "
+    "literature evolution probability reaction force syntax derivative organism"
+).split()
+
+def sentences(count: int, rng: random.Random = None):
+    rng = rng or random.Random(SEED)
+    for _ in range(count):
+        length = rng.randint(8, 20)
+        yield " ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + "."
+
+def make_pdf(path: str, pages: int = 10, paragraphs_per_page: int = 6):
+    import fitz
+
+    rng = random.Random(SEED)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        text = "\n\n".join(" ".join(sentences(4, rng)) for _ in range(paragraphs_per_page))
+        page.insert_textbox(fitz.Rect(54, 54, page.rect.width - 54, page.rect.height - 54), text, fontsize=10)
+    doc.save(path)
+    doc.close()
+    return path
+
+def make_docx(path: str, paragraphs: int = 200, tables: int = 10, rows: int = 20, cols: int = 4):
+    from docx import Document
+
+    rng = random.Random(SEED)
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = "Synthetic benchmark document"
+    doc.sections[0].footer.paragraphs[0].text = "Generated for iOrganise benchmarks"
+
+    # interleave tables with the paragraphs so that reading order matters
+    table_every = max(1, paragraphs // max(1, tables))
+    for i in range(paragraphs):
+        doc.add_paragraph(" ".join(sentences(3, rng)))
+        if tables and i % table_every == table_every - 1:
+            table = doc.add_table(rows=rows, cols=cols)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = " ".join(rng.choice(WORDS) for _ in range(3))
+    doc.save(path)
+    return path
+
+def make_wav(path: str, seconds: float = 30.0, sample_rate: int = 16000, speech_ratio: float = 0.7):
+    '''
+    Writes a mono 16-bit WAV of "speech like" bursts: amplitude modulated harmonic tones separated by near silent pauses.
+    '''
+    rng = random.Random(SEED)
+    samples = array("h")
+    total = int(seconds * sample_rate)
+
+    while len(samples) < total:
+        voiced = rng.random() < speech_ratio
+        burst = int(rng.uniform(0.3, 1.5) * sample_rate)
+        pitch = rng.uniform(110, 220)
+        for n in range(burst):
+            t = n / sample_rate
+            if voiced:
+                envelope = 0.5 * (1 - math.cos(2 * math.pi * min(n / burst, 1)))
+                value = sum(math.sin(2 * math.pi * pitch * k * t) / k for k in (1, 2, 3)) * envelope * 8000
+            else:
+                value = rng.uniform(-60, 60)
+            samples.append(int(value))
+
+    del samples[total:]
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.tobytes())
+    return path
+
+def make_music_wav(path: str, seconds: float = 30.0, sample_rate: int = 16000):
+    '''
+    Writes a mono 16-bit WAV of music without vocals: three note chords held for a beat each and overlapping into the next, over a
+    quiet drone.
+    '''
+    rng = random.Random(SEED)
+    beat = int(0.5 * sample_rate)
+    total = int(seconds * sample_rate)
+    scale = (220.0, 246.9, 261.6, 293.7, 329.6, 349.2, 392.0)
+    chords = [[rng.choice(scale) * rng.choice((1, 2)) for _ in range(3)] for _ in range(total // beat + 2)]
+
+    samples = array("h")
+    for n in range(total):
+        t = n / sample_rate
+        index, position = divmod(n, beat)
+        # each chord fades out over the first half of the next beat while that one fades in
+        fade = min(position / (beat / 2), 1.0)
+        value = 0.15 * math.sin(2 * math.pi * 110 * t)
+        value += fade * sum(math.sin(2 * math.pi * pitch * t) for pitch in chords[index + 1]) / 3
+        value += (1 - fade) * sum(math.sin(2 * math.pi * pitch * t) for pitch in chords[index]) / 3
+        samples.append(int(value * 6000))
+
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.tobytes())
+    return path
+
+def make_png(path: str, width: int = 640, height: int = 480):
+    rng = random.Random(SEED)
+
+    # greyscale "handwriting" strokes on a white page, encoded without any imaging library
+    rows = []
+    for y in range(height):
+        row = bytearray(b"\xff" * width)
+        if y % 24 < 3:
+            for x in range(0, width, rng.randint(4, 12)):
+                row[x] = 0
+        rows.append(b"\x00" + bytes(row))
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    with open(path, "wb") as png:
+        png.write(b"\x89PNG\r\n\x1a\n")
+        png.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)))
+        png.write(chunk(b"IDAT", zlib.compress(b"".join(rows), 6)))
+        png.write(chunk(b"IEND", b""))
+    return path
+
+def make_txt(path: str, sentence_count: int = 500):
+    with open(path, "w", encoding="utf-8") as txt:
+        txt.write("\n".join(sentences(sentence_count)))
+    return path
+
+FILLERS = ("um", "uh", "so", "you know", "okay so", "like", "right", "I mean", "yeah so basically", "let me just")
+
+def make_transcript(path: str, segments: int = 400):
+    '''
+    Writes a lecture transcript the way the API formats whisper output, one "Segment N: ..." line per segment. Speech is padded with
+    filler, asides and restated sentences, as in real recordings.
+    '''
+    rng = random.Random(SEED)
+    said = []
+    lines = []
+
+    for i in range(segments):
+        roll = rng.random()
+        if roll < 0.15:
+            text = f"{rng.choice(FILLERS).capitalize()}, {rng.choice(FILLERS)}, can everyone hear me at the back?"
+        elif roll < 0.35 and said:
+            text = f"{rng.choice(FILLERS).capitalize()}, again, {rng.choice(said[-20:]).lower()}"
+        else:
+            text = next(sentences(1, rng))
+            said.append(text)
+            if rng.random() < 0.5:
+                text = f"{rng.choice(FILLERS).capitalize()} {text[0].lower()}{text[1:]}"
+        lines.append(f"Segment {i + 1}: {text}")
+
+    with open(path, "w", encoding="utf-8") as transcript:
+        transcript.write("\n".join(lines))
+    return path
+
+def make_mp4(path: str, audio_path: str):
+    # videos need ffmpeg, callers should skip video fixtures when it isn't installed
+    if not shutil.which("ffmpeg"):
+        return None
+
+    subprocess.run(
+        ["ffmpeg", "-y", "-f", "lavfi", "-i", "color=c=black:s=320x240", "-i", audio_path, "-shortest", "-c:v", "libx264", "-c:a", "aac", path],
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    return path
+
+def make_fixture_set(directory: str, scale: int = 1):
+    '''
+    Generates one of each supported input type and returns a mapping of fixture name to path.
+    '''
+    os.makedirs(directory, exist_ok=True)
+
+    fixtures = {
+        "pdf": make_pdf(os.path.join(directory, "notes.pdf"), pages=10 * scale),
+        "docx": make_docx(os.path.join(directory, "notes.docx"), paragraphs=200 * scale, tables=10 * scale),
+        "txt": make_txt(os.path.join(directory, "notes.txt"), sentence_count=500 * scale),
+        "transcript": make_transcript(os.path.join(directory, "lecture_transcript.txt"), segments=400 * scale),
+        "wav": make_wav(os.path.join(directory, "lecture.wav"), seconds=30 * scale),
+        "png": make_png(os.path.join(directory, "handwriting.png"))
+    }
+
+    video = make_mp4(os.path.join(directory, "lecture.mp4"), fixtures["wav"])
+    if video:
+        fixtures["mp4"] = video
+
+    return fixtures
@@ -0,0 +1,68 @@
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarise(samples):
+    return {
+        "n": len(samples),
+        "mean": sum(samples) / len(samples) if samples else None,
+        "min": min(samples) if samples else None,
+        "p50": percentile(samples, 0.50),
+        "p95": percentile(samples, 0.95),
+        "p99": percentile(samples, 0.99),
+        "max": max(samples) if samples else None
+    }
+
+def measure(name, fn, repeat=5, warmup=1, units=None, **meta):
+    '''
+    Times fn() `repeat` times after `warmup` untimed calls. `units` is the amount of work done per call (pages, audio seconds...)
+    and is used to derive a throughput figure.
+    '''
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+
+    result = {"name": name, "seconds": summarise(samples), **meta}
+    if units:
+        result["units"] = units
+        result["units_per_second"] = units / result["seconds"]["p50"] if result["seconds"]["p50"] else None
+
+    return result
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+def write_results(path, suites, options):
+    report = {"environment": environment(), "options": options, "suites": suites}
+
+    with open(path, "w") as output:
+        json.dump(report, output, indent=2)
+
+    return report
@@ -0,0 +1,16 @@
+'''
+Starts inferenceServer.py for the benchmarks, with the stand-in models unless --real-models is passed.
+'''
+
+import sys
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    if "--real-models" in argv:
+        argv.remove("--real-models")
+    else:
+        from benchmarks import stubs
+        stubs.install()
+
+    import inferenceServer
+    inferenceServer.main(argv)
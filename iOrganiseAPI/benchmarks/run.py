@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+SUITES = ("extractors", "managers", "llm", "compression", "api", "pipeline", "fingerprint", "cpu", "derivation", "inference", "auth", "fairness", "checkpoint", "speech")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the iOrganiseAPI benchmark suites and write the results as JSON.")
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--out", default="benchmark_results.json", help="path of the JSON report")
+    parser.add_argument("--repeat", type=int, default=5, help="timed repetitions per micro-benchmark")
+    parser.add_argument("--scale", type=int, default=1, help="multiplier for the size of the synthetic fixtures")
+    parser.add_argument("--users", type=int, default=4, help="concurrent users in the HTTP load test")
+    parser.add_argument("--iterations", type=int, default=3, help="request rounds per user in the HTTP load test")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 8], help="concurrent summaries compared in the llm suite")
+    parser.add_argument("--workers", type=int, default=2, help="API worker processes sharing the inference server in the inference suite")
+    parser.add_argument("--real-models", action="store_true", help="use the real inference libraries and /app/models instead of stubs")
+    parser.add_argument("--work-dir", default=None, help="directory for fixtures, SQLite and file storage (default: a temp dir)")
+    args = parser.parse_args(argv)
+
+    # per request log lines would drown the report
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    # stubs have to be in place before anything imports utils, the managers or main
+    if not args.real_models:
+        from benchmarks import stubs
+        stubs.install()
+
+    from benchmarks.fixtures import make_fixture_set
+    from benchmarks.harness import write_results
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="iorganise-bench-")
+    # the suites upload the same fixtures over and over, only the fingerprint suite lets them reuse each other's transcripts
+    os.environ.setdefault("ASR_FINGERPRINT", "0")
+    os.environ.setdefault("FINGERPRINT_INDEX", os.path.join(work_dir, "fingerprints.sqlite3"))
+    # every request is transcribed with the model it asks for, so runs under different load compare the same work
+    os.environ.setdefault("ASR_LATENCY_TARGET_SECONDS", "0")
+    fixtures = make_fixture_set(os.path.join(work_dir, "fixtures"), scale=args.scale)
+
+    suites = {}
+    if "extractors" in args.suites:
+        from benchmarks import bench_extractors
+        suites["extractors"] = bench_extractors.run(fixtures, repeat=args.repeat, scale=args.scale)
+
+    if "managers" in args.suites:
+        from benchmarks import bench_managers
+        suites["managers"] = bench_managers.run(fixtures, repeat=args.repeat)
+
+    if "llm" in args.suites:
+        from benchmarks import bench_llm
+        suites["llm"] = bench_llm.run(fixtures, repeat=args.repeat, concurrency=args.concurrency, real_models=args.real_models)
+
+    if "compression" in args.suites:
+        from benchmarks import bench_compress
+        suites["compression"] = bench_compress.run(fixtures, repeat=args.repeat, real_models=args.real_models)
+
+    if "api" in args.suites:
+        from benchmarks import bench_api
+        suites["api"] = bench_api.run(fixtures, work_dir, users=args.users, iterations=args.iterations)
+
+    if "pipeline" in args.suites:
+        from benchmarks import bench_pipeline
+        suites["pipeline"] = bench_pipeline.run(fixtures, work_dir, repeat=args.repeat, real_models=args.real_models)
+
+    if "fingerprint" in args.suites:
+        from benchmarks import bench_fingerprint
+        suites["fingerprint"] = bench_fingerprint.run(fixtures, work_dir, repeat=args.repeat, real_models=args.real_models)
+
+    if "cpu" in args.suites:
+        from benchmarks import bench_cpu
+        suites["cpu"] = bench_cpu.run(fixtures, repeat=args.repeat, real_models=args.real_models)
+
+    if "derivation" in args.suites:
+        from benchmarks import bench_derivation
+        suites["derivation"] = bench_derivation.run(fixtures, work_dir, real_models=args.real_models)
+
+    if "inference" in args.suites:
+        from benchmarks import bench_inference
+        suites["inference"] = bench_inference.run(fixtures, work_dir, users=args.users, iterations=args.iterations, workers=args.workers, real_models=args.real_models)
+
+    if "auth" in args.suites:
+        from benchmarks import bench_auth
+        suites["auth"] = bench_auth.run(fixtures, work_dir, users=args.users)
+
+    if "fairness" in args.suites:
+        from benchmarks import bench_fairness
+        suites["fairness"] = bench_fairness.run(fixtures, work_dir, real_models=args.real_models)
+
+    if "checkpoint" in args.suites:
+        from benchmarks import bench_checkpoint
+        suites["checkpoint"] = bench_checkpoint.run(work_dir, seconds=600 * args.scale, real_models=args.real_models)
+
+    if "speech" in args.suites:
+        from benchmarks import bench_speech
+        suites["speech"] = bench_speech.run(work_dir, seconds=60 * args.scale, repeat=args.repeat, real_models=args.real_models)
+
+    options = {key: value for key, value in vars(args).items() if key != "out"}
+    options["work_dir"] = work_dir
+    write_results(args.out, suites, options)
+
+    json.dump(suites, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+'''
+ASGI entry point for API worker processes started by the benchmarks. uvicorn imports the app by name in each worker, so the stubs
+have to be installed here rather than in the parent process.
+'''
+
+from benchmarks import stubs
+
+stubs.install()
+
+from main import app
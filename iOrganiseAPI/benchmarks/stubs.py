@@ -0,0 +1,387 @@
+'''
+Stand-in implementations of the heavy inference libraries (torch, tensorflow, transformers, faster-whisper, llama.cpp via langchain
+and its low level API).
+
+They mimic just enough of each API for the managers to run unchanged, so that benchmarks measure our own pipeline code on a CPU-only,
+offline machine. The simulated compute cost of each fake model is configurable through STUB_COSTS.
+'''
+
+import os
+import sys
+import zlib
+import random
+import ctypes
+import time
+import types
+import threading
+import wave
+from collections import namedtuple
+
+STUB_COSTS = {
+    "asr_audio_seconds_per_second": 0,  # 0 means "infinitely fast"
+    "llm_tokens_per_second": 0,
+    "llm_batch_token_cost": 0.05,   # extra cost of each additional token in a llama_decode batch, relative to a single token step
+    "bert_seconds": 0,
+    "model_load_seconds": 0,
+    "cpu_bound": False      # burn the inference costs on the engine's threads instead of sleeping them away
+}
+
+Segment = namedtuple("Segment", ["start", "end", "text"])
+TranscriptionInfo = namedtuple("TranscriptionInfo", ["language", "duration"])
+
+# work done between two meetings of an engine's threads, in single core seconds
+_BURN_STEP_SECONDS = 0.005
+_burn_unit_seconds = None
+
+def _burn_unit(size=4096):
+    import numpy as np
+
+    # numpy sorts without the GIL, so threads doing this really run in parallel
+    np.sort(np.random.default_rng(size).random(size))
+
+def _burn(seconds, threads):
+    '''
+    Spends `seconds` of single core CPU time split over `threads` threads. The threads meet at a spinning barrier after every step,
+    like the thread pools of ggml and CTranslate2, so a thread that loses its core to another engine holds up all of its peers.
+    '''
+    global _burn_unit_seconds
+    if _burn_unit_seconds is None:
+        for _ in range(20):
+            _burn_unit()
+        start = time.perf_counter()
+        for _ in range(200):
+            _burn_unit()
+        _burn_unit_seconds = (time.perf_counter() - start) / 200
+
+    threads = max(1, threads or os.cpu_count() or 1)
+    units = max(1, round(_BURN_STEP_SECONDS / _burn_unit_seconds / threads))
+    steps = max(1, round(seconds / _BURN_STEP_SECONDS))
+    arrived = [0] * steps
+    lock = threading.Lock()
+
+    def work():
+        for step in range(steps):
+            for _ in range(units):
+                _burn_unit()
+            with lock:
+                arrived[step] += 1
+            while arrived[step] < threads:
+                _burn_unit(256)
+
+    workers = [threading.Thread(target=work, daemon=True) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+def _simulate(seconds, threads=None):
+    if seconds <= 0:
+        return
+    # only inference is burnt, model loads keep sleeping
+    if STUB_COSTS["cpu_bound"] and threads is not None:
+        _burn(seconds, threads)
+    else:
+        time.sleep(seconds)
+
+def _audio_duration(path):
+    try:
+        with wave.open(path, "rb") as wav:
+            return wav.getnframes() / wav.getframerate()
+    except Exception:
+        return 30.0
+
+# faster-whisper
+def decode_audio(path, sampling_rate=16000):
+    import numpy as np
+
+    # wav fixtures decode to their samples, anything else to silence as long as _audio_duration says
+    try:
+        with wave.open(path, "rb") as wav:
+            samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16).reshape(-1, wav.getnchannels()).mean(axis=1) / 32768
+            rate = wav.getframerate()
+    except Exception:
+        return np.zeros(int(_audio_duration(path) * sampling_rate), dtype=np.float32)
+
+    if rate != sampling_rate:
+        samples = np.interp(np.arange(int(len(samples) * sampling_rate / rate)) * (rate / sampling_rate), np.arange(len(samples)), samples)
+    return samples.astype(np.float32)
+
+class WhisperModel:
+    def __init__(self, model_size_or_path, device="cpu", compute_type="default", **kwargs):
+        _simulate(STUB_COSTS["model_load_seconds"])
+        self.model_size_or_path = model_size_or_path
+        self.device = device
+        self.compute_type = compute_type
+        self.kwargs = kwargs
+
+class BatchedInferencePipeline:
+    def __init__(self, model):
+        self.model = model
+
+    def transcribe(self, audio, batch_size=16, vad_filter=True, language=None, **kwargs):
+        duration = _audio_duration(audio) if isinstance(audio, str) else len(audio) / 16000
+        rate = STUB_COSTS["asr_audio_seconds_per_second"]
+
+        def segments():
+            start = 0.0
+            while start < duration:
+                end = min(start + 5.0, duration)
+                _simulate((end - start) / rate if rate else 0, self.model.kwargs.get("cpu_threads", 0))
+                yield Segment(start, end, f" synthetic speech between {start:.1f} and {end:.1f} seconds about algebra")
+                start = end
+
+        return segments(), TranscriptionInfo(language or "en", duration)
+
+# llama_cpp.Llama, the client wrapped by LlamaCpp. it remembers the tokens in its context so prompts are priced by what isn't cached
+_LlamaState = namedtuple("_LlamaState", ["input_ids", "n_tokens"])
+
+class _Llama:
+    def __init__(self, n_threads=None):
+        self.input_ids = []
+        self.n_threads = n_threads or 0
+
+    @property
+    def ctx(self):
+        return self
+
+    @property
+    def n_tokens(self):
+        return len(self.input_ids)
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return [word for word in text.decode("utf-8", errors="ignore").split()]
+
+    def reset(self):
+        self.input_ids = []
+
+    def eval(self, tokens):
+        rate = STUB_COSTS["llm_tokens_per_second"]
+        # the tokens are evaluated in one batch, priced like the low level stand-in below
+        _simulate((1 + STUB_COSTS["llm_batch_token_cost"] * (len(tokens) - 1)) / rate if rate and tokens else 0, self.n_threads)
+        self.input_ids = self.input_ids + list(tokens)
+
+    def save_state(self):
+        return _LlamaState(list(self.input_ids), self.n_tokens)
+
+    def load_state(self, state):
+        self.input_ids = list(state.input_ids)
+
+# langchain_community.llms.LlamaCpp
+class LlamaCpp:
+    def __init__(self, **params):
+        _simulate(STUB_COSTS["model_load_seconds"])
+        self.params = params
+        self.client = _Llama(params.get("n_threads"))
+
+    def get_num_tokens(self, text):
+        return len(text.split())
+
+    def stream(self, prompt, **kwargs):
+        rate = STUB_COSTS["llm_tokens_per_second"]
+        tokens = self.client.tokenize(prompt.encode("utf-8"))
+
+        # like llama.cpp, only what follows the longest match with the context is evaluated
+        matched = 0
+        while matched < min(len(tokens) - 1, self.client.n_tokens) and tokens[matched] == self.client.input_ids[matched]:
+            matched += 1
+        self.client.input_ids = self.client.input_ids[:matched]
+        self.client.eval(tokens[matched:])
+
+        words = [word for word in prompt.split() if word.isalpha()][:64] or ["empty"]
+        # deepseek reasons before it answers, its closing tag arrives split over two chunks like real tokens can
+        chunks = ["<think>\nreading the transcript\n</th", "ink>\n\n"] if "deepseek" in str(self.params.get("model_path")) else []
+        chunks += ["- " + " ".join(words[i:i + 8]) + "\n" for i in range(0, len(words), 8)]
+        for chunk in chunks:
+            _simulate(len(chunk.split()) / rate if rate else 0, self.client.n_threads)
+            self.client.input_ids = self.client.input_ids + chunk.split()
+            yield chunk
+
+    def invoke(self, prompt, **kwargs):
+        return "".join(self.stream(prompt))
+
+# llama_cpp low level API, used by LlamaCppBatchManager
+_LLAMA_VOCAB_SIZE = 32000
+_LLAMA_BOS, _LLAMA_EOS = 1, 2
+_LLAMA_COMPLETION_TOKENS = 64
+_llama_words = {}
+_llama_pieces = {}
+_llama_background = None    # fixed low logits behind the chosen token, real logits are never all ties
+
+class _LlamaParams:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+class _LlamaBatch:
+    def __init__(self, n_tokens, embd, n_seq_max):
+        self.n_tokens = 0
+        self.token = [0] * n_tokens
+        self.pos = [0] * n_tokens
+        self.n_seq_id = [0] * n_tokens
+        self.seq_id = [[0] * n_seq_max for _ in range(n_tokens)]
+        self.logits = [0] * n_tokens
+
+class _LlamaContext:
+    def __init__(self, params):
+        self.params = params
+        self.n_threads = params.n_threads
+        self.sequences = {}         # seq id -> tokens in the KV cache
+        self.prompt_lengths = {}
+        self.outputs = {}
+
+def _llama_load_model(path, params):
+    _simulate(STUB_COSTS["model_load_seconds"])
+    return _LlamaParams(path=path)
+
+def _llama_tokenize(vocab, text, text_len, tokens, n_tokens_max, add_special, parse_special):
+    ids = [_LLAMA_BOS] if add_special else []
+    for word in text.decode("utf-8", errors="ignore").split():
+        if word not in _llama_words:
+            _llama_words[word] = 3 + len(_llama_words) % (_LLAMA_VOCAB_SIZE - 3)
+            _llama_pieces[_llama_words[word]] = word
+        ids.append(_llama_words[word])
+
+    if len(ids) > n_tokens_max:
+        return -len(ids)
+    for i, token in enumerate(ids):
+        tokens[i] = token
+    return len(ids)
+
+def _llama_token_to_piece(vocab, token, buf, length, lstrip, special):
+    piece = (" " + _llama_pieces.get(token, "")).encode() if token > _LLAMA_EOS else b""
+    ctypes.memmove(buf, piece, min(len(piece), length))
+    return min(len(piece), length)
+
+def _llama_decode(context, batch):
+    # decoding is bound by reading the weights once per step, every extra token in the batch only adds a little compute
+    rate = STUB_COSTS["llm_tokens_per_second"]
+    _simulate((1 + STUB_COSTS["llm_batch_token_cost"] * (batch.n_tokens - 1)) / rate if rate else 0, context.n_threads)
+
+    for i in range(batch.n_tokens):
+        seq = batch.seq_id[i][0]
+        tokens = context.sequences.setdefault(seq, [])
+        del tokens[batch.pos[i]:]
+        tokens.append(batch.token[i])
+
+        if batch.logits[i]:
+            # the stand-in "summarises" by repeating the tail of the prompt, then stops
+            prompt_length = context.prompt_lengths.setdefault(seq, len(tokens))
+            step = len(tokens) - prompt_length
+            budget = min(_LLAMA_COMPLETION_TOKENS, prompt_length - 1)
+            target = _LLAMA_EOS if step >= budget else context.sequences[seq][prompt_length - budget + step]
+
+            global _llama_background
+            if _llama_background is None:
+                noise = random.Random(0)
+                _llama_background = (ctypes.c_float * _LLAMA_VOCAB_SIZE)(*(noise.uniform(-5, 5) for _ in range(_LLAMA_VOCAB_SIZE)))
+
+            logits = (ctypes.c_float * _LLAMA_VOCAB_SIZE)()
+            ctypes.memmove(logits, _llama_background, ctypes.sizeof(logits))
+            logits[target] = 50.0
+            context.outputs[i] = logits
+    return 0
+
+def _llama_get_logits_ith(context, i):
+    return ctypes.cast(context.outputs[i], ctypes.POINTER(ctypes.c_float))
+
+def _llama_kv_cache_seq_cp(context, src, dst, p0, p1):
+    context.sequences[dst] = context.sequences.get(src, [])[p0:p1]
+
+def _llama_kv_cache_seq_rm(context, seq, p0, p1):
+    context.sequences.pop(seq, None)
+    context.prompt_lengths.pop(seq, None)
+    return True
+
+# tensorflow
+class _Tensor:
+    def __init__(self, value):
+        self.value = value
+
+    def numpy(self):
+        return self.value
+
+class _SavedModel:
+    def __init__(self):
+        self.signatures = {"serving_default": self.__serve}
+
+    def __serve(self, input_ids=None, attention_mask=None):
+        _simulate(STUB_COSTS["bert_seconds"])
+        # deterministic pseudo logits derived from the input so repeated runs agree, one forward pass costs the same for any batch size
+        rows = input_ids.value if input_ids is not None else [[0]]
+        return {"logits": _Tensor([[sum(ids) % 3 == label for label in range(3)] for ids in rows])}
+
+def _load_saved_model(path):
+    _simulate(STUB_COSTS["model_load_seconds"])
+    return _SavedModel()
+
+def _argmax(tensor, axis=-1):
+    return _Tensor([max(range(len(row)), key=lambda i: row[i]) for row in tensor.value])
+
+# transformers
+class DistilBertTokenizer:
+    @classmethod
+    def from_pretrained(cls, name):
+        return cls()
+
+    def __call__(self, text, max_length=256, **kwargs):
+        rows = []
+        for item in [text] if isinstance(text, str) else text:
+            ids = [zlib.crc32(word.encode()) % 30522 for word in item.lower().split()][:max_length]
+            rows.append(ids + [0] * (max_length - len(ids)))
+        return {"input_ids": _Tensor(rows), "attention_mask": _Tensor([[int(i != 0) for i in ids] for ids in rows])}
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+def install():
+    '''
+    Registers the stand-in modules in sys.modules. Must be called before importing utils, the managers or main.
+    '''
+    cuda = _module("torch.cuda", is_available=lambda: False, empty_cache=lambda: None)
+    torch = _module("torch", cuda=cuda, set_num_threads=lambda n: None, get_num_threads=lambda: 1)
+
+    experimental = _module("tensorflow.config.experimental", list_physical_devices=lambda kind=None: [], set_memory_growth=lambda gpu, value: None)
+    threading = _module("tensorflow.config.threading", set_intra_op_parallelism_threads=lambda n: None, set_inter_op_parallelism_threads=lambda n: None)
+    tf_config = _module("tensorflow.config", experimental=experimental, threading=threading)
+    saved_model = _module("tensorflow.saved_model", load=_load_saved_model)
+    tensorflow = _module("tensorflow", config=tf_config, saved_model=saved_model, argmax=_argmax)
+
+    llama_cpp = _module(
+        "llama_cpp",
+        llama_token=ctypes.c_int32,
+        llama_backend_init=lambda: None,
+        llama_model_default_params=lambda: _LlamaParams(n_gpu_layers=0),
+        llama_load_model_from_file=_llama_load_model,
+        llama_model_get_vocab=lambda model: model,
+        llama_vocab_n_tokens=lambda vocab: _LLAMA_VOCAB_SIZE,
+        llama_vocab_is_eog=lambda vocab, token: token == _LLAMA_EOS,
+        llama_context_default_params=lambda: _LlamaParams(n_ctx=512, n_batch=512, n_ubatch=512, n_seq_max=1, n_threads=1, n_threads_batch=1),
+        llama_new_context_with_model=lambda model, params: _LlamaContext(params),
+        llama_batch_init=_LlamaBatch,
+        llama_batch_free=lambda batch: None,
+        llama_decode=_llama_decode,
+        llama_get_logits_ith=_llama_get_logits_ith,
+        llama_kv_cache_seq_cp=_llama_kv_cache_seq_cp,
+        llama_kv_cache_seq_rm=_llama_kv_cache_seq_rm,
+        llama_tokenize=_llama_tokenize,
+        llama_token_to_piece=_llama_token_to_piece,
+        llama_set_n_threads=lambda context, n_threads, n_threads_batch: setattr(context, "n_threads", n_threads),
+        llama_free=lambda context: None,
+        llama_free_model=lambda model: None
+    )
+
+    llms = _module("langchain_community.llms", LlamaCpp=LlamaCpp)
+    langchain_community = _module("langchain_community", llms=llms)
+
+    sys.modules.update({
+        "torch": torch,
+        "torch.cuda": cuda,
+        "tensorflow": tensorflow,
+        "tensorflow.config": tf_config,
+        "transformers": _module("transformers", DistilBertTokenizer=DistilBertTokenizer),
+        "faster_whisper": _module("faster_whisper", WhisperModel=WhisperModel, BatchedInferencePipeline=BatchedInferencePipeline, decode_audio=decode_audio),
+        "llama_cpp": llama_cpp,
+        "langchain_community": langchain_community,
+        "langchain_community.llms": llms
+    })
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+
+from utils import FILE_STORAGE
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# where unfinished jobs keep what they have done so far, it has to survive a restart of the process or container
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", os.path.join(FILE_STORAGE, ".checkpoints"))
+# wall clock seconds between writes of the finished pieces of a job (0 turns checkpointing off)
+CHECKPOINT_SECONDS = float(os.getenv("CHECKPOINT_SECONDS", "30"))
+# checkpoints of jobs nobody came back for are removed after this many days
+CHECKPOINT_MAX_AGE_DAYS = float(os.getenv("CHECKPOINT_MAX_AGE_DAYS", "7"))
+
+_pruned = False
+
+def prune_checkpoints(max_age_days=CHECKPOINT_MAX_AGE_DAYS):
+    cutoff = time.time() - max_age_days * 86400
+    try:
+        names = os.listdir(CHECKPOINT_DIR)
+    except FileNotFoundError:
+        return 0
+
+    removed = 0
+    for name in names:
+        path = os.path.join(CHECKPOINT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+class Checkpoint:
+    '''
+    The Checkpoint class is an append only journal of the finished pieces of one long job, one JSON record per line, kept under
+    CHECKPOINT_DIR by a key that identifies the job's input. Records are buffered and written (and fsynced) at most every
+    CHECKPOINT_SECONDS, so a job interrupted by a restart loses at most that much work. A line cut short by the crash is ignored.
+    The journal is removed once the job has finished.
+    '''
+
+    def __init__(self, key, interval=CHECKPOINT_SECONDS):
+        global _pruned
+
+        self.key = key
+        self.path = os.path.join(CHECKPOINT_DIR, key + ".jsonl")
+        self.enabled = interval > 0
+        self.__interval = interval
+        self.__pending = []
+        self.__written = time.monotonic()
+
+        # abandoned journals are cleared out once per process, when the first job opens one
+        if self.enabled and not _pruned:
+            _pruned = True
+            removed = prune_checkpoints()
+            if removed:
+                logger.info("old checkpoints removed", extra={"removed": removed})
+
+    def load(self):
+        if not self.enabled:
+            return []
+
+        records, valid = [], 0
+        try:
+            with open(self.path, "r+b") as journal:
+                for line in journal:
+                    try:
+                        if not line.endswith(b"\n"):
+                            break
+                        records.append(json.loads(line))
+                        valid += len(line)
+                    except ValueError:
+                        break
+                # cut off a torn last line so the records written after resuming follow the good ones
+                journal.truncate(valid)
+        except FileNotFoundError:
+            pass
+        return records
+
+    def record(self, *records):
+        if not self.enabled:
+            return
+        self.__pending.extend(records)
+        if time.monotonic() - self.__written >= self.__interval:
+            self.flush()
+
+    def flush(self):
+        if not self.enabled or not self.__pending:
+            return
+
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as journal:
+            journal.write("".join(json.dumps(record) + "\n" for record in self.__pending))
+            journal.flush()
+            os.fsync(journal.fileno())
+        self.__pending = []
+        self.__written = time.monotonic()
+
+    def finish(self):
+        self.__pending = []
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
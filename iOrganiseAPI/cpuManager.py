@@ -0,0 +1,174 @@
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+
+from metrics import CPU_THREADS
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# give every engine its own share of the cores instead of letting each one size its thread pool to the whole machine
+CPU_PARTITIONING = os.getenv("CPU_PARTITIONING", "1") == "1"
+# also pin the threads of each engine to the cores of its share
+CPU_AFFINITY = os.getenv("CPU_AFFINITY", "0") == "1"
+# relative share of the cores per model key
+CPU_WEIGHTS = {
+    key.strip(): float(weight)
+    for key, weight in (pair.split(":") for pair in os.getenv("CPU_WEIGHTS", "ASR:2,LLM:2,BERT:1").split(",") if pair.strip())
+}
+# llama.cpp can change the thread count of a live context, CTranslate2 and TensorFlow fix theirs when the model is created
+CPU_RESIZABLE = ("LLM",)
+
+def _read(path):
+    try:
+        with open(path) as cgroup_file:
+            return cgroup_file.read().split()
+    except OSError:
+        return None
+
+def cpu_quota():
+    # cores' worth of CPU time the container may use, None when it isn't limited
+    quota = _read("/sys/fs/cgroup/cpu.max")
+    if quota and quota[0] != "max":
+        return int(quota[0]) / int(quota[1])
+
+    quota, period = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"), _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota[0]) > 0:
+        return int(quota[0]) / int(period[0])
+    return None
+
+def available_cores():
+    try:
+        cores = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = list(range(os.cpu_count() or 1))
+
+    # a quota limits how many cores can be busy at once, more threads than that only queue for their time slice
+    quota = cpu_quota()
+    if quota:
+        cores = cores[:max(1, int(quota))]
+    return cores
+
+def partition(cores, weights):
+    '''
+    Splits the cores into contiguous shares proportional to weights, with at least one core each. When there are fewer cores than
+    keys the shares overlap.
+    '''
+    keys = list(weights)
+    if len(cores) <= len(keys):
+        return {key: [cores[i % len(cores)]] for i, key in enumerate(keys)}
+
+    total = sum(weights.values())
+    counts = {key: max(1, int(len(cores) * weights[key] / total)) for key in keys}
+    # the cores left over by rounding down go to the largest remainders
+    remainders = sorted(keys, key=lambda key: len(cores) * weights[key] / total - counts[key], reverse=True)
+    for key in remainders[:len(cores) - sum(counts.values())]:
+        counts[key] += 1
+    while sum(counts.values()) > len(cores):
+        counts[max(counts, key=counts.get)] -= 1
+
+    shares, start = {}, 0
+    for key in keys:
+        shares[key] = cores[start:start + counts[key]]
+        start += counts[key]
+    return shares
+
+class CpuBudget:
+    '''
+    The CpuBudget class holds the threads and cores assigned to one engine. threads is None when partitioning is off, the engine then
+    keeps its own default.
+    '''
+
+    def __init__(self, model_key):
+        self.model_key = model_key
+        self.resizable = model_key in CPU_RESIZABLE
+        self.threads = None
+        self.cores = None
+        self.__on_resize = None
+
+    def on_resize(self, callback):
+        self.__on_resize = callback
+
+    def assign(self, cores):
+        resized = self.threads is not None and self.threads != len(cores)
+        self.cores, self.threads = cores, len(cores)
+        CPU_THREADS.labels(self.model_key).set(self.threads)
+
+        if resized and self.__on_resize is not None:
+            logger.info("engine threads resized", extra={"model_key": self.model_key, "threads": self.threads})
+            self.__on_resize(self.threads)
+
+    # threads an engine starts inherit the affinity of the thread that starts them, so creating or calling an engine inside this
+    # keeps its workers on its own cores
+    @contextmanager
+    def pinned(self):
+        if not (CPU_AFFINITY and self.cores and hasattr(os, "sched_setaffinity")):
+            yield
+            return
+
+        previous = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, self.cores)
+        try:
+            yield
+        finally:
+            os.sched_setaffinity(0, previous)
+
+def pinned(cpu_budget):
+    return cpu_budget.pinned() if cpu_budget is not None else nullcontext()
+
+class CpuManager:
+    '''
+    The CpuManager class hands every loaded engine a thread budget from a fixed partition of the cores, so that engines running at the
+    same time don't oversubscribe them. Engines that can resize (llama.cpp) also take the shares of the engines that aren't loaded,
+    and are rebalanced whenever an engine is loaded or unloaded.
+    '''
+
+    def __init__(self, enabled=CPU_PARTITIONING, weights=CPU_WEIGHTS):
+        self.enabled = enabled
+        self.weights = dict(weights)
+        self.__budgets = {}
+        self.__lock = threading.Lock()
+
+    def acquire(self, model_key):
+        budget = CpuBudget(model_key)
+        if not self.enabled:
+            return budget
+
+        with self.__lock:
+            self.__budgets[model_key] = budget
+            self.__rebalance()
+        logger.info("engine threads assigned", extra={"model_key": model_key, "threads": budget.threads, "cores": budget.cores})
+        return budget
+
+    def release(self, model_key):
+        with self.__lock:
+            if self.__budgets.pop(model_key, None) is not None:
+                CPU_THREADS.labels(model_key).set(0)
+                self.__rebalance()
+
+    # callers must hold the lock
+    def __rebalance(self):
+        weights = dict(self.weights)
+        for model_key in self.__budgets:
+            weights.setdefault(model_key, 1)
+        shares = partition(available_cores(), weights)
+
+        idle = [core for model_key, share in shares.items() if model_key not in self.__budgets for core in share]
+        for model_key, budget in self.__budgets.items():
+            cores = shares[model_key] + (idle if budget.resizable else [])
+            budget.assign(sorted(set(cores)))
+
+    def snapshot(self):
+        with self.__lock:
+            budgets = {model_key: {"threads": budget.threads, "cores": budget.cores, "resizable": budget.resizable} for model_key, budget in self.__budgets.items()}
+
+        return {
+            "partitioning": self.enabled,
+            "affinity": CPU_AFFINITY,
+            "cores": available_cores(),
+            "quota": cpu_quota(),
+            "weights": self.weights,
+            "budgets": budgets
+        }
+
+cpu_manager = CpuManager()
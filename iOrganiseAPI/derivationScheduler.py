@@ -0,0 +1,145 @@
+import os
+import time
+import asyncio
+import itertools
+
+from admissionController import admission_controller, AdmissionRejected
+from metrics import QUEUE_DEPTH, DERIVATIONS, DERIVATION_SECONDS
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# uploaded files are queued for extraction, classification and summarisation in the background (0 leaves them until first viewed)
+DERIVE_ON_UPLOAD = os.getenv("DERIVE_ON_UPLOAD", "1") == "1"
+# background work only starts, and only moves on to its next stage, once no request has held inference work for this many seconds
+DERIVE_IDLE_SECONDS = float(os.getenv("DERIVE_IDLE_SECONDS", "5"))
+DERIVE_POLL_SECONDS = 0.5
+
+class DerivationScheduler:
+    '''
+    The DerivationScheduler class derives the content, subject and summary of uploaded files while the node is otherwise idle, so that
+    opening a file is usually a read of what was stored. Files of the users seen most recently go first, newest upload first. Each file
+    runs through derive(file_id, ticket, wait_idle), which reserves its work on an admission ticket like any request and awaits
+    wait_idle() between stages, so interactive requests pause the background work at the next stage boundary.
+    '''
+
+    def __init__(self, derive, controller=admission_controller, idle_seconds=DERIVE_IDLE_SECONDS):
+        self.__derive = derive
+        self.__controller = controller
+        self.idle_seconds = idle_seconds
+        self.__pending = {}         # file id -> (user id, upload order)
+        self.__running = {}         # file id -> future set to whether its background derivation succeeded
+        self.__seen = {}            # user id -> when the user last made a request
+        self.__order = itertools.count()
+        self.__ticket = None
+        self.__busy_at = 0.0
+        self.__wake = None
+        self.__task = None
+
+    def start(self):
+        # started from the app's startup hook so the event and task belong to the running loop
+        self.__wake = asyncio.Event()
+        self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        if self.__task:
+            self.__task.cancel()
+            await asyncio.gather(self.__task, return_exceptions=True)
+            self.__task = None
+
+    def touch(self, user_id):
+        self.__seen[user_id] = time.monotonic()
+
+    def submit(self, file_id, user_id):
+        self.__pending[file_id] = (user_id, next(self.__order))
+        self.__publish()
+        if self.__wake:
+            self.__wake.set()
+
+    def discard(self, file_id):
+        self.__pending.pop(file_id, None)
+        self.__publish()
+
+    async def claim(self, file_id):
+        '''
+        Called before a file is derived in the foreground. A queued file is taken off the queue, and a file whose background derivation
+        is already running is waited for instead of being derived twice. Returns True when the background derivation produced it.
+        '''
+        self.discard(file_id)
+
+        future = self.__running.get(file_id)
+        if future is None:
+            return False
+        return await asyncio.shield(future)
+
+    def is_idle(self):
+        # interactive load is any admitted inference work that isn't ours, it has to stay away for idle_seconds
+        now = time.monotonic()
+        if self.__controller.active_tickets(exclude=self.__ticket):
+            self.__busy_at = now
+        return now - self.__busy_at >= self.idle_seconds
+
+    async def wait_idle(self):
+        while not self.is_idle():
+            await asyncio.sleep(DERIVE_POLL_SECONDS)
+
+    def snapshot(self):
+        return {
+            "pending": len(self.__pending),
+            "running": list(self.__running),
+            "idle": self.is_idle(),
+            "idle_seconds": self.idle_seconds
+        }
+
+    def __next(self):
+        return max(self.__pending, key=lambda file_id: (self.__seen.get(self.__pending[file_id][0], 0), self.__pending[file_id][1]))
+
+    def __publish(self):
+        QUEUE_DEPTH.labels("derivation").set(len(self.__pending))
+
+    async def __run(self):
+        while True:
+            if not self.__pending:
+                self.__wake.clear()
+                await self.__wake.wait()
+                continue
+
+            await self.wait_idle()
+            if not self.__pending:
+                continue
+
+            file_id = self.__next()
+            user_id, _ = self.__pending.pop(file_id)
+            self.__publish()
+            await self.__run_one(file_id, user_id)
+
+    async def __run_one(self, file_id, user_id):
+        future = asyncio.get_running_loop().create_future()
+        self.__running[file_id] = future
+        self.__ticket = self.__controller.ticket("background")
+
+        start = time.perf_counter()
+        outcome = "failed"
+        try:
+            await self.__derive(file_id, self.__ticket, self.wait_idle)
+            outcome = "derived"
+        except AdmissionRejected as e:
+            # the models filled up between the idle check and the reservation, try again once they have drained
+            outcome = "deferred"
+            self.__pending.setdefault(file_id, (user_id, next(self.__order)))
+            self.__busy_at = time.monotonic() + e.retry_after
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            logger.error("background derivation failed", extra={"file_id": file_id, "error": str(e)})
+        finally:
+            self.__ticket.release()
+            self.__ticket = None
+            del self.__running[file_id]
+            future.set_result(outcome == "derived")
+            self.__publish()
+
+            DERIVATIONS.labels(outcome).inc()
+            DERIVATION_SECONDS.observe(time.perf_counter() - start)
+            logger.info("background derivation finished", extra={"file_id": file_id, "outcome": outcome, "seconds": round(time.perf_counter() - start, 3)})
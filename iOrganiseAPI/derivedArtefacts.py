@@ -0,0 +1,72 @@
+import hashlib
+
+from database import db_create, db_get_by_attribute, db_update
+from model.DerivedArtefact import DerivedArtefact
+from summaryPrompt import summary_version
+from utils import get_file_type, model_name
+
+# every stored output of a file is recorded with what produced it and a hash of what it was produced from. the stages run in this
+# order and each one takes the output of the one before: content from the uploaded file, subject and summary from the content.
+STAGES = ("content", "subject", "summary")
+
+# bump a version whenever that producer's output changes for the same input, artefacts made by an older version are recomputed
+ASR_VERSION = "1"
+OCR_VERSION = "1"
+EXTRACTOR_VERSION = "1"
+CLASSIFIER_VERSION = "1"
+
+DOCUMENT_TYPES = {
+    "application/pdf": "pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx"
+}
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def content_producer(path, asr_model):
+    file_type = get_file_type(path) or ""
+    if file_type.split("/")[0] in ("audio", "video"):
+        return f"asr:{model_name(asr_model)}", ASR_VERSION
+    if file_type.startswith("image/"):
+        return "ocr", OCR_VERSION
+    if file_type in DOCUMENT_TYPES:
+        return DOCUMENT_TYPES[file_type], EXTRACTOR_VERSION
+    return None
+
+def classifier_producer():
+    return "distilbert", CLASSIFIER_VERSION
+
+def summary_producer(llm):
+    return f"llm:{model_name(llm)}", summary_version()
+
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+async def get_artefacts(file_id):
+    return {artefact.stage: artefact for artefact in await db_get_by_attribute(DerivedArtefact, "file_id", file_id) or []}
+
+def is_current(artefact, producer, input_hash):
+    return artefact is not None and (artefact.producer, artefact.version) == tuple(producer) and artefact.input_hash == input_hash
+
+def stale_stages(artefacts, content, file_hash, llm):
+    # planned from the stored hashes alone. redone content may change what the later stages get, so they are counted as stale too
+    if not is_current(artefacts.get("content"), content, file_hash):
+        return list(STAGES)
+
+    content_hash = artefacts["content"].output_hash
+    producers = {"subject": classifier_producer(), "summary": summary_producer(llm)}
+    return [stage for stage, producer in producers.items() if not is_current(artefacts.get(stage), producer, content_hash)]
+
+async def record_artefact(file_id, stage, producer, input_hash, output_hash):
+    values = {"producer": producer[0], "version": producer[1], "input_hash": input_hash, "output_hash": output_hash}
+
+    existing = (await get_artefacts(file_id)).get(stage)
+    if existing:
+        return await db_update(DerivedArtefact, existing.id, values)
+    return await db_create(DerivedArtefact(file_id=file_id, stage=stage, **values))
@@ -0,0 +1,116 @@
+import re
+import zipfile
+import posixpath
+from xml.etree import ElementTree
+
+from lxml import etree
+
+# WordprocessingML namespaces
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+MC = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+RELS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+DOCUMENT_PART = "word/document.xml"
+DOCUMENT_RELS = "word/_rels/document.xml.rels"
+
+P, R, T, TAB, BR, CR = W + "p", W + "r", W + "t", W + "tab", W + "br", W + "cr"
+TBL, TR, TC = W + "tbl", W + "tr", W + "tc"
+FALLBACK = MC + "Fallback"
+# the only elements the parser reports, everything else is skipped over in C
+EVENT_TAGS = (P, T, TAB, BR, CR, TBL, TR, TC, FALLBACK)
+
+PART_NUMBER = re.compile(r"(\d+)\.xml$")
+
+def _header_footer_parts(docx):
+    # headers and footers are separate parts linked from the document's relationships, taken in part number order
+    try:
+        rels = ElementTree.fromstring(docx.read(DOCUMENT_RELS))
+    except KeyError:
+        return [], []
+
+    parts = {"header": set(), "footer": set()}
+    for rel in rels.iter(RELS + "Relationship"):
+        kind = rel.get("Type", "").rsplit("/", 1)[-1]
+        if kind in parts and rel.get("TargetMode") != "External":
+            parts[kind].add(posixpath.normpath(posixpath.join("word", rel.get("Target"))))
+
+    def order(name):
+        number = PART_NUMBER.search(name)
+        return (int(number.group(1)) if number else 0, name)
+
+    return sorted(parts["header"], key=order), sorted(parts["footer"], key=order)
+
+def _iter_part(stream):
+    '''
+    Yields the text of one WordprocessingML part a block at a time, in document order: a paragraph's text, or a table row as its
+    cells' text joined by " | ". Elements are dropped once read, so memory stays bounded by the largest paragraph or table.
+    '''
+    paragraphs = []     # text of the paragraphs being read, a text box's paragraphs sit inside the paragraph holding the box
+    cells = []          # paragraphs read so far in each open table cell
+    rows = []           # cells read so far in each open table row
+    skipping = 0        # depth inside mc:Fallback, which repeats the mc:Choice content before it for older readers
+
+    for event, elem in etree.iterparse(stream, events=("start", "end"), tag=EVENT_TAGS):
+        tag = elem.tag
+        if tag == FALLBACK:
+            skipping += 1 if event == "start" else -1
+            continue
+        if skipping:
+            continue
+
+        if event == "start":
+            if tag == P:
+                paragraphs.append([])
+            elif tag == TR:
+                rows.append([])
+            elif tag == TC:
+                cells.append([])
+            continue
+
+        if tag == T:
+            if paragraphs and elem.text:
+                paragraphs[-1].append(elem.text)
+        elif tag in (TAB, CR) or (tag == BR and elem.get(W + "type", "textWrapping") == "textWrapping"):
+            # w:tab also defines tab stops in a paragraph's properties, only a tab inside a run is text
+            if paragraphs and elem.getparent().tag == R:
+                paragraphs[-1].append("\t" if tag == TAB else "\n")
+        elif tag == P:
+            text = "".join(paragraphs.pop())
+            if cells:
+                cells[-1].append(text)
+            elif text:
+                yield text
+        elif tag == TC:
+            text = "\n".join(cells.pop()).strip()
+            if rows:
+                rows[-1].append(text)
+        elif tag == TR:
+            row = rows.pop()
+            # a nested table's rows become lines of the cell holding it
+            if any(row):
+                if cells:
+                    cells[-1].append(" | ".join(row))
+                else:
+                    yield " | ".join(row)
+
+        # paragraphs and tables are only needed until their end, drop them and the empty siblings they leave behind
+        if tag in (P, TBL) and not paragraphs and not cells:
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+def iter_docx_text(docx_path: str):
+    '''
+    Streams the text of a .docx a block at a time straight from its XML: the headers, the body in reading order with tables where
+    they appear, then the footers. Unlike python-docx no document tree is built, so the first blocks arrive before the rest is read.
+    '''
+    with zipfile.ZipFile(docx_path) as docx:
+        headers, footers = _header_footer_parts(docx)
+
+        for part in headers + [DOCUMENT_PART] + footers:
+            try:
+                stream = docx.open(part)
+            except KeyError:
+                continue
+            with stream:
+                yield from _iter_part(stream)
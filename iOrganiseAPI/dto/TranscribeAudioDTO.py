@@ -6,4 +6,5 @@ from enums.LlmModels import LlmModels
 class TranscribeAudioDTO(BaseModel):
     asr_model: AsrModels
     content_summary: bool
-    llm: LlmModels
\ No newline at end of file
+    llm: LlmModels
+    stream: bool = False
\ No newline at end of file
@@ -0,0 +1,244 @@
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+
+from metrics import FAIR_QUEUE_DEPTH, FAIR_QUEUE_WAIT_SECONDS, FAIR_QUEUE_SERVED
+
+# seconds of model time every waiting owner is credited per round, the scheduling grain between owners
+FAIR_QUANTUM_SECONDS = float(os.getenv("FAIR_QUANTUM_SECONDS", "1"))
+# relative share per owner, above 0, e.g. "background:0.25,user:7:2" (owners are "user:<id>", "ip:<address>" or "background", default 1)
+FAIR_WEIGHTS = {
+    owner.strip(): float(weight)
+    for owner, _, weight in (pair.rpartition(":") for pair in os.getenv("FAIR_WEIGHTS", "background:0.25").split(",") if pair.strip())
+}
+# once a slot moves to work on a different model (whose load replaces the one before), its owner keeps the slot for up to this many
+# seconds of work on that model, and for up to FAIR_TURN_LINGER_SECONDS after each piece for the next one to arrive, so owners on
+# different models don't reload the model for every file
+FAIR_MODEL_TURN_SECONDS = float(os.getenv("FAIR_MODEL_TURN_SECONDS", "60"))
+FAIR_TURN_LINGER_SECONDS = float(os.getenv("FAIR_TURN_LINGER_SECONDS", "0.5"))
+# owners with nothing waiting or running are forgotten after this many seconds
+FAIR_STATS_TTL = 3600
+# waits kept per owner for the snapshot
+FAIR_WAIT_WINDOW = 100
+
+class _Waiter:
+    def __init__(self, future, cost, model):
+        self.future = future
+        self.cost = cost
+        self.model = model
+        self.queued = time.perf_counter()
+
+# anonymous owners are one per client address, they share a metric label so the series don't grow with every address seen
+def _label(owner):
+    return "anonymous" if owner.startswith("ip:") else owner
+
+class _Flow:
+    def __init__(self, weight):
+        self.weight = weight
+        self.deficit = 0.0
+        self.credited = False
+        self.waiters = deque()
+
+class FairQueue:
+    '''
+    The FairQueue class hands out a model's slots with deficit round robin over the owners of the waiting work, each owner's work in
+    its own FIFO. Every round an owner is credited FAIR_QUANTUM_SECONDS times its weight and is served once its credit covers the cost
+    of its next piece of work, in estimated seconds. An owner with a long batch waits its turn between each piece of it, so a small
+    request from someone else goes ahead of the rest of the batch instead of behind all of it. Credit isn't kept while an owner has
+    nothing waiting. Work on a different model than the one the slot last ran starts a turn of up to model_turn seconds in which
+    the owner's work on that model goes first, the seconds are charged to its credit as usual.
+    '''
+
+    def __init__(self, name, slots, quantum=FAIR_QUANTUM_SECONDS, weights=FAIR_WEIGHTS, model_turn=FAIR_MODEL_TURN_SECONDS, linger=FAIR_TURN_LINGER_SECONDS):
+        self.name = name
+        self.slots = slots
+        self.quantum = quantum
+        self.weights = dict(weights)
+        self.model_turn = model_turn
+        self.linger = linger
+        self.__free = slots
+        self.__flows = OrderedDict()    # owner -> flow, owners with waiting work in round robin order
+        self.__owners = {}              # owner -> waiting, running, served and recent waits
+        self.__model = None             # model of the work started last
+        self.__turn = None              # [owner, model, seconds left] of the turn started by the last change of model
+        self.__held = None              # timer handing back a slot kept for the turn's owner
+
+    def weight(self, owner):
+        # an owner's own weight, else the weight of its kind ("user", "ip" or "background")
+        return max(self.weights.get(owner, self.weights.get(owner.partition(":")[0], 1.0)), 0.01)
+
+    def __stats(self, owner):
+        if owner not in self.__owners:
+            self.__owners[owner] = {"waiting": 0, "running": 0, "served": 0, "cost_seconds": 0.0, "waits": deque(maxlen=FAIR_WAIT_WINDOW), "seen": time.monotonic()}
+        return self.__owners[owner]
+
+    # model is the model the work runs on, None for work that can't cause one to be swapped for another
+    async def acquire(self, owner, cost, model=None):
+        stats = self.__stats(owner)
+        stats["seen"] = time.monotonic()
+
+        # the slot kept for the turn's owner goes straight to its next piece of work on the same model
+        if self.__held is not None and self.__turn[:2] == [owner, model]:
+            self.__held.cancel()
+            self.__held = None
+            self.__turn[2] -= cost
+            self.__start(owner, stats, cost, 0.0, model)
+            return
+
+        if self.__free > 0 and not self.__flows:
+            self.__free -= 1
+            self.__begin_turn(owner, model, cost)
+            self.__start(owner, stats, cost, 0.0, model)
+            return
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), max(cost, 0.0), model)
+        if owner not in self.__flows:
+            self.__flows[owner] = _Flow(self.weight(owner))
+        self.__flows[owner].waiters.append(waiter)
+        stats["waiting"] += 1
+        self.__publish(owner, stats)
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            # a slot handed over just as the waiter was cancelled goes on to the next in line
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.__hand_back()
+            else:
+                self.__forget(owner, waiter)
+            stats["waiting"] -= 1
+            self.__publish(owner, stats)
+            raise
+
+        stats["waiting"] -= 1
+        self.__start(owner, stats, waiter.cost, time.perf_counter() - waiter.queued, waiter.model)
+
+    # more tells whether the owner has work left for the model, a turn's slot is only kept for an owner that does
+    def release(self, owner, more=False):
+        stats = self.__stats(owner)
+        stats["running"] = max(0, stats["running"] - 1)
+        stats["seen"] = time.monotonic()
+
+        # others waiting would take the slot before the turn's owner has queued its next piece, so it is kept for it a moment
+        turn_open = self.__turn is not None and self.__turn[0] == owner and self.__turn[2] > 0
+        if more and turn_open and self.__flows and owner not in self.__flows and self.__held is None and self.linger > 0:
+            self.__held = asyncio.get_running_loop().call_later(self.linger, self.__end_hold)
+        else:
+            self.__hand_back()
+        self.__publish(owner, stats)
+        self.__prune()
+
+    def __end_hold(self):
+        self.__held = None
+        self.__turn = None
+        self.__hand_back()
+
+    def __hand_back(self):
+        self.__free += 1
+        self.__dispatch()
+
+    def __start(self, owner, stats, cost, wait, model):
+        stats["running"] += 1
+        stats["served"] += 1
+        stats["cost_seconds"] += cost
+        stats["waits"].append(wait)
+        if model is not None:
+            self.__model = model
+        FAIR_QUEUE_WAIT_SECONDS.labels(self.name, _label(owner)).inc(wait)
+        FAIR_QUEUE_SERVED.labels(self.name, _label(owner)).inc()
+        self.__publish(owner, stats)
+
+    def __forget(self, owner, waiter):
+        flow = self.__flows.get(owner)
+        if flow is not None and waiter in flow.waiters:
+            flow.waiters.remove(waiter)
+            if not flow.waiters:
+                del self.__flows[owner]
+
+    def __dispatch(self):
+        while self.__free > 0 and self.__flows:
+            waiter = self.__next()
+            self.__free -= 1
+            waiter.future.set_result(None)
+
+    def __begin_turn(self, owner, model, cost):
+        if model is not None and model != self.__model:
+            self.__turn = [owner, model, self.model_turn - cost]
+
+    def __take(self, owner, flow):
+        waiter = flow.waiters.popleft()
+        flow.deficit -= waiter.cost
+        if not flow.waiters:
+            del self.__flows[owner]
+        return waiter
+
+    def __next(self):
+        # the owner whose turn it is goes first while its work stays on the turn's model and the turn has seconds left
+        if self.__turn is not None:
+            owner, model, left = self.__turn
+            flow = self.__flows.get(owner)
+            if flow is not None and left > 0 and flow.waiters[0].model == model:
+                self.__turn[2] -= flow.waiters[0].cost
+                return self.__take(owner, flow)
+            self.__turn = None
+
+        while True:
+            owner, flow = next(iter(self.__flows.items()))
+            if not flow.credited:
+                flow.deficit += self.quantum * flow.weight
+                flow.credited = True
+
+            waiter = flow.waiters[0]
+            if flow.deficit >= waiter.cost:
+                # the owner stays at the head, and is served again while its credit lasts
+                self.__begin_turn(owner, waiter.model, waiter.cost)
+                return self.__take(owner, flow)
+
+            flow.credited = False
+            self.__flows.move_to_end(owner)
+
+            # when nobody could be served in a whole round, skip straight to the round in which the first owner can
+            if all(other.credited is False and other.deficit < other.waiters[0].cost for other in self.__flows.values()):
+                rounds = min(math.ceil((other.waiters[0].cost - other.deficit) / (self.quantum * other.weight)) for other in self.__flows.values()) - 1
+                if rounds > 0:
+                    for other in self.__flows.values():
+                        other.deficit += rounds * self.quantum * other.weight
+
+    def __publish(self, owner, stats):
+        label = _label(owner)
+        FAIR_QUEUE_DEPTH.labels(self.name, label).set(sum(other["waiting"] for key, other in self.__owners.items() if _label(key) == label))
+
+    def __prune(self):
+        now = time.monotonic()
+        for owner in [owner for owner, stats in self.__owners.items() if not stats["waiting"] and not stats["running"] and now - stats["seen"] > FAIR_STATS_TTL]:
+            del self.__owners[owner]
+            if any(_label(other) == _label(owner) for other in self.__owners):
+                continue
+            for metric in (FAIR_QUEUE_DEPTH, FAIR_QUEUE_WAIT_SECONDS, FAIR_QUEUE_SERVED):
+                try:
+                    metric.remove(self.name, _label(owner))
+                except KeyError:
+                    pass
+
+    def snapshot(self):
+        return {
+            "slots": self.slots,
+            "free": self.__free,
+            "quantum_seconds": self.quantum,
+            "model": self.__model,
+            "model_turn": {"owner": self.__turn[0], "model": self.__turn[1], "seconds_left": round(self.__turn[2], 3)} if self.__turn else None,
+            "owners": {
+                owner: {
+                    "waiting": stats["waiting"],
+                    "running": stats["running"],
+                    "served": stats["served"],
+                    "cost_seconds": round(stats["cost_seconds"], 3),
+                    "deficit_seconds": round(self.__flows[owner].deficit, 3) if owner in self.__flows else 0.0,
+                    "mean_wait_seconds": round(sum(stats["waits"]) / len(stats["waits"]), 4) if stats["waits"] else None,
+                    "max_wait_seconds": round(max(stats["waits"]), 4) if stats["waits"] else None
+                }
+                for owner, stats in self.__owners.items()
+            }
+        }
@@ -0,0 +1,279 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import namedtuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from utils import FILE_STORAGE
+
+# set to 0 to transcribe every recording in full
+ASR_FINGERPRINT = os.getenv("ASR_FINGERPRINT", "1") == "1"
+# where the landmarks and transcripts of transcribed recordings are kept, and how many landmarks are kept before the oldest recordings
+# go. a landmark takes about 43 bytes on disk and speech gives a few hundred a second, so the default is about 1 GB or 14 hours of audio
+FINGERPRINT_INDEX = os.getenv("FINGERPRINT_INDEX", os.path.join(FILE_STORAGE, "fingerprints.sqlite3"))
+FINGERPRINT_MAX_LANDMARKS = int(os.getenv("FINGERPRINT_MAX_LANDMARKS", "25000000"))
+
+# landmarks are taken from a log spectrogram of the audio at 8 kHz, 64 ms frames every 32 ms
+SAMPLE_RATE = 8000
+FRAME = 512
+HOP = 256
+SECONDS_PER_FRAME = HOP / SAMPLE_RATE
+CHUNK_FRAMES = 2048             # spectrogram frames held in memory at a time
+MIN_BIN = 4                     # bins below ~60 Hz are mostly hum
+
+# a peak has to be the loudest point of its neighbourhood (frames x bins), stand out from the median level of its frame and be louder
+# than PEAK_FLOOR_DB (relative to a full scale sine) so pauses add no peaks. only the loudest PEAKS_PER_FRAME of a frame are kept,
+# every decision is local so that trimming or appending audio keeps the same peaks
+PEAK_NEIGHBOURHOOD = (9, 9)
+PEAK_MIN_DB = 10
+PEAK_FLOOR_DB = -50
+PEAKS_PER_FRAME = 3
+
+# each peak is paired with the next FAN_OUT peaks up to MAX_DT frames later, a pair hashes to (f1, f2, dt // DT_STEP). peaks on a
+# smooth onset move a frame or two with noise, so dt is hashed coarsely and offsets OFFSET_TOLERANCE frames apart are counted together
+FAN_OUT = 10
+MAX_DT = 63
+DT_STEP = 2
+OFFSET_TOLERANCE = 2
+
+# a recording matches when this many landmarks agree on one time offset. a stored segment is reused when this share of the landmarks
+# the stored recording has inside it were found again, the gaps left between reused segments are transcribed if long enough
+MIN_MATCHING_LANDMARKS = 20
+# the best offset is looked for among an evenly spaced sample of this many of the new recording's landmarks. a recording that
+# really shares audio agrees on a share of them at one offset, while chance collisions spread over every offset
+MATCH_SAMPLE_LANDMARKS = 10000
+SEGMENT_COVERAGE = 0.4
+MIN_GAP_SECONDS = 0.5
+
+Match = namedtuple("Match", ["recording", "offset", "times", "landmarks"])    # times: stored frames of the agreeing landmarks
+
+def _resample(samples, sample_rate):
+    if sample_rate == SAMPLE_RATE:
+        return samples
+    # whisper audio is 16 kHz, averaging sample pairs is a cheap low pass before dropping every other one
+    if sample_rate % SAMPLE_RATE == 0:
+        step = sample_rate // SAMPLE_RATE
+        return samples[:len(samples) // step * step].reshape(-1, step).mean(axis=1)
+    count = int(len(samples) * SAMPLE_RATE / sample_rate)
+    return np.interp(np.arange(count) * (sample_rate / SAMPLE_RATE), np.arange(len(samples)), samples).astype(np.float32)
+
+def _running_max(values, size, axis):
+    pad = [(0, 0)] * values.ndim
+    pad[axis] = (size // 2, size // 2)
+    return sliding_window_view(np.pad(values, pad, constant_values=-np.inf), size, axis=axis).max(axis=-1)
+
+def _peaks(spectrogram):
+    # local maxima of the neighbourhood, found with a separable running maximum
+    neighbourhood = _running_max(_running_max(spectrogram, PEAK_NEIGHBOURHOOD[1], 1), PEAK_NEIGHBOURHOOD[0], 0)
+    peaks = (spectrogram == neighbourhood) & (spectrogram > np.median(spectrogram, axis=1, keepdims=True) + PEAK_MIN_DB) & (spectrogram > PEAK_FLOOR_DB)
+    peaks[:, :MIN_BIN] = False
+
+    # the loudest peaks of each frame, the others are masked out by ranking every bin within its frame
+    levels = np.where(peaks, spectrogram, -np.inf)
+    rank = np.argsort(np.argsort(-levels, axis=1), axis=1)
+    return np.nonzero(peaks & (rank < PEAKS_PER_FRAME))
+
+def fingerprint(samples, sample_rate=16000):
+    '''
+    Returns the landmark hashes of a recording and the frame each one starts at. Landmarks are pairs of spectral peaks, so they
+    survive re-encoding, a different microphone and trimming.
+    '''
+    samples = _resample(np.asarray(samples, dtype=np.float32), sample_rate)
+    count = max(0, (len(samples) - FRAME) // HOP + 1)
+    window = np.hanning(FRAME).astype(np.float32)
+    margin = PEAK_NEIGHBOURHOOD[0] // 2
+
+    all_times, all_bins = [], []
+    for first in range(0, count, CHUNK_FRAMES):
+        # chunks overlap by the peak neighbourhood so that peaks near their edges are judged on the same frames
+        start, stop = max(0, first - margin), min(count, first + CHUNK_FRAMES + margin)
+        frames = sliding_window_view(samples[start * HOP:(stop - 1) * HOP + FRAME], FRAME)[::HOP] * window
+        spectrogram = (20 * np.log10(np.abs(np.fft.rfft(frames, axis=1)) / (FRAME / 4) + 1e-9)).astype(np.float32)
+
+        times, bins = _peaks(spectrogram)
+        times = times + start
+        inside = (times >= first) & (times < first + CHUNK_FRAMES)
+        all_times.append(times[inside])
+        all_bins.append(bins[inside])
+
+    if not all_times:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    times, bins = np.concatenate(all_times), np.concatenate(all_bins)
+    order = np.lexsort((bins, times))
+    times, bins = times[order], bins[order]
+
+    hashes, anchors = [], []
+    for k in range(1, FAN_OUT + 1):
+        dt = times[k:] - times[:-k]
+        paired = (dt > 0) & (dt <= MAX_DT)
+        hashes.append((bins[:-k][paired] << 15) | (bins[k:][paired] << 6) | dt[paired] // DT_STEP)
+        anchors.append(times[:-k][paired])
+
+    return np.concatenate(hashes).astype(np.int64), np.concatenate(anchors).astype(np.int64)
+
+def plan_reuse(match, stored_segments, stored_times, duration):
+    '''
+    Splits a recording that matched a stored one into the stored segments it can reuse, moved onto its own timeline, and the
+    (start, end) gaps in seconds that still have to be transcribed.
+    '''
+    offset = match.offset * SECONDS_PER_FRAME       # stored time = new time + offset
+    stored_times = np.sort(stored_times) * SECONDS_PER_FRAME
+    found = np.sort(match.times) * SECONDS_PER_FRAME
+
+    reused = []
+    for segment in stored_segments:
+        start, end = segment["start"] - offset, segment["end"] - offset
+        if start < 0 or end > duration + SECONDS_PER_FRAME:
+            continue
+        # a segment the stored recording has no landmarks in can't be vouched for
+        total = np.searchsorted(stored_times, segment["end"]) - np.searchsorted(stored_times, segment["start"])
+        hits = np.searchsorted(found, segment["end"]) - np.searchsorted(found, segment["start"])
+        if total and hits / total >= SEGMENT_COVERAGE:
+            reused.append({**segment, "start": round(float(start), 3), "end": round(float(min(end, duration)), 3)})
+
+    gaps, position = [], 0.0
+    for segment in reused + [{"start": duration, "end": duration}]:
+        if segment["start"] - position >= MIN_GAP_SECONDS:
+            gaps.append((position, segment["start"]))
+        position = max(position, segment["end"])
+
+    return reused, gaps
+
+class FingerprintIndex:
+    '''
+    The FingerprintIndex class keeps the landmarks of transcribed recordings in SQLite together with their transcript, the ASR model
+    that produced it and the uploaded file it came from, and finds the stored recording a new one shares the most audio with. A file's
+    recordings leave the index with it (see remove()).
+    '''
+
+    def __init__(self, path=FINGERPRINT_INDEX, max_landmarks=FINGERPRINT_MAX_LANDMARKS, enabled=ASR_FINGERPRINT):
+        self.path = path
+        self.enabled = enabled
+        self.max_landmarks = max_landmarks
+        self.__lock = threading.Lock()
+        self.__db = None
+
+    def __connect(self):
+        if self.__db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.__db = sqlite3.connect(self.path, check_same_thread=False)
+            self.__db.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS recordings (id INTEGER PRIMARY KEY, model TEXT NOT NULL, duration REAL NOT NULL, segments TEXT NOT NULL, file_id INTEGER, owner INTEGER, landmarks INTEGER NOT NULL DEFAULT 0);
+                CREATE TABLE IF NOT EXISTS landmarks (hash INTEGER NOT NULL, recording INTEGER NOT NULL, t INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS landmarks_hash ON landmarks (hash);
+                CREATE INDEX IF NOT EXISTS landmarks_recording ON landmarks (recording);
+                CREATE TEMP TABLE query (hash INTEGER NOT NULL, t INTEGER NOT NULL);
+                CREATE INDEX temp.query_hash ON query (hash);
+            """)
+
+            # an index from before recordings were tied to their file can't say whose they are or when to forget them, so it starts over
+            columns = [row[1] for row in self.__db.execute("PRAGMA table_info(recordings)")]
+            if "file_id" not in columns:
+                with self.__db:
+                    self.__db.execute("DELETE FROM landmarks")
+                    self.__db.execute("DELETE FROM recordings")
+                    self.__db.execute("ALTER TABLE recordings ADD COLUMN file_id INTEGER")
+                    self.__db.execute("ALTER TABLE recordings ADD COLUMN owner INTEGER")
+            # the index is capped by landmarks, each recording keeps its count so the total doesn't have to be counted again
+            if "landmarks" not in columns:
+                with self.__db:
+                    self.__db.execute("ALTER TABLE recordings ADD COLUMN landmarks INTEGER NOT NULL DEFAULT 0")
+                    self.__db.execute("UPDATE recordings SET landmarks = (SELECT COUNT(*) FROM landmarks WHERE recording = recordings.id)")
+            self.__db.execute("CREATE INDEX IF NOT EXISTS recordings_file ON recordings (file_id)")
+        return self.__db
+
+    @staticmethod
+    def __delete(db, recordings):
+        for recording in recordings:
+            db.execute("DELETE FROM landmarks WHERE recording = ?", (recording,))
+            db.execute("DELETE FROM recordings WHERE id = ?", (recording,))
+
+    def match(self, hashes, times, model):
+        '''
+        Returns the Match of the recording transcribed by model that most landmarks place at a single time offset from this one, or
+        None when no recording reaches MIN_MATCHING_LANDMARKS. Only segments covering audio the new recording also has are reused, so
+        a match with someone else's upload of the same lecture gives away nothing that wasn't in the new one.
+        '''
+        if not len(hashes):
+            return None
+
+        with self.__lock:
+            db = self.__connect()
+            db.execute("DELETE FROM query")
+            db.executemany("INSERT INTO query VALUES (?, ?)", zip(hashes.tolist(), times.tolist()))
+            # an hour of audio against a full index joins millions of landmarks, so the best offset is counted in SQLite over a sample
+            # of them and only the stored landmarks agreeing with it come back. CROSS JOIN keeps SQLite from scanning every stored
+            # landmark, it has no statistics for the query table
+            best = db.execute("""
+                SELECT l.recording, l.t - q.t AS offset FROM query q
+                CROSS JOIN landmarks l ON l.hash = q.hash
+                CROSS JOIN recordings r ON r.id = l.recording
+                WHERE q.rowid % ? = 0 AND r.model = ?
+                GROUP BY l.recording, offset ORDER BY COUNT(*) DESC LIMIT 1
+            """, (-(-len(hashes) // MATCH_SAMPLE_LANDMARKS), model)).fetchone()
+            if best is None:
+                return None
+
+            recording, offset = best
+            found = db.execute("""
+                SELECT l.t FROM landmarks l
+                CROSS JOIN query q ON q.hash = l.hash
+                WHERE l.recording = ? AND l.t - q.t BETWEEN ? AND ?
+            """, (recording, offset - OFFSET_TOLERANCE, offset + OFFSET_TOLERANCE)).fetchall()
+
+        if len(found) < MIN_MATCHING_LANDMARKS:
+            return None
+
+        return Match(recording, offset, np.array([t for t, in found], dtype=np.int64), len(found))
+
+    def recording(self, recording):
+        '''
+        Returns the transcript segments of a stored recording and the frames of its landmarks.
+        '''
+        with self.__lock:
+            db = self.__connect()
+            row = db.execute("SELECT segments FROM recordings WHERE id = ?", (recording,)).fetchone()
+            times = db.execute("SELECT t FROM landmarks WHERE recording = ?", (recording,)).fetchall()
+        return (json.loads(row[0]) if row else []), np.array([t for t, in times], dtype=np.int64)
+
+    def clear(self):
+        with self.__lock:
+            db = self.__connect()
+            with db:
+                db.execute("DELETE FROM landmarks")
+                db.execute("DELETE FROM recordings")
+
+    def add(self, hashes, times, model, duration, segments, file_id, owner):
+        with self.__lock:
+            db = self.__connect()
+            with db:
+                # a file transcribed again with the same model replaces its earlier transcript
+                self.__delete(db, [row[0] for row in db.execute("SELECT id FROM recordings WHERE file_id = ? AND model = ?", (file_id, model))])
+
+                recording = db.execute(
+                    "INSERT INTO recordings (model, duration, segments, file_id, owner, landmarks) VALUES (?, ?, ?, ?, ?, ?)",
+                    (model, duration, json.dumps(segments), file_id, owner, len(hashes))
+                ).lastrowid
+                db.executemany("INSERT INTO landmarks VALUES (?, ?, ?)", ((hash, recording, t) for hash, t in zip(hashes.tolist(), times.tolist())))
+
+                # the oldest recordings make way once the index holds more than max_landmarks
+                self.__delete(db, [row[0] for row in db.execute("""
+                    SELECT id FROM (SELECT id, SUM(landmarks) OVER (ORDER BY id DESC) AS kept FROM recordings) WHERE kept > ?
+                """, (self.max_landmarks,))])
+        return recording
+
+    def remove(self, file_id):
+        '''
+        Forgets every recording of a deleted file, so its transcript can't be reused any more.
+        '''
+        with self.__lock:
+            db = self.__connect()
+            with db:
+                self.__delete(db, [row[0] for row in db.execute("SELECT id FROM recordings WHERE file_id = ?", (file_id,))])
+
+fingerprint_index = FingerprintIndex()
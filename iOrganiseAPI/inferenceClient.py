@@ -0,0 +1,129 @@
+import os
+import time
+import socket
+from uuid import uuid4
+from contextlib import contextmanager, asynccontextmanager
+
+from inferenceProtocol import InferenceError, send_message, recv_message
+from memoryTracker import InsufficientMemoryError
+from metrics import INFERENCE_CALL_SECONDS
+from utils import model_name
+
+# summaries of long transcripts can take minutes on CPU, the timeout only guards against a hung server
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "1800"))
+
+class RemoteManager:
+    '''
+    The RemoteManager class stands in for a FasterWhisperManager, LlamaCppManager or DistilBertManager living in the inference server.
+    '''
+
+    def __init__(self, loader, model_key, model, batch_size=None):
+        self.__loader = loader
+        self.__model_key = model_key
+        self.__model = model
+        self.__batch_size = batch_size
+
+    def get_model(self):
+        return self.__model
+
+    def transcribe(self, path, file_id=None, owner=None):
+        return self.__loader.call("transcribe", model=self.__model, batch_size=self.__batch_size, path=os.path.abspath(path), file_id=file_id, owner=owner)
+
+    def generate_summary(self, transcript):
+        return self.__loader.call("summarise", model=self.__model, text=transcript)
+
+    def stream_summary(self, transcript):
+        yield from self.__loader.stream("summarise", model=self.__model, text=transcript, stream=True)
+
+    def predict(self, text):
+        return self.__loader.call("predict", text=text)
+
+class RemoteModelLoader:
+    '''
+    The RemoteModelLoader class offers the ModelLoader lease API to an API worker while the models themselves stay resident in the
+    inference server, so any number of workers share one set of models. Files are passed by path, so the workers and the server must
+    see the same filesystem (same host or container, or shared volumes for the file storage and /tmp).
+    '''
+
+    def __init__(self, path):
+        self.__path = path
+
+    def call(self, op, **args):
+        start = time.perf_counter()
+
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(INFERENCE_TIMEOUT)
+                sock.connect(self.__path)
+                send_message(sock, {"id": uuid4().hex, "op": op, "args": args})
+                reply = recv_message(sock)
+        except OSError as e:
+            raise InferenceError(f"Inference server at {self.__path} is unreachable: {e}")
+        finally:
+            INFERENCE_CALL_SECONDS.labels(op).observe(time.perf_counter() - start)
+
+        return self.__result(reply)
+
+    def stream(self, op, **args):
+        '''
+        Like call(), but yields the chunks the server sends ahead of its final reply.
+        '''
+        start = time.perf_counter()
+
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(INFERENCE_TIMEOUT)
+                sock.connect(self.__path)
+                send_message(sock, {"id": uuid4().hex, "op": op, "args": args})
+                reply = recv_message(sock)
+                while reply is not None and "chunk" in reply:
+                    yield reply["chunk"]
+                    reply = recv_message(sock)
+        except OSError as e:
+            raise InferenceError(f"Inference server at {self.__path} is unreachable: {e}")
+        finally:
+            INFERENCE_CALL_SECONDS.labels(op).observe(time.perf_counter() - start)
+
+        self.__result(reply)
+
+    def __result(self, reply):
+        if reply is None:
+            raise InferenceError("Inference server closed the connection without replying")
+
+        if "error" in reply:
+            # memory refusals keep their type so the API still answers them with 503 and Retry-After
+            if reply.get("error_type") == "InsufficientMemoryError":
+                raise InsufficientMemoryError(**reply["details"])
+            raise InferenceError(reply["error"], reply.get("error_type"), reply.get("details"))
+
+        return reply["result"]
+
+    # lease functions, the server holds the real leases for the duration of each call
+    @contextmanager
+    def lease(self, model_key, *args):
+        if model_key == "ASR":
+            model, device, batch_size, compute_type = args
+            yield RemoteManager(self, model_key, model_name(model), batch_size)
+        elif model_key == "LLM":
+            model, device = args
+            yield RemoteManager(self, model_key, model_name(model))
+        else:
+            yield RemoteManager(self, model_key, "distilbert")
+
+    @asynccontextmanager
+    async def lease_async(self, model_key, *args):
+        with self.lease(model_key, *args) as manager:
+            yield manager
+
+    # the server decides what stays resident and evicts idle models when a load needs the memory, so workers never unload models
+    def del_models(self, *model_keys):
+        return self
+
+    def del_all_models(self):
+        return self
+
+    def get_leases(self):
+        return self.status()["leases"]
+
+    def status(self):
+        return self.call("status")
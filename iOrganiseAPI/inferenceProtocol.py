@@ -0,0 +1,61 @@
+import os
+import json
+import struct
+
+# unix socket shared by the inference server and every API worker on the host
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "")
+DEFAULT_SOCKET = "/tmp/iorganise-inference.sock"
+
+# every message is a 4 byte big endian length followed by that many bytes of UTF-8 JSON
+HEADER = struct.Struct(">I")
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+class InferenceError(RuntimeError):
+    def __init__(self, message, error_type="RuntimeError", details=None):
+        self.error_type = error_type
+        self.details = details or {}
+        super().__init__(message)
+
+def encode(message):
+    body = json.dumps(message, default=str).encode()
+    return HEADER.pack(len(body)) + body
+
+def decode_length(header):
+    (length,) = HEADER.unpack(header)
+    if length > MAX_MESSAGE_BYTES:
+        raise InferenceError(f"Inference message of {length} bytes exceeds the {MAX_MESSAGE_BYTES} byte limit")
+    return length
+
+# blocking socket helpers, used by the API workers from threadpool threads
+def send_message(sock, message):
+    sock.sendall(encode(message))
+
+def recv_message(sock):
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    return json.loads(_recv_exactly(sock, decode_length(header)))
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            if chunks:
+                raise InferenceError("Inference server closed the connection mid-message")
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+# asyncio stream helpers, used by the inference server
+async def read_message(reader):
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except Exception:
+        return None
+    return json.loads(await reader.readexactly(decode_length(header)))
+
+async def write_message(writer, message):
+    writer.write(encode(message))
+    await writer.drain()
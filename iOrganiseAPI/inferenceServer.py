@@ -0,0 +1,271 @@
+import os
+import time
+import signal
+import asyncio
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from modelLoader import ModelLoader
+from memoryTracker import memory_tracker, InsufficientMemoryError
+from admissionController import admission_controller
+from cpuManager import cpu_manager
+from warmup import Warmup
+from inferenceProtocol import DEFAULT_SOCKET, INFERENCE_SOCKET, read_message, write_message
+from metrics import QUEUE_DEPTH, INFERENCE_BATCH_SIZE, INFERENCE_QUEUE_SECONDS
+from logger import get_logger
+from utils import model_name
+from prometheus_client import start_http_server
+
+import torch
+
+logger = get_logger(__name__)
+
+DEVICE, COMPUTE_TYPE = ("cuda", "float16") if torch.cuda.is_available() else ("cpu", "int8")
+
+# how many queued requests for one model are served together, and how long the first one waits for company
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "8"))
+INFERENCE_BATCH_WAIT = float(os.getenv("INFERENCE_BATCH_WAIT_MS", "10")) / 1000
+# the server is a separate process, so its prometheus metrics are exposed on their own port (0 disables)
+INFERENCE_METRICS_PORT = int(os.getenv("INFERENCE_METRICS_PORT", "0"))
+
+# op -> model key whose queue serves it
+OPS = {"transcribe": "ASR", "summarise": "LLM", "predict": "BERT"}
+
+Job = namedtuple("Job", ["op", "model_args", "payload", "future", "queued_at"])
+
+class InferenceServer:
+    '''
+    The InferenceServer class owns the only ModelLoader on the host and serves inference to any number of API workers over a Unix socket.
+
+    Every model key has its own request queue. A worker per queue drains whatever has piled up (up to INFERENCE_MAX_BATCH requests),
+    takes one lease per model variant in the batch and runs the batch on it, so a burst of requests is served by one resident model
+    instead of one copy per API worker.
+    '''
+
+    def __init__(self, path, max_batch=INFERENCE_MAX_BATCH, batch_wait=INFERENCE_BATCH_WAIT):
+        self.__path = path
+        self.__max_batch = max_batch
+        self.__batch_wait = batch_wait
+        self.__loader = ModelLoader()
+        self.__warmup = Warmup(self.__loader, DEVICE, COMPUTE_TYPE)
+        self.__queues = {}
+        self.__served = {model_key: 0 for model_key in OPS.values()}
+
+    async def serve(self, ready=None):
+        self.__queues = {model_key: asyncio.Queue() for model_key in OPS.values()}
+        workers = [asyncio.create_task(self.__worker(model_key)) for model_key in self.__queues]
+
+        if os.path.exists(self.__path):
+            os.unlink(self.__path)
+        server = await asyncio.start_unix_server(self.__handle, path=self.__path)
+        os.chmod(self.__path, 0o660)
+        logger.info("inference server listening", extra={"socket": self.__path, "device": DEVICE, "max_batch": self.__max_batch})
+
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        if ready:
+            ready()
+
+        # requests are served while the models warm up, the API workers' readiness probes report when they are done
+        self.__warmup.start()
+
+        async with server:
+            await stop.wait()
+
+        await self.__warmup.stop()
+        for worker in workers:
+            worker.cancel()
+        self.__loader.del_all_models()
+        if os.path.exists(self.__path):
+            os.unlink(self.__path)
+
+    # connections are long lived and may carry several requests at once, replies are matched to requests by id
+    async def __handle(self, reader, writer):
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+
+                task = asyncio.create_task(self.__dispatch(message, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def __dispatch(self, message, writer, write_lock):
+        loop = asyncio.get_running_loop()
+
+        # called from the inference thread, streamed summaries send every chunk as its own message ahead of the final reply
+        def send_chunk(text):
+            asyncio.run_coroutine_threadsafe(self.__write(writer, write_lock, {"id": message.get("id"), "chunk": text}), loop)
+
+        try:
+            reply = {"id": message.get("id"), "result": await self.__execute(message.get("op"), message.get("args", {}), send_chunk)}
+        except InsufficientMemoryError as e:
+            reply = {"id": message.get("id"), "error": str(e), "error_type": "InsufficientMemoryError", "details": {"model_key": e.model_key, "model": e.model, "required": e.required, "available": e.available}}
+        except Exception as e:
+            reply = {"id": message.get("id"), "error": str(e), "error_type": type(e).__name__}
+
+        await self.__write(writer, write_lock, reply)
+
+    async def __write(self, writer, write_lock, reply):
+        async with write_lock:
+            try:
+                await write_message(writer, reply)
+            except ConnectionError:
+                logger.warning("inference client went away before its reply", extra={"id": reply.get("id")})
+
+    async def __execute(self, op, args, send_chunk=None):
+        if op == "status":
+            return self.status()
+
+        if op not in OPS:
+            raise ValueError(f"Unknown inference op: {op}")
+
+        model_key = OPS[op]
+        if model_key == "ASR":
+            model_args = (args["model"], DEVICE, args.get("batch_size", 16), COMPUTE_TYPE)
+            payload = (args["path"], args.get("file_id"), args.get("owner"))
+        elif model_key == "LLM":
+            model_args = (args["model"], DEVICE)
+            payload = (args["text"], send_chunk if args.get("stream") else None)
+        else:
+            model_args = ()
+            payload = args["text"]
+
+        future = asyncio.get_running_loop().create_future()
+        await self.__queues[model_key].put(Job(op, model_args, payload, future, time.perf_counter()))
+        QUEUE_DEPTH.labels(f"inference_{model_key}").set(self.__queues[model_key].qsize())
+
+        return await future
+
+    async def __worker(self, model_key):
+        queue = self.__queues[model_key]
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await queue.get()]
+
+            # give requests that are already on their way a moment to join the batch
+            deadline = loop.time() + self.__batch_wait
+            while len(batch) < self.__max_batch:
+                try:
+                    batch.append(queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            QUEUE_DEPTH.labels(f"inference_{model_key}").set(queue.qsize())
+
+            # a batch may mix model variants (e.g. small and medium whisper), each variant is run under its own lease
+            groups = {}
+            for job in batch:
+                groups.setdefault(job.model_args, []).append(job)
+
+            for model_args, jobs in groups.items():
+                INFERENCE_BATCH_SIZE.labels(model_key).observe(len(jobs))
+                for job in jobs:
+                    INFERENCE_QUEUE_SECONDS.labels(model_key).observe(time.perf_counter() - job.queued_at)
+
+                try:
+                    results = await asyncio.to_thread(self.__run, model_key, model_args, [job.payload for job in jobs])
+                except Exception as e:
+                    results = [e] * len(jobs)
+
+                for job, result in zip(jobs, results):
+                    if job.future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        job.future.set_exception(result)
+                    else:
+                        job.future.set_result(result)
+
+                self.__served[model_key] += len(jobs)
+
+    # runs in a worker thread, returns one result (or exception) per payload
+    def __run(self, model_key, model_args, payloads):
+        with self.__loader.lease(model_key, *model_args) as manager:
+            if model_key == "BERT":
+                return [int(label) for label in manager.predict_batch(payloads)]
+
+            # summaries are submitted together so the batched engine decodes them in shared steps, the single engine takes them in turn.
+            # no more threads than the engine decodes at once, the rest would only wait on it
+            if model_key == "LLM":
+                with ThreadPoolExecutor(min(len(payloads), admission_controller.queue("LLM").concurrency)) as pool:
+                    futures = [pool.submit(self.__summarise, manager, *payload) for payload in payloads]
+                return [future.exception() or future.result() for future in futures]
+
+            results = []
+            for payload in payloads:
+                try:
+                    results.append(manager.transcribe(*payload))
+                except Exception as e:
+                    results.append(e)
+            return results
+
+    @staticmethod
+    def __summarise(manager, text, send_chunk):
+        if send_chunk is None:
+            return manager.generate_summary(text)
+
+        parts = []
+        for part in manager.stream_summary(text):
+            send_chunk(part)
+            parts.append(part)
+        return "".join(parts)
+
+    def status(self):
+        loaded = {}
+        for model_key in self.__queues:
+            manager = self.__loader.get_model(model_key)
+            if manager is not None:
+                loaded[model_key] = model_name(manager.get_model())
+
+        return {
+            "pid": os.getpid(),
+            "device": DEVICE,
+            "loaded_models": loaded,
+            "leases": self.__loader.get_leases(),
+            "queue_depth": {model_key: queue.qsize() for model_key, queue in self.__queues.items()},
+            "served": dict(self.__served),
+            "memory": memory_tracker.snapshot(),
+            "cpu": cpu_manager.snapshot(),
+            "warmup": self.__warmup.snapshot()
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the iOrganise models to API workers over a Unix socket.")
+    parser.add_argument("--socket", default=INFERENCE_SOCKET or DEFAULT_SOCKET, help="path of the Unix socket to listen on")
+    parser.add_argument("--max-batch", type=int, default=INFERENCE_MAX_BATCH, help="most queued requests served together per model")
+    parser.add_argument("--batch-wait-ms", type=float, default=INFERENCE_BATCH_WAIT * 1000, help="how long a request waits for others to batch with")
+    parser.add_argument("--metrics-port", type=int, default=INFERENCE_METRICS_PORT, help="port serving prometheus metrics (0 disables)")
+    args = parser.parse_args(argv)
+
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+
+    server = InferenceServer(args.socket, max_batch=args.max_batch, batch_wait=args.batch_wait_ms / 1000)
+    asyncio.run(server.serve())
+
+if __name__ == "__main__":
+    main()
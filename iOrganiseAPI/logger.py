@@ -0,0 +1,41 @@
+import os
+import json
+import logging
+from datetime import datetime, timezone
+
+# attributes present on every LogRecord, anything else passed through `extra` is treated as a structured field
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    '''
+    The JsonFormatter class renders log records as single line JSON objects so that log fields can be queried instead of grepped.
+    '''
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+def get_logger(name: str) -> logging.Logger:
+    # configure the root "iorganise" logger once, child loggers propagate to it
+    root = logging.getLogger("iorganise")
+    if not root.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+        root.addHandler(handler)
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        root.propagate = False
+
+    return logging.getLogger(name if name.startswith("iorganise") else f"iorganise.{name}")
@@ -1,9 +1,11 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Form, Query
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, Response, JSONResponse, StreamingResponse
 
 import os
+import json
 import zipfile
 import aiofiles
 from io import BytesIO
@@ -12,29 +14,50 @@ import re
 import torch
 
 import io
+import time
+import asyncio
 import requests
 
-from database import create_tables, db_create, db_get, db_get_by_id, db_get_by_attribute, db_update, db_delete
+from database import create_tables, get_db, db_scope, db_create, db_get, db_get_by_id, db_get_by_attribute, db_update, db_delete
 
 from model.User import User
 from model.FileUpload import FileUpload
 from model.UserSetting import UserSetting
 from model.SharedFile import SharedFile
+from model.DerivedArtefact import DerivedArtefact
 
 import subprocess
+from contextlib import asynccontextmanager, AsyncExitStack
 from typing import List, Optional
 from tempfile import NamedTemporaryFile
 
 from enums.SubjectTypes import SubjectTypes
 
 from utils import *
-from modelLoader import ModelLoader
+from inferenceProtocol import INFERENCE_SOCKET, InferenceError
+from metrics import *
+from logger import get_logger
+from profiler import span, start_profile, stop_profile, profile_path
+from memoryTracker import memory_tracker, InsufficientMemoryError
+from cpuManager import cpu_manager
+from warmup import Warmup
+from admissionController import admission_controller, AdmissionTicket, AdmissionRejected, media_seconds
+from asrPolicy import asr_policy, Tier
+from transcriptStore import TranscriptReader, transcript_path, write_transcript
+from derivationScheduler import DerivationScheduler, DERIVE_ON_UPLOAD
+from pipeline import Pipeline
+from speechProbe import SPEECH_PROBE, probe, worth_transcribing
+from fingerprint import fingerprint_index
+from derivedArtefacts import content_producer, classifier_producer, summary_producer, get_artefacts, is_current, record_artefact, hash_file, hash_text
 from dto.RegisterDTO import RegisterDTO
 from dto.UpdateSettingDTO import UpdateSettingDTO
 from dto.ShareFilesDTO import ShareFilesDTO
 from dto.TranscribeAudioDTO import TranscribeAudioDTO
 
-app = FastAPI()
+# every request gets one database session for all of its queries, see db_scope() in database.py
+app = FastAPI(dependencies=[Depends(get_db)])
+
+logger = get_logger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
@@ -52,14 +75,178 @@ app.add_middleware(
 )
 
 
-model_loader = ModelLoader()
+# with INFERENCE_SOCKET set the models live in the shared inference server (inferenceServer.py) instead of this worker
+if INFERENCE_SOCKET:
+    from inferenceClient import RemoteModelLoader
+    model_loader = RemoteModelLoader(INFERENCE_SOCKET)
+else:
+    from modelLoader import ModelLoader
+    model_loader = ModelLoader()
 DEVICE, COMPUTE_TYPE = ("cuda", "float16") if torch.cuda.is_available() else ("cpu", "int8")
+# the inference server warms its own models up, see inferenceServer.py
+warmup = None if INFERENCE_SOCKET else Warmup(model_loader, DEVICE, COMPUTE_TYPE)
 # Hugging Face API endpoint for OCR
-HUGGING_FACE_URL = "https://fiamenova-aap.hf.space/predict/"
+HUGGING_FACE_URL = os.getenv("OCR_URL", "https://fiamenova-aap.hf.space/predict/")
+# labels of the subject classifier
+SUBJECT_LABELS = {
+    0: SubjectTypes.math,
+    1: SubjectTypes.english,
+    2: SubjectTypes.science
+}
+# the classifier only reads the first 256 wordpieces, /predict-text stops extracting a file once it has this many estimated tokens
+CLASSIFY_TOKEN_BUDGET = int(os.getenv("CLASSIFY_TOKEN_BUDGET", "1024"))
 
 @app.on_event("startup")
 async def on_startup():
     await create_tables()
+    if warmup is not None:
+        warmup.start()
+    if DERIVE_ON_UPLOAD:
+        derivation_scheduler.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if warmup is not None:
+        await warmup.stop()
+    await derivation_scheduler.stop()
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    db_stats = start_request_db_stats()
+    memory_stats = memory_tracker.start_request()
+    start = time.perf_counter()
+    status = 500
+
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # label by route template rather than raw path so ids don't explode the label cardinality
+        route = request.scope.get("route")
+        endpoint_label = getattr(route, "path", request.url.path)
+        elapsed = time.perf_counter() - start
+
+        REQUESTS_IN_FLIGHT.dec()
+        REQUEST_SECONDS.labels(request.method, endpoint_label, str(status)).observe(elapsed)
+        DB_QUERIES_PER_REQUEST.labels(endpoint_label).observe(db_stats["queries"])
+        DB_SECONDS_PER_REQUEST.labels(endpoint_label).observe(db_stats["seconds"])
+        memory_tracker.finish_request(memory_stats, endpoint_label)
+
+        logger.info("request served", extra={
+            "method": request.method,
+            "endpoint": endpoint_label,
+            "status": status,
+            "seconds": round(elapsed, 4),
+            "db_queries": db_stats["queries"],
+            "db_seconds": round(db_stats["seconds"], 4),
+            "peak_rss_mb": memory_stats["peak"] // (1024 * 1024)
+        })
+
+# profiling is opt-in per request (?profile=1 or "X-Profile: 1") and restricted to admins
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    if request.headers.get("x-profile") != "1" and request.query_params.get("profile") != "1":
+        return await call_next(request)
+
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    try:
+        user = await db_get_by_id(User, verify_jwt_token(token)) if scheme.lower() == "bearer" else None
+    except HTTPException:
+        user = None
+
+    if not is_admin(user):
+        return JSONResponse(status_code=403, content={"detail": "Profiling is restricted to administrators"})
+
+    profile = start_profile(f"{request.method} {request.url.path}")
+    try:
+        response = await call_next(request)
+    finally:
+        profile_id = stop_profile(profile)
+        logger.info("request profiled", extra={"profile_id": profile_id, "endpoint": request.url.path, "seconds": round(profile.duration, 4)})
+
+    response.headers["X-Profile-Id"] = profile_id
+    response.headers["Server-Timing"] = ", ".join(
+        f"{name.replace(':', '-')};dur={seconds * 1000:.1f}" for name, seconds in profile.span_totals().most_common()
+    )
+    return response
+
+# a model that doesn't fit in memory is refused instead of letting the OOM killer take the whole container down
+@app.exception_handler(InsufficientMemoryError)
+async def insufficient_memory_handler(request: Request, exc: InsufficientMemoryError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "30"})
+
+# inference endpoints are admitted before doing any work, overload is answered with 429/503 instead of piling up
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+# model slots are shared fairly between the users the work belongs to, and between client addresses for requests without a token
+def ticket_owner(request: Request):
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            return f"user:{verify_jwt_token(token)}"
+        except HTTPException:
+            pass
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+# hands the admitted work back when the request ends, including stages that never ran
+async def get_admission_ticket(request: Request):
+    ticket = admission_controller.ticket(ticket_owner(request))
+    try:
+        yield ticket
+    finally:
+        if not ticket.streaming:
+            ticket.release()
+
+# streamed summaries are sent as server-sent events. the body is iterated after the endpoint has returned, so errors become an
+# error event and the response releases the admission ticket once the last event is out
+def event_stream(events, ticket):
+    ticket.streaming = True
+
+    async def body():
+        try:
+            async for event, data in events:
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            status_code = 503 if isinstance(e, InsufficientMemoryError) else getattr(e, "status_code", 500)
+            logger.error("streamed response failed", extra={"status": status_code, "error": str(e)})
+            yield f"event: error\ndata: {json.dumps({'status': status_code, 'detail': str(getattr(e, 'detail', e))})}\n\n"
+        finally:
+            ticket.release()
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def get_admin_user(token: str = Depends(oauth2_scheme)):
+    user = await db_get_by_id(User, verify_jwt_token(token))
+    if not is_admin(user):
+        raise HTTPException(status_code=403, detail="Administrator access required")
+    return user
+
+# liveness: the process is up and serving requests
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+# readiness: 503 until the models in WARMUP_MODELS are loaded and warmed up (or failed to), with the state of each
+@app.get("/readyz")
+async def readyz():
+    if warmup is not None:
+        status = warmup.snapshot()
+    else:
+        try:
+            status = (await run_in_threadpool(model_loader.status))["warmup"]
+        except InferenceError as e:
+            return JSONResponse(status_code=503, content={"ready": False, "detail": str(e)})
+
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/metrics")
+async def get_metrics():
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
 
 @app.post("/register")
 async def register(form_data: RegisterDTO):
@@ -69,14 +256,14 @@ async def register(form_data: RegisterDTO):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # hash password
-    hashed_password = hash_password(form_data.password)
+    hashed_password = await hash_password_async(form_data.password)
     
     # create new user
     user = User(name=form_data.name, email=form_data.email, password=hashed_password)
     response = await db_create(user)
     user_setting = UserSetting(asr_model="small_sg", llm="deepseek_14b", user=user)
     await db_create(user_setting)
-    os.makedirs(os.path.join("/app/file_storage", user.email), exist_ok=True)
+    os.makedirs(os.path.join(FILE_STORAGE, user.email), exist_ok=True)
     
     return {"msg": "User created successfully", "user": response}
 
@@ -84,7 +271,7 @@ async def register(form_data: RegisterDTO):
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     # fetch user by email
     existing_user = (await db_get_by_attribute(User, "email", form_data.username) or [None])[0]
-    if not existing_user or not verify_password(form_data.password, existing_user.password):
+    if not existing_user or not await verify_password_async(form_data.password, existing_user.password):
         raise HTTPException(status_code=401, detail="Invalid login credentials")
     
     # create JWT token for user
@@ -134,7 +321,7 @@ async def update_setting(id: int, form_data: UpdateSettingDTO, token: str = Depe
         raise HTTPException(status_code=400, detail="Email already registered")
 
     # hash password
-    hashed_password = hash_password(form_data.password)
+    hashed_password = await hash_password_async(form_data.password)
 
     new_user = {
         "name": form_data.name,
@@ -150,9 +337,16 @@ async def update_setting(id: int, form_data: UpdateSettingDTO, token: str = Depe
     response_user = await db_update(User, user_id, new_user)
     user_status = {"status": "User updated successfully"} if response_user else {"status": "Failed"}
 
+    previous_models = (user_setting.asr_model, user_setting.llm)
     response_setting = await db_update(UserSetting, id, new_setting)
     setting_status = {"status": "UserSetting updated successfully"} if response_setting else {"status": "Failed"}
 
+    # files derived with the old models are re-processed in the background, only the stages those models produced are redone
+    if response_setting and DERIVE_ON_UPLOAD and previous_models != (response_setting.asr_model, response_setting.llm):
+        for file in await db_get_by_attribute(FileUpload, "user_id", user_id) or []:
+            if file.content_path:
+                derivation_scheduler.submit(file.id, user_id)
+
     return {
         "user_msg": user_status,
         "setting_msg": setting_status
@@ -167,13 +361,20 @@ async def upload_files(files: List[UploadFile] = File(...), token: str = Depends
         type, size, path = await save_uploaded_file(user.email, file)
 
         file_upload = FileUpload(name=os.path.basename(path), type=type, size=size, path=path, user=user)
-        await db_create(file_upload)
+        response = await db_create(file_upload)
+
+        # extracted, classified and summarised in the background once the node is idle
+        if response and DERIVE_ON_UPLOAD:
+            derivation_scheduler.submit(response.id, user.id)
+
+    derivation_scheduler.touch(user_id)
 
     return {"msg": "Files uploaded successfully"}
 
 @app.get("/get-files")
 async def get_files(token: str = Depends(oauth2_scheme), name: Optional[str] = Query(None), subject: Optional[str] = Query(None)):
     user_id = verify_jwt_token(token)
+    derivation_scheduler.touch(user_id)
     file_upload_list = await db_get_by_attribute(FileUpload, "user_id", user_id)
     shared_file_list = [
         await db_get_by_id(FileUpload, shared.file_id)
@@ -206,11 +407,16 @@ async def delete_file(id: int, token: str = Depends(oauth2_scheme)):
     if file is None:
         raise HTTPException(status_code=404, detail="Requested file not found or authorised for deletion")
     
+    derivation_scheduler.discard(id)
+    # its transcript must not be reused once the file is gone
+    await run_in_threadpool(fingerprint_index.remove, id)
     try:
         os.remove(file.path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error removing file from storage: {e}")
     
+    for artefact in await db_get_by_attribute(DerivedArtefact, "file_id", id) or []:
+        await db_delete(DerivedArtefact, artefact.id)
     await db_delete(FileUpload, id)
     shared_file_list = await db_get_by_attribute(SharedFile, "file_id", id)
     for shared_file in shared_file_list:
@@ -315,7 +521,7 @@ async def share_files(form_data: ShareFilesDTO = Depends(), token: str = Depends
     if not shared_file_list:
         raise HTTPException(status_code=400, detail="Files have already been shared with the specified users")
 
-    print("Shared File List:", shared_file_list)
+    logger.info("sharing files", extra={"user_id": user_id, "shares": len(shared_file_list)})
     
     for shared_file in shared_file_list:
         await db_create(shared_file)
@@ -335,177 +541,467 @@ async def unshare_file(id: int, token: str = Depends(oauth2_scheme)):
 
     return {"msg": "Files unshared successfully"}
 
+# smart-upload runs each batch as a pipeline (see pipeline.py): files move from ffmpeg, ASR, OCR or document extraction on to
+# classification and summarisation one by one, so network, disk and model work overlap. "sequential" runs one stage at a time instead.
+SMART_UPLOAD_PIPELINE = os.getenv("SMART_UPLOAD_PIPELINE", "concurrent")
+# workers of the stages that mostly wait on the OCR service, ffmpeg or the disk
+PIPELINE_IO_WORKERS = int(os.getenv("PIPELINE_IO_WORKERS", "4"))
+# first stage of each kind of file, anything else is stored without processing
+SMART_UPLOAD_ENTRY = {"video": "ffmpeg", "audio": "asr", "image": "ocr", "application": "extract"}
+
+# extracts the audio of a video to a temporary mp3, faster-whisper then reads the audio instead of demuxing the video. the caller
+# removes the file
+async def extract_audio(path):
+    with NamedTemporaryFile(suffix=".mp3", delete=False) as audio_temp:
+        audio_path = audio_temp.name
+    try:
+        with track_stage("ffmpeg"):
+            await run_in_threadpool(subprocess.run, ["ffmpeg", "-y", "-i", path, audio_path], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except BaseException:
+        os.remove(audio_path)
+        raise
+    return audio_path
+
+# the audio of a video while it is transcribed, removed afterwards
+@asynccontextmanager
+async def extracted_audio(path):
+    audio_path = await extract_audio(path)
+    try:
+        yield audio_path
+    finally:
+        os.remove(audio_path)
+
+def smart_upload_pipeline(user, user_setting, ticket, tier):
+    pipeline = Pipeline("smart_upload", sequential=SMART_UPLOAD_PIPELINE == "sequential")
+
+    # every file takes its own turn on a model and only leases it while it is processed, so other users' requests are served between
+    # the files of a batch (see fairQueue.py). a stage's resource hands out those turns, the model stays loaded from the first file
+    # that reaches the stage until no more can, then is unloaded as before
+    @asynccontextmanager
+    async def model(model_key, *args):
+        @asynccontextmanager
+        async def turn(units):
+            async with ticket.stage(model_key, units, args[0] if args else None), model_loader.lease_async(model_key, *args) as manager:
+                yield manager
+
+        yield turn
+        model_loader.del_models(model_key)
+
+    # the LLM loads next to the other models when they all fit in memory, otherwise once ASR and classification are done with theirs.
+    # the loader then makes room by unloading idle models only, a model another request holds a lease on stays
+    @asynccontextmanager
+    async def summariser():
+        @asynccontextmanager
+        async def turn(units):
+            async with ticket.stage("LLM", units, user_setting.llm), AsyncExitStack() as stack:
+                try:
+                    manager = await stack.enter_async_context(model_loader.lease_async("LLM", user_setting.llm, DEVICE))
+                except InsufficientMemoryError:
+                    await pipeline.wait_closed("asr", "classify")
+                    manager = await stack.enter_async_context(model_loader.lease_async("LLM", user_setting.llm, DEVICE))
+                yield manager
+
+        yield turn
+        model_loader.del_models("LLM")
+
+    # the audio of a video is extracted ahead of the ASR stage, which removes it once transcribed
+    async def decode(item, _):
+        item["audio"] = await extract_audio(item["path"])
+        return "asr"
+
+    async def transcribe(item, turn):
+        try:
+            async with turn(item["audio_seconds"]) as transcription_manager:
+                transcript = await run_in_threadpool(transcription_manager.transcribe, item.get("audio") or item["path"], item["id"], user.id)
+        finally:
+            if item.get("audio") and os.path.exists(item["audio"]):
+                os.remove(item["audio"])
+
+        item["content"] = format_transcript(transcript.get("segments"))
+        await save_transcript(user, item["id"], item["name"], transcript.get("segments"))
+        return "classify"
+
+    # Extract text from image files
+    async def ocr(item, _):
+        async with aiofiles.open(item["path"], "rb") as image_file:
+            image_bytes = await image_file.read()
+
+        # Send the image to Hugging Face API
+        with track_stage("ocr"):
+            response = await run_in_threadpool(requests.post, HUGGING_FACE_URL, files={"image": image_bytes})
+
+        if response.status_code != 200:
+            logger.error("ocr request failed", extra={"file_id": item["id"], "status": response.status_code, "body": response.text})
+            return None
+
+        item["content"] = response.json()["prediction"]  # Extract the prediction from the response
+        return "classify"
+
+    async def extract(item, _):
+        logger.info("processing document", extra={"file_id": item["id"], "file_name": item["name"]})
+
+        # Check file type and extract text accordingly
+        file_type = get_file_type(item["path"])
+        with track_stage("extraction"):
+            if file_type == "application/pdf":
+                item["content"] = await run_in_threadpool(extract_text_from_pdf, item["path"]) or None
+            elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+                item["content"] = await run_in_threadpool(extract_text_from_docx, item["path"]) or None
+
+        return "classify" if item["content"] else None
+
+    # subject classification, the content is stored first so it survives a failed summary
+    async def classify(item, turn):
+        await save_content(user, item["id"], item["name"], item["path"], item["content"], content_producer(item["path"], tier.model))
+
+        try:
+            async with turn(1) as classification_manager:
+                predicted_label = await run_in_threadpool(classification_manager.predict, item["content"])  # This returns 0, 1, or 2
+            if predicted_label in SUBJECT_LABELS:
+                await save_subject(item["id"], item["content"], SUBJECT_LABELS[predicted_label])
+                logger.info("file classified", extra={"file_id": item["id"], "file_name": item["name"], "subject": SUBJECT_LABELS[predicted_label].value})
+            else:
+                # Handle case where prediction doesn't match any mapping
+                logger.warning("unknown subject label", extra={"file_id": item["id"], "label": int(predicted_label)})
+        except Exception as e:
+            # summarise the file all the same
+            logger.error("classification failed", extra={"file_id": item["id"], "file_name": item["name"], "error": str(e)})
+
+        return "summarise"
+
+    # content summary (final stage)
+    async def summarise(item, turn):
+        async with turn(1) as llama_cpp_manager:
+            summary = await run_in_threadpool(llama_cpp_manager.generate_summary, item["content"])
+        await save_summary(user, item["id"], item["name"], item["content"], summary, user_setting.llm)
+
+    pipeline.stage("ffmpeg", decode, workers=PIPELINE_IO_WORKERS)
+    pipeline.stage("asr", transcribe, upstream=("ffmpeg",), resource=lambda: model("ASR", tier.model, DEVICE, 16, COMPUTE_TYPE))
+    pipeline.stage("ocr", ocr, workers=PIPELINE_IO_WORKERS)
+    pipeline.stage("extract", extract, workers=min(PIPELINE_IO_WORKERS, os.cpu_count() or 1))
+    pipeline.stage("classify", classify, upstream=("asr", "ocr", "extract"), resource=lambda: model("BERT"))
+    # every summary can be in flight at once so an engine with parallel slots decodes them together
+    pipeline.stage("summarise", summarise, workers=admission_controller.queue("LLM").concurrency, upstream=("classify",), resource=summariser, bounded=False)
+
+    return pipeline
+
+# reads the streams of each audio/video upload and how much of it sounds like speech, a few at a time alongside each other
+async def probe_speech(items):
+    limit = asyncio.Semaphore(PIPELINE_IO_WORKERS)
+
+    async def check(item):
+        async with limit:
+            with track_stage("speech_probe"):
+                item["probe"] = await run_in_threadpool(probe, item["path"])
+        item["speech"] = worth_transcribing(item["probe"])
+        if item["probe"].duration is not None:
+            item["audio_seconds"] = item["probe"].duration
+        SPEECH_PROBES.labels(item["probe"].verdict).inc()
+        if item["probe"].speech_ratio is not None:
+            SPEECH_RATIO.observe(item["probe"].speech_ratio)
+
+    await asyncio.gather(*(check(item) for item in items))
+
 @app.post("/smart-upload")
-async def smart_upload(files: List[UploadFile] = File(...), token: str = Depends(oauth2_scheme)):
+async def smart_upload(files: List[UploadFile] = File(...), token: str = Depends(oauth2_scheme), ticket: AdmissionTicket = Depends(get_admission_ticket)):
     user_id = verify_jwt_token(token)
     user = await db_get_by_id(User, user_id)
     user_setting = next(iter(await db_get_by_attribute(UserSetting, "user_id", user_id)), None)
 
+    # every file may be transcribed, classified and summarised
+    durations = [media_seconds(file.content_type, file.size, file.filename, file.file) for file in files]
+    ticket.reserve({
+        "ASR": sum(durations),
+        "BERT": len(files),
+        "LLM": len(files)
+    })
+
     # upload files
-    myList = []
-    for file in files:
+    items = []
+    for file, seconds in zip(files, durations):
         type, size, path = await save_uploaded_file(user.email, file)
 
         file_upload = FileUpload(name=os.path.basename(path), type=type, size=size, path=path, user=user)
         response = await db_create(file_upload)
 
         if response:
-            myList.append((response.id, response.name, response.type, response.path))
-
-    # bucket sort based on MIME type for later processing
-    buckets = {"video": [], "audio": [], "image": [], "application": [], "other": []}
-
-    for file_id, file_name, file_type, file_path in myList:
-        category = file_type.split("/")[0] if file_type and file_type.split("/")[0] in buckets else "other"
-        buckets[category].append((file_id, file_name, file_path, category))
-
-    # file processing (1st stage)
-    myList = []
-    # extract audio from audio/video files
-    if buckets["video"] or buckets["audio"]:
-        transcription_manager = model_loader.load_asr(user_setting.asr_model, DEVICE, 16, COMPUTE_TYPE)
-
-        for file_id, file_name, file_path, category in buckets["video"] + buckets["audio"]:
-            try:
-                if category == "video":
-                    with NamedTemporaryFile(delete=True) as audio_temp:
-                        extracted_audio_path = audio_temp.name + ".mp3"
-                        subprocess.run(["ffmpeg", "-i", file_path, extracted_audio_path], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                        content = "\n".join(
-                            f"Segment {j + 1}: {segment.get('text')}"
-                            for j, segment in enumerate(transcription_manager.transcribe(file_path).get("segments"))
-                        )
-
-                if category == "audio":
-                    content = "\n".join(
-                        f"Segment {j + 1}: {segment.get('text')}"
-                        for j, segment in enumerate(transcription_manager.transcribe(file_path).get("segments"))
-                    )
-
-                myList.append((file_id, file_name, file_path, category, content))
-
-            except Exception as e:
-                print(f"Error processing file {file_name}: {e}")
+            items.append({"id": response.id, "name": response.name, "path": response.path, "category": (response.type or "").split("/")[0], "content": None, "audio_seconds": seconds})
+
+    if not items:
+        return {"msg": "Files uploaded but not processed", "files": []}
+
+    # audio and video are probed for speech first (see speechProbe.py). a recording with no audio track or nothing that sounds like speech
+    # is stored without being transcribed, classified or summarised, and a batch of them never loads an ASR model
+    media = [item for item in items if item["category"] in ("audio", "video")] if SPEECH_PROBE else []
+    if media:
+        await probe_speech(media)
+        skipped = sum(not item["speech"] for item in media)
+        ticket.revise("ASR", sum(item["audio_seconds"] for item in media if item["speech"]))
+        for model_key in ("BERT", "LLM"):
+            ticket.revise(model_key, ticket.units.get(model_key, 0) - skipped)
+
+    # one ASR model for the whole batch
+    audio_seconds = ticket.units.get("ASR", 0)
+    chosen = time.perf_counter()
+    tier = asr_policy.choose(user_setting.asr_model, audio_seconds, ticket, resident_asr_model())
+
+    for item in media:
+        item["speech_probe"] = {
+            "verdict": item["probe"].verdict,
+            "duration": item["probe"].duration,
+            "speech_seconds": item["probe"].speech_seconds,
+            "speech_ratio": item["probe"].speech_ratio,
+            "estimated_asr_seconds": round(item["audio_seconds"] * asr_policy.rate(tier.model), 1) if item["speech"] else 0
+        }
+        logger.info("speech probed", extra={"file_id": item["id"], "file_name": item["name"], **item["speech_probe"]})
+
+    pipeline = smart_upload_pipeline(user, user_setting, ticket, tier)
+    await pipeline.run((SMART_UPLOAD_ENTRY[item["category"]], item) for item in items if item["category"] in SMART_UPLOAD_ENTRY and item.get("speech", True))
+
+    report = pipeline.report()
+    asr = report["stages"].get("asr")
+    if asr and asr["items"]:
+        # the ASR stage finished this long after the pipeline started, which was makespan seconds ago
+        latency = time.perf_counter() - chosen - report["makespan"] + asr["finished"]
+        asr_policy.observe(tier, audio_seconds, asr["busy_seconds"], latency)
+        for item in items:
+            if item["category"] in ("audio", "video") and item["content"]:
+                upgrade_draft(tier, item["id"], user_id)
+    PIPELINE_MAKESPAN_SECONDS.labels(pipeline.name, "sequential" if pipeline.sequential else "concurrent").observe(report["makespan"])
+    logger.info("smart upload processed", extra={"files": len(items), **report})
+
+    return {"msg": "Files uploaded & processed", "files": [upload_result(item, pipeline) for item in items]}
+
+# what became of each file of a /smart-upload, with the probe's findings for audio and video so it is clear why one has no transcript
+def upload_result(item, pipeline):
+    result = {"id": item["id"], "name": item["name"]}
+    if "speech_probe" in item:
+        result["speech_probe"] = item["speech_probe"]
+
+    failure = pipeline.failure(item)
+    if item["category"] not in SMART_UPLOAD_ENTRY:
+        result.update(status="stored", reason="unsupported file type")
+    elif not item.get("speech", True):
+        result.update(status="skipped", reason=item["probe"].verdict)
+    elif failure is not None:
+        result.update(status="failed", stage=failure[0], error=failure[1])
+    elif not item["content"]:
+        result.update(status="failed", error="no content could be extracted")
+    else:
+        result["status"] = "processed"
+    return result
+
+def format_transcript(segments):
+    return "\n".join(f"Segment {j + 1}: {segment.get('text')}" for j, segment in enumerate(segments))
+
+# transcripts keep their timestamps in a memory mapped file next to the flattened content, see transcriptStore.py
+async def save_transcript(user, file_id, file_name, segments):
+    path = transcript_path(FILE_STORAGE, user.email, file_name)
+    await run_in_threadpool(write_transcript, path, segments)
+    await db_update(FileUpload, file_id, {"transcript_path": path})
+
+# every stored output is recorded with what produced it and from what, so that re-processing only redoes the stages whose producer
+# or input changed (see derivedArtefacts.py)
+async def save_content(user, file_id, file_name, file_path, content, producer, input_hash=None):
+    content_path = os.path.join(FILE_STORAGE, user.email, "content_" + file_name)
+    async with aiofiles.open(content_path, "w") as content_file:
+        await content_file.write(content)
+
+    await db_update(FileUpload, file_id, {"content_path": content_path})
+    await record_artefact(file_id, "content", producer, input_hash or await run_in_threadpool(hash_file, file_path), hash_text(content))
+
+async def save_subject(file_id, content, subject):
+    await db_update(FileUpload, file_id, {"subject": subject})
+    await record_artefact(file_id, "subject", classifier_producer(), hash_text(content), hash_text(subject.value))
+
+async def save_summary(user, file_id, file_name, content, summary, llm):
+    summary_path = os.path.join(FILE_STORAGE, user.email, "summary_" + file_name)
+    async with aiofiles.open(summary_path, "w") as summary_file:
+        await summary_file.write(summary)
+
+    await db_update(FileUpload, file_id, {"summary_path": summary_path})
+    await record_artefact(file_id, "summary", summary_producer(llm), hash_text(content), hash_text(summary))
+
+def resident_asr_model():
+    # the inference server's models aren't visible from here, every model is then priced as if it had to be loaded
+    manager = None if INFERENCE_SOCKET else model_loader.get_model("ASR")
+    return model_name(manager.get_model()) if manager else None
+
+# a request someone is waiting on is transcribed with the model the tiering policy picks (see asrPolicy.py), background work with the
+# user's own. yields the tier and the model's manager, and reports how long the transcription took back to the policy
+@asynccontextmanager
+async def transcriber(ticket, requested, interactive=True):
+    audio_seconds = ticket.units.get("ASR", 0)
+    chosen = time.perf_counter()
+    if interactive:
+        tier = asr_policy.choose(requested, audio_seconds, ticket, resident_asr_model())
+    else:
+        tier = Tier(model_name(requested), model_name(requested), "background", None)
+
+    async with ticket.stage("ASR", model=tier.model), model_loader.lease_async("ASR", tier.model, DEVICE, 16, COMPUTE_TYPE) as transcription_manager:
+        started = time.perf_counter()
+        yield tier, transcription_manager
+    asr_policy.observe(tier, audio_seconds, time.perf_counter() - started, time.perf_counter() - chosen if interactive else None)
+
+# a stored transcript made with a faster model than the user's is a draft, the background scheduler re-transcribes it with theirs
+# once the node is idle because its content producer no longer matches their setting
+def upgrade_draft(tier, file_id, user_id):
+    if tier is not None and tier.model != tier.requested and asr_policy.upgrades_drafts and DERIVE_ON_UPLOAD:
+        derivation_scheduler.submit(file_id, user_id)
+
+# content of a file: the transcript of audio and video (also stored with its timestamps), OCR of images, the text of documents.
+# returned with the ASR tier it was transcribed with, None for anything else
+async def extract_content(user, user_setting, file, path, ticket, interactive=True):
+    if is_video(path) or is_audio(path):
+        # a video's audio is extracted before the ASR model is taken, so the model isn't held while ffmpeg runs
+        async with AsyncExitStack() as stack:
+            audio_path = await stack.enter_async_context(extracted_audio(path)) if is_video(path) else path
+            async with transcriber(ticket, user_setting.asr_model, interactive) as (tier, transcription_manager):
+                transcript = await run_in_threadpool(transcription_manager.transcribe, audio_path, file.id, user.id)
 
         model_loader.del_models("ASR")
 
-    # Extract text from image files
-    if buckets["image"]:
-        for file_id, file_name, file_path, category in buckets["image"]:
-            try:
-                # Open the image file in binary mode
-                with open(file_path, "rb") as image_file:
-                    image_bytes = image_file.read()  # Read the image as bytes
-
-                    # Send the image to Hugging Face API
-                    response = requests.post(HUGGING_FACE_URL, files={"image": image_bytes})
-
-                    if response.status_code == 200:
-                        content = response.json()["prediction"]  # Extract the prediction from the response
-                    else:
-                        print(f"Error: {response.status_code} - {response.text}")
-                        content = None
-
-                myList.append((file_id, file_name, file_path, category, content))
-            except Exception as e:
-                print(f"Error processing image {file_name}: {e}")
-                myList.append((file_id, file_name, file_path, category, None))
-
-    if buckets["application"]:
-        # load model(s) here
-
-        for file_id, file_name, file_path, category in buckets["application"]:
-            # processing steps for file here
-            print(f"Processing document: {file_name}")
-
-            # Check file type and extract text accordingly
-            file_type = get_file_type(file_path)
-            extracted_text = ""
+        await save_transcript(user, file.id, file.name, transcript.get("segments"))
+        return format_transcript(transcript.get("segments")), tier
 
-            if file_type == "application/pdf":
-                extracted_text = extract_text_from_pdf(file_path)
-            elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-                extracted_text = extract_text_from_docx(file_path)
-
-            content = extracted_text if extracted_text else None
-            myList.append((file_id, file_name, file_path, category, content))
-        
-        # unload model(s) here
-
-    if buckets["other"]:
-        for file_id, file_name, file_path, category in buckets["other"]:
-            content = None
-            myList.append((file_id, file_name, file_path, category, content))
-
-    # subject classification (2nd stage)
-    classification_manager = model_loader.load_bert()
-
-    subject_mapping = {
-        0: SubjectTypes.math,
-        1: SubjectTypes.english,
-        2: SubjectTypes.science
-    }
-
-    for file_id, file_name, file_path, category, content in myList:
-        # classify files and save the subject to db
+    if is_image(path):
         try:
-            if content:  # Only try to classify if there's content
-                print(content)
-                predicted_label = classification_manager.predict(content)  # This returns 0, 1, or 2
-                
-                # Get the corresponding enum value using the mapping
-                try:
-                    
-                    subject_enum = subject_mapping[predicted_label]
-                    
-                    # Update the file record with the predicted subject
-                    await db_update(FileUpload, file_id, {"subject": subject_enum})
-                    
-                    print(f"Classified {file_name} as: {subject_enum}")
-                except KeyError:
-                    # Handle case where prediction doesn't match any mapping
-                    print(f"Warning: Predicted label '{predicted_label}' doesn't match any known subject mapping")
-            else:
-                print(f"Skipping classification for {file_name}: No content available")
-
-        except Exception as e:
-            print(f"Classification error for file {file_name}: {str(e)}")
-            # Continue processing other files instead of failing completely
-            continue
+            # Open the image file in binary mode
+            with open(path, "rb") as image_file:
+                image_bytes = image_file.read()  # Read the image as bytes
 
-    # Unload BERT model after processing all files
-    model_loader.del_models("BERT")
-    print("END------------------")
+            # Send the image to Hugging Face API
+            with track_stage("ocr"):
+                response = await run_in_threadpool(requests.post, HUGGING_FACE_URL, files={"image": image_bytes})
 
-    # content summary (final stage)
-    if myList:
-        model_loader.del_all_models()
-        llama_cpp_manager = model_loader.load_llm(user_setting.llm, DEVICE)
+            if response.status_code == 200:
+                return response.json()["prediction"], None  # Extract the prediction from the response
+            logger.error("ocr request failed", extra={"file_id": file.id, "status": response.status_code, "body": response.text})
+        except Exception as e:
+            logger.error("ocr failed", extra={"file_id": file.id, "error": str(e)})
+        return None, None
+
+    # document text extraction
+    file_type = get_file_type(path)
+    with track_stage("extraction"):
+        if file_type == "application/pdf":
+            return await run_in_threadpool(extract_text_from_pdf, path) or None, None
+        if file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+            return await run_in_threadpool(extract_text_from_docx, path) or None, None
+    return None, None
+
+# outputs stored before artefacts were recorded are taken to come from the owner's current settings rather than being redone
+def adoptable(file, artefacts):
+    return not artefacts and file.content_path and file.summary_path and os.path.exists(file.content_path) and os.path.exists(file.summary_path)
+
+# returns the file's artefacts once adopted. with record=False nothing is stored and the artefacts adopting would record are returned,
+# so that a dry run of backfill.py plans the same work as the real run
+async def adopt_artefacts(file, user_setting, record=True):
+    async with aiofiles.open(file.content_path, "r") as content_file:
+        content = await content_file.read()
+    async with aiofiles.open(file.summary_path, "r") as summary_file:
+        summary = await summary_file.read()
+
+    content_hash = hash_text(content)
+    adopted = [("content", content_producer(file.path, user_setting.asr_model), await run_in_threadpool(hash_file, file.path), content_hash)]
+    if file.subject:
+        adopted.append(("subject", classifier_producer(), content_hash, hash_text(file.subject.value)))
+    adopted.append(("summary", summary_producer(user_setting.llm), content_hash, hash_text(summary)))
+
+    if not record:
+        return {stage: DerivedArtefact(file_id=file.id, stage=stage, producer=producer[0], version=producer[1], input_hash=input_hash, output_hash=output_hash)
+                for stage, producer, input_hash, output_hash in adopted}
+
+    for stage, producer, input_hash, output_hash in adopted:
+        await record_artefact(file.id, stage, producer, input_hash, output_hash)
+
+    logger.info("adopted stored artefacts", extra={"file_id": file.id, "file_name": file.name})
+    return await get_artefacts(file.id)
+
+# derives the content, subject and summary of a file, redoing only the stages whose producer or input changed since they were stored.
+# used by the background scheduler (see derivationScheduler.py), which pauses it between stages while requests use the models, and
+# by backfill.py
+async def derive_file(file_id, ticket, wait_idle):
+    # one database session for the whole file, the way a request gets one
+    async with db_scope():
+        await derive_file_stages(file_id, ticket, wait_idle)
+
+async def derive_file_stages(file_id, ticket, wait_idle):
+    file = await db_get_by_id(FileUpload, file_id)
+    if not file or not os.path.exists(file.path):
+        return
+
+    user = await db_get_by_id(User, file.user_id)
+    user_setting = next(iter(await db_get_by_attribute(UserSetting, "user_id", file.user_id)), None)
+
+    producer = content_producer(file.path, user_setting.asr_model)
+    if producer is None:
+        return
+
+    artefacts = await get_artefacts(file.id)
+    if adoptable(file, artefacts):
+        artefacts = await adopt_artefacts(file, user_setting)
+
+    # content
+    input_hash = await run_in_threadpool(hash_file, file.path)
+    if is_current(artefacts.get("content"), producer, input_hash) and file.content_path and os.path.exists(file.content_path):
+        async with aiofiles.open(file.content_path, "r") as content_file:
+            content = await content_file.read()
+    else:
+        ticket.reserve({"ASR": media_seconds(file.type, file.size, file.name)})
+        content, _ = await extract_content(user, user_setting, file, file.path, ticket, interactive=False)
+        if not content:
+            logger.info("nothing to derive, no content", extra={"file_id": file.id, "file_name": file.name})
+            return
+        await save_content(user, file.id, file.name, file.path, content, producer, input_hash)
+
+    content_hash = hash_text(content)
+
+    # subject
+    if not is_current(artefacts.get("subject"), classifier_producer(), content_hash):
+        await wait_idle()
+        ticket.reserve({"BERT": 1})
+        async with ticket.stage("BERT"), model_loader.lease_async("BERT") as classification_manager:
+            predicted_label = await run_in_threadpool(classification_manager.predict, content)
+        model_loader.del_models("BERT")
 
-        for file_id, file_name, file_path, category, content in myList:
-            if not content:
-                continue
+        if predicted_label in SUBJECT_LABELS:
+            await save_subject(file.id, content, SUBJECT_LABELS[predicted_label])
 
-            summary = llama_cpp_manager.generate_summary(content)
+    # summary
+    if not is_current(artefacts.get("summary"), summary_producer(user_setting.llm), content_hash):
+        await wait_idle()
+        ticket.reserve({"LLM": 1})
+        async with ticket.stage("LLM", model=user_setting.llm), model_loader.lease_async("LLM", user_setting.llm, DEVICE) as llama_cpp_manager:
+            summary = await run_in_threadpool(llama_cpp_manager.generate_summary, content)
+        model_loader.del_models("LLM")
 
-            content_path = os.path.join("/app/file_storage", user.email, "content_" + file_name)
-            summary_path = os.path.join("/app/file_storage", user.email, "summary_" + file_name)
+        if summary:
+            await save_summary(user, file.id, file.name, content, summary, user_setting.llm)
 
-            async with aiofiles.open(content_path, "w") as content_file:
-                await content_file.write(content)
-            async with aiofiles.open(summary_path, "w") as summary_file:
-                await summary_file.write(summary)
+derivation_scheduler = DerivationScheduler(derive_file)
 
-            await db_update(FileUpload, file_id, {"content_path": content_path, "summary_path": summary_path})
+# events of a streamed /view-extract: the content, the summary as it is generated (or in one piece if it was stored before), the result
+async def stream_extract(user, file, subject, content, summary, llm, ticket):
+    yield "content", {"content": content}
 
+    if summary is None and content:
+        summary = ""
+        async with ticket.stage("LLM", model=llm), model_loader.lease_async("LLM", llm, DEVICE) as llama_cpp_manager:
+            async for text in iterate_in_threadpool(llama_cpp_manager.stream_summary(content)):
+                summary += text
+                yield "summary", {"text": text}
         model_loader.del_models("LLM")
 
-        return {"Files uploaded & processed"}
-    
-    return {"Files uploaded but not processed"}
+        if summary:
+            await save_summary(user, file.id, file.name, content, summary, llm)
+    elif summary:
+        yield "summary", {"text": summary}
+
+    yield "done", {"content": content, "summary": summary, "subject": subject}
 
 @app.post("/view-extract/{id}")
-async def view_extract(id: str, token: str = Depends(oauth2_scheme)):
+async def view_extract(id: str, stream: bool = Query(False), token: str = Depends(oauth2_scheme), ticket: AdmissionTicket = Depends(get_admission_ticket)):
     user_id = verify_jwt_token(token)
     user = await db_get_by_id(User, user_id)
     user_setting = next(iter(await db_get_by_attribute(UserSetting, "user_id", user_id)), None)
@@ -517,6 +1013,11 @@ async def view_extract(id: str, token: str = Depends(oauth2_scheme)):
         raise HTTPException(status_code=404, detail="File not found")
     if user_id != file.user_id and not any(user_id == shared_file.user_id for shared_file in shared_file_list):
         raise HTTPException(status_code=403, detail="You are not authorized to view this file")
+
+    # a file the background scheduler is deriving is waited for, a queued one is taken off the queue and derived here
+    derivation_scheduler.touch(user_id)
+    if await derivation_scheduler.claim(file.id):
+        file = await db_get_by_id(FileUpload, file.id)
     
     content, summary, subject = None, None, None
     
@@ -529,151 +1030,181 @@ async def view_extract(id: str, token: str = Depends(oauth2_scheme)):
         async with aiofiles.open(file.summary_path, "r") as summary_file:
             summary = await summary_file.read()
 
+        if stream:
+            return event_stream(stream_extract(user, file, subject, content, summary, user_setting.llm, ticket), ticket)
+
         return {"content": content, "summary": summary, "subject": subject}
-      
+
+    ticket.reserve({"ASR": media_seconds(file.type, file.size, file.name), "LLM": 1})
+
     # process file if not viewed before
     with NamedTemporaryFile(delete=True) as temp:
         try:
-            with open(file.path, "rb") as src_file, open(temp.name, "wb") as temp_file:
+            with span("temp_copy"), open(file.path, "rb") as src_file, open(temp.name, "wb") as temp_file:
                 temp_file.write(src_file.read())
 
-            # transcribe audio
-            if is_video(temp.name) or is_audio(temp.name):
-                transcription_manager = model_loader.load_asr(user_setting.asr_model, DEVICE, 16, COMPUTE_TYPE)
-
-                if is_video(temp.name):
-                    with NamedTemporaryFile(delete=True) as audio_temp:
-                        extracted_audio_path = audio_temp.name + ".mp3"
-                        subprocess.run(["ffmpeg", "-i", temp.name, extracted_audio_path], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                        content = "\n".join(
-                            f"Segment {j + 1}: {segment.get('text')}"
-                            for j, segment in enumerate(transcription_manager.transcribe(temp.name).get("segments"))
-                        )
-
-                elif is_audio(temp.name):
-                    content = "\n".join(
-                        f"Segment {j + 1}: {segment.get('text')}"
-                        for j, segment in enumerate(transcription_manager.transcribe(temp.name).get("segments"))
-                    )
-
-                model_loader.del_models("ASR")
-                            
-            # Image to text
-            if is_image(temp.name):
-                try:
-                    # Open the image file in binary mode
-                    with open(temp.name, "rb") as image_file:
-                        image_bytes = image_file.read()  # Read the image as bytes
-
-                        # Send the image to Hugging Face API
-                        response = requests.post(HUGGING_FACE_URL, files={"image": image_bytes})
-
-                        if response.status_code == 200:
-                            content = response.json()["prediction"]  # Extract the prediction from the response
-                        else:
-                            print(f"Error: {response.status_code} - {response.text}")
-                            content = None
-                except Exception as e:
-                    print(f"Error processing image: {e}")
-                    content = None
-                        # document text extraction
+            content, tier = await extract_content(user, user_setting, file, temp.name, ticket)
+            if content:
+                await save_content(user, file.id, file.name, file.path, content, content_producer(temp.name, tier.model if tier else user_setting.asr_model))
+                upgrade_draft(tier, file.id, file.user_id)
 
             # subject classification
 
-            # summarise content
+            # summarise content, token by token when the summary is streamed
+            if stream:
+                return event_stream(stream_extract(user, file, subject, content, None, user_setting.llm, ticket), ticket)
+
             if content:
-                model_loader.del_all_models()
-                llama_cpp_manager = model_loader.load_llm(user_setting.llm, DEVICE)
-                summary = llama_cpp_manager.generate_summary(content)
+                async with ticket.stage("LLM", model=user_setting.llm), model_loader.lease_async("LLM", user_setting.llm, DEVICE) as llama_cpp_manager:
+                    summary = await run_in_threadpool(llama_cpp_manager.generate_summary, content)
                 model_loader.del_models("LLM")
 
             if content and summary:
-                content_path = os.path.join("/app/file_storage", user.email, "content_" + file.name)
-                summary_path = os.path.join("/app/file_storage", user.email, "summary_" + file.name)
-                
-                async with aiofiles.open(content_path, "w") as content_file:
-                    await content_file.write(content)
-                async with aiofiles.open(summary_path, "w") as summary_file:
-                    await summary_file.write(summary)
-
-                await db_update(FileUpload, id, {"content_path": content_path, "summary_path": summary_path})
+                await save_summary(user, file.id, file.name, content, summary, user_setting.llm)
 
             return {"content": content, "summary": summary}
         
+        except (InsufficientMemoryError, AdmissionRejected):
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+# pages through the timestamped transcript of an audio/video file, by segment or by time, without loading the rest of it
+@app.get("/transcript/{id}")
+async def get_transcript(
+    id: int,
+    start: Optional[float] = Query(None, ge=0),
+    end: Optional[float] = Query(None, ge=0),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    token: str = Depends(oauth2_scheme)
+):
+    user_id = verify_jwt_token(token)
+
+    file = await db_get_by_id(FileUpload, id)
+    shared_file_list = await db_get_by_attribute(SharedFile, "file_id", id)
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    if user_id != file.user_id and not any(user_id == shared_file.user_id for shared_file in shared_file_list):
+        raise HTTPException(status_code=403, detail="You are not authorized to view this file")
+    if not file.transcript_path or not os.path.exists(file.transcript_path):
+        raise HTTPException(status_code=404, detail="No timestamped transcript for this file, extract it first")
+
+    def read():
+        with TranscriptReader(file.transcript_path) as transcript:
+            first, last = transcript.time_range(start, end)
+            return {
+                "segment_count": len(transcript),
+                "duration": transcript.duration(),
+                "first": first,
+                "last": last,
+                "segments": transcript.segments(first + offset, min(first + offset + limit, last))
+            }
+
+    return await run_in_threadpool(read)
+
+# events of a streamed /transcribe-audio: every transcript, then each summary as it is generated, then the full response
+async def stream_transcripts(response, llm, ticket):
+    for id, file_data in response.items():
+        yield "transcript", {"id": id, **file_data}
+
+    if llm is not None:
+        async with ticket.stage("LLM", model=llm), model_loader.lease_async("LLM", llm, DEVICE) as llama_cpp_manager:
+            for id, file_data in response.items():
+                try:
+                    summary = ""
+                    async for text in iterate_in_threadpool(llama_cpp_manager.stream_summary(format_transcript(file_data["segments"]))):
+                        summary += text
+                        yield "summary", {"id": id, "text": text}
+                    file_data["summary"] = summary
+
+                except Exception as e:
+                    file_data["summary"] = {
+                        "error": str(e)
+                    }
+
+        model_loader.del_models("LLM")
+
+    yield "done", response
+
 @app.post("/transcribe-audio")
-async def transcribe_audio(form_data: TranscribeAudioDTO = Depends(), files: List[UploadFile] = File(...)):
+async def transcribe_audio(form_data: TranscribeAudioDTO = Depends(), files: List[UploadFile] = File(...), ticket: AdmissionTicket = Depends(get_admission_ticket)):
     # 1. error check
     if not files:
         raise HTTPException(status_code=400, detail="No Files Uploaded")
 
-    response = {}
+    ticket.reserve({
+        "ASR": sum(media_seconds(file.content_type, file.size, file.filename, file.file) for file in files),
+        "LLM": len(files) if form_data.content_summary else 0
+    })
 
-    # 2. load models used for transciption
-    transcription_manager = model_loader.load_asr(form_data.asr_model, DEVICE, 16, COMPUTE_TYPE)
+    response = {}
 
-    # 3. transcribe all audio/video files
-    for id, file in enumerate(files, start=1):
-        with NamedTemporaryFile(delete=True) as temp:
-            try:
-                # copies uploaded file contents to the temporary file
-                with open(temp.name, "wb") as temp_file:
-                    temp_file.write(file.file.read())
+    # 2. load models used for transciption, a faster one than asked for when the latency target is at risk
+    async with transcriber(ticket, form_data.asr_model) as (tier, transcription_manager):
+        # 3. transcribe all audio/video files
+        for id, file in enumerate(files, start=1):
+            with NamedTemporaryFile(delete=True) as temp:
+                try:
+                    # copies uploaded file contents to the temporary file
+                    with open(temp.name, "wb") as temp_file:
+                        temp_file.write(file.file.read())
 
-                # extract audio from video using ffmpeg
-                if is_video(temp.name):
-                    with NamedTemporaryFile(delete=True) as audio_temp:
-                        extracted_audio_path = audio_temp.name + ".mp3"
-                        subprocess.run(["ffmpeg", "-i", temp.name, extracted_audio_path], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                    # extract audio from video using ffmpeg
+                    if is_video(temp.name):
+                        async with extracted_audio(temp.name) as audio_path:
+                            transcript = await run_in_threadpool(transcription_manager.transcribe, audio_path)
+                            segments = transcript["segments"]
 
-                        transcript = transcription_manager.transcribe(extracted_audio_path)
+                    if is_audio(temp.name):
+                        # performs audio transcription
+                        transcript = await run_in_threadpool(transcription_manager.transcribe, temp.name)
                         segments = transcript["segments"]
-
-                if is_audio(temp.name):
-                    # performs audio transcription
-                    transcript = transcription_manager.transcribe(temp.name)
-                    segments = transcript["segments"]
-                        
-                response[id] = {
-                    "filename": file.filename,
-                    "language": transcript["language"],
-                    "segments": [
-                        {
-                            "start": segment.get("start"),
-                            "end": segment.get("end"),
-                            "text": segment.get("text").lstrip()
-                        }
-                        for segment in segments
-                    ]
-                }
-            
-            except Exception as e:
-                response[id] = {
-                    "filename": file.filename,
-                    "error": str(e)
-                }
+                            
+                    response[id] = {
+                        "filename": file.filename,
+                        "asr_model": tier.model,
+                        "language": transcript["language"],
+                        "segments": [
+                            {
+                                "start": segment.get("start"),
+                                "end": segment.get("end"),
+                                "text": segment.get("text").lstrip()
+                            }
+                            for segment in segments
+                        ]
+                    }
+                
+                except Exception as e:
+                    response[id] = {
+                        "filename": file.filename,
+                        "error": str(e)
+                    }
     
+    # summaries stream as server-sent events when asked for
+    if form_data.stream:
+        return event_stream(stream_transcripts(response, form_data.llm if form_data.content_summary else None, ticket), ticket)
+
     if form_data.content_summary:
-        # 4. unload the ASR model used for transcription and load in the LLM
-        model_loader.del_all_models()
-        llama_cpp_manager = model_loader.load_llm(form_data.llm, DEVICE)
-
-        # 5. summarise transcript of all audio files
-        for i, file_data in response.items():
-            try:
-                formatted_transcript = "\n".join(
-                    f"Segment {j + 1}: {segment.get('text')}"
-                    for j, segment in enumerate(file_data["segments"])
-                )
-                
-                response[i]["summary"] = llama_cpp_manager.generate_summary(formatted_transcript)
+        # 4. load in the LLM, the loader unloads the ASR model used for transcription if it needs the memory and nobody else is using it
+
+        async with ticket.stage("LLM", model=form_data.llm), model_loader.lease_async("LLM", form_data.llm, DEVICE) as llama_cpp_manager:
+            # 5. summarise transcript of all audio files, as many at once as the engine decodes together so the others don't hold
+            # threadpool threads while they wait for it
+            parallel = asyncio.Semaphore(admission_controller.queue("LLM").concurrency)
 
-            except Exception as e:
-                response[i]["summary"] = {
-                    "error": str(e)
-                }
+            async def summarise(i, file_data):
+                try:
+                    formatted_transcript = format_transcript(file_data["segments"])
+                    async with parallel:
+                        response[i]["summary"] = await run_in_threadpool(llama_cpp_manager.generate_summary, formatted_transcript)
+
+                except Exception as e:
+                    response[i]["summary"] = {
+                        "error": str(e)
+                    }
+
+            await asyncio.gather(*(summarise(i, file_data) for i, file_data in response.items()))
 
         # 6. unload the LLM
         model_loader.del_models("LLM")
@@ -683,16 +1214,18 @@ async def transcribe_audio(form_data: TranscribeAudioDTO = Depends(), files: Lis
 @app.post("/predict-text")
 async def predict_text(
     text: Optional[str] = Form(None),
-    files: List[UploadFile] = File(default=None)
+    files: List[UploadFile] = File(default=None),
+    ticket: AdmissionTicket = Depends(get_admission_ticket)
 ):
     # 1. error check
     if not text and not files:
         raise HTTPException(status_code=400, detail="No text or file uploaded")
 
+    ticket.reserve({"BERT": 1})
+
     response = {}
     
-    # Print received files
-    print("Received files:", [file.filename for file in files] if files else "No files")
+    logger.info("predicting subject", extra={"files": [file.filename for file in files] if files else []})
 
     # 2. extract text from files
     extracted_text = ""
@@ -705,16 +1238,15 @@ async def predict_text(
                         temp_file.write(content)
 
                     # extract text from the file based on extension
-                    if file.filename.endswith(".pdf"):
-                        extracted_text += extract_text_from_pdf(temp.name)
-                    elif file.filename.endswith(".docx"):
-                        print(f"Before DOCX extraction: {temp.name}")
-                        extracted_text += extract_text_from_docx(temp.name)
-                        print(f"After DOCX extraction: {extracted_text}")
-                    elif file.filename.endswith(".txt"):
-                        extracted_text += extract_text_from_txt(temp.name)
-                    else:
-                        raise HTTPException(status_code=400, detail="Unsupported file type")
+                    with track_stage("extraction"):
+                        if file.filename.endswith(".pdf"):
+                            extracted_text += extract_text_from_pdf(temp.name, CLASSIFY_TOKEN_BUDGET)
+                        elif file.filename.endswith(".docx"):
+                            extracted_text += extract_text_from_docx(temp.name, CLASSIFY_TOKEN_BUDGET)
+                        elif file.filename.endswith(".txt"):
+                            extracted_text += extract_text_from_txt(temp.name, CLASSIFY_TOKEN_BUDGET)
+                        else:
+                            raise HTTPException(status_code=400, detail="Unsupported file type")
                     
                     await file.seek(0)  # Reset file pointer
 
@@ -734,8 +1266,8 @@ async def predict_text(
     # 3. predict subject for combined text
     if cleaned_text:
         try:
-            classification_manager = model_loader.load_bert()
-            predicted_label = classification_manager.predict(cleaned_text)
+            async with ticket.stage("BERT"), model_loader.lease_async("BERT") as classification_manager:
+                predicted_label = await run_in_threadpool(classification_manager.predict, cleaned_text)
 
             response = {
                 "predicted_label": int(predicted_label)
@@ -751,4 +1283,41 @@ async def predict_text(
 
 @app.get("/get-device")
 async def get_device():
-    return DEVICE
\ No newline at end of file
+    return DEVICE
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = Query("folded"), admin: User = Depends(get_admin_user)):
+    path = profile_path(profile_id, format)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    media_type = "application/json" if format == "trace" else "text/plain"
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
+
+@app.get("/admin/memory")
+async def get_memory(admin: User = Depends(get_admin_user)):
+    snapshot = memory_tracker.snapshot()
+    if INFERENCE_SOCKET:
+        snapshot["inference_server"] = await run_in_threadpool(model_loader.status)
+
+    return snapshot
+
+@app.get("/admin/cpu")
+async def get_cpu(admin: User = Depends(get_admin_user)):
+    snapshot = cpu_manager.snapshot()
+    if INFERENCE_SOCKET:
+        snapshot["inference_server"] = (await run_in_threadpool(model_loader.status)).get("cpu")
+
+    return snapshot
+
+@app.get("/admin/admission")
+async def get_admission(admin: User = Depends(get_admin_user)):
+    return admission_controller.snapshot()
+
+@app.get("/admin/asr-policy")
+async def get_asr_policy(admin: User = Depends(get_admin_user)):
+    return asr_policy.snapshot()
+
+@app.get("/admin/derivation")
+async def get_derivation(admin: User = Depends(get_admin_user)):
+    return derivation_scheduler.snapshot()
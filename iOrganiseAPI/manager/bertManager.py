@@ -4,6 +4,11 @@ import fitz
 from docx import Document
 import gc
 from utils import *
+from metrics import track_stage
+from cpuManager import pinned
+from logger import get_logger
+
+logger = get_logger(__name__)
 
 # Define your model path here
 MODEL_PATH = "/app/models/DistilBERTSubjectClassification"
@@ -14,23 +19,44 @@ if gpus:
         for gpu in gpus:
             tf.config.experimental.set_memory_growth(gpu, True)
     except RuntimeError as e:
-        print(f"GPU Memory Limiting Error: {e}")
+        logger.warning("GPU memory growth could not be enabled", extra={"error": str(e)})
 
 class DistilBertManager:
-    def __init__(self, model_path: str = MODEL_PATH):
+    def __init__(self, model_path: str = MODEL_PATH, cpu_budget=None):
+        self.cpu_budget = cpu_budget
+        if cpu_budget is not None and cpu_budget.threads:
+            # tensorflow's thread pools are process wide and fixed once its runtime starts, so only the first load can size them
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(cpu_budget.threads)
+                tf.config.threading.set_inter_op_parallelism_threads(1)
+            except RuntimeError as e:
+                logger.info("tensorflow threads already fixed", extra={"error": str(e)})
+
         # Load the DistilBertTokenizer with the default pre-trained model
         self.tokenizer = DistilBertTokenizer.from_pretrained("distilbert-base-uncased")
         
         # Load the saved model from the given model_path
-        self.model = tf.saved_model.load(model_path)
+        with pinned(cpu_budget):
+            self.model = tf.saved_model.load(model_path)
         
         # Define the inference function from the model
         self.inference_func = self.model.signatures['serving_default']
 
+    def get_model(self):
+        return "distilbert"
+
+    # the first call of a SavedModel signature traces and optimises its graph
+    def warm_up(self):
+        self.predict("warm up")
+
     def predict(self, text: str) -> int:
-        # Tokenize the input text
+        return self.predict_batch([text])[0]
+
+    # classifies several texts in one forward pass, used by the inference server to batch queued requests
+    def predict_batch(self, texts: list) -> list:
+        # Tokenize the input texts
         inputs = self.tokenizer(
-            text,
+            texts,
             return_tensors="tf",
             padding="max_length",
             truncation=True,
@@ -44,13 +70,14 @@ class DistilBertManager:
         }
 
         # Run inference
-        predictions = self.inference_func(**model_inputs)
+        with track_stage("bert"), pinned(self.cpu_budget):
+            predictions = self.inference_func(**model_inputs)
         
-        # Get the logits and predict the label
+        # Get the logits and predict the labels
         logits = predictions[list(predictions.keys())[0]]
-        predicted_label = tf.argmax(logits, axis=-1).numpy()[0]
+        predicted_labels = tf.argmax(logits, axis=-1).numpy()
 
-        return predicted_label
+        return [int(label) for label in predicted_labels]
     
     def unload(self):
         del self.tokenizer  # Delete tokenizer
@@ -1,7 +1,21 @@
-from faster_whisper import WhisperModel, BatchedInferencePipeline
+from faster_whisper import WhisperModel, BatchedInferencePipeline, decode_audio
+
+import time
+import hashlib
+import numpy as np
 
 from enums.DeviceTypes import DeviceTypes
 from enums.AsrModels import AsrModels
+from metrics import track_stage, ASR_AUDIO_SECONDS, ASR_REUSED_SECONDS, ASR_RESUMED_SECONDS, ASR_SPEED
+from fingerprint import fingerprint, fingerprint_index, plan_reuse
+from checkpoint import Checkpoint
+from cpuManager import pinned
+from utils import model_name
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+SAMPLE_RATE = 16000
 
 ASR_MODELS = {
     "small": "/app/models/faster-whisper-small",
@@ -10,13 +24,18 @@ ASR_MODELS = {
 }
 
 class FasterWhisperManager:
-    def __init__(self, name: AsrModels, device: DeviceTypes, batch_size, compute_type):
+    def __init__(self, name: AsrModels, device: DeviceTypes, batch_size, compute_type, cpu_budget=None):
         try:
             self.__name = name
             self.__device = device
             self.__batch_size = batch_size
             self.__compute_type = compute_type
-            self.__model = BatchedInferencePipeline(model=WhisperModel(ASR_MODELS.get(self.__name), self.__device, compute_type=self.__compute_type))
+            self.__cpu_budget = cpu_budget
+
+            # CTranslate2 sizes its thread pool when the model is created (0 lets it pick), the budget can't change it afterwards
+            cpu_threads = (cpu_budget.threads if cpu_budget is not None else None) or 0
+            with pinned(cpu_budget):
+                self.__model = BatchedInferencePipeline(model=WhisperModel(ASR_MODELS.get(self.__name), self.__device, compute_type=self.__compute_type, cpu_threads=cpu_threads))
 
         except Exception as e:
             raise RuntimeError(f"Error initialising FasterWhisperManager: {e}")
@@ -24,28 +43,93 @@ class FasterWhisperManager:
     def get_model(self):
         return self.__name
 
-    def transcribe(self, path):
+    # a second of silence through the encoder and decoder pages the weights in and starts CTranslate2's thread pool
+    def warm_up(self):
+        with pinned(self.__cpu_budget):
+            segments, _ = self.__model.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), batch_size=1, vad_filter=False, language="en")
+            list(segments)
+
+    # segments come out of the model as they are decoded, each one is journalled to the checkpoint as it arrives
+    def __segments(self, audio, offset=0.0, checkpoint=None):
+        segments, info = self.__model.transcribe(audio, batch_size=self.__batch_size, vad_filter=True, language="en")
+        transcribed = []
+        for segment in segments:
+            transcribed.append({
+                "start": round(segment.start + offset, 3),
+                "end": round(segment.end + offset, 3),
+                "text": segment.text.lstrip()
+            })
+            if checkpoint is not None:
+                checkpoint.record(transcribed[-1])
+        return transcribed, getattr(info, "language", "unknown")
+
+    # file_id and owner tie the transcript to the uploaded file it belongs to, a recording without them (one transcribed for the caller
+    # and not stored) can reuse transcripts but leaves nothing in the fingerprint index, as nothing would remove it again
+    def transcribe(self, path, file_id=None, owner=None):
         if self.__model is None:
             raise RuntimeError("Model has not been loaded.")
 
         try:
-            segments, info = self.__model.transcribe(path, batch_size=self.__batch_size, vad_filter=True, language="en")
-            transcript = {
-                "language": getattr(info, "language", "unknown"),
-                "segments": [
-                    {
-                        "start": segment.start,
-                        "end": segment.end,
-                        "text": segment.text.lstrip()
-                    }
-                    for segment in segments
-                ]
-            }
-
-            return transcript
+            start = time.perf_counter()
+            name = model_name(self.__name)
+
+            with track_stage("asr"), pinned(self.__cpu_budget):
+                # the audio is decoded once, for the fingerprint and for whatever still has to be transcribed
+                audio = decode_audio(path, sampling_rate=SAMPLE_RATE)
+                duration = len(audio) / SAMPLE_RATE
+                reused, gaps, hashes, times = [], [(0.0, duration)], None, None
+
+                if fingerprint_index.enabled:
+                    hashes, times = fingerprint(audio, SAMPLE_RATE)
+                    # only transcripts of the same model are reused, so changing model still re-transcribes
+                    match = fingerprint_index.match(hashes, times, name)
+                    if match is not None:
+                        reused, gaps = plan_reuse(match, *fingerprint_index.recording(match.recording), duration)
+                        logger.info("reusing transcript of a matching recording", extra={"recording": match.recording, "landmarks": match.landmarks, "reused_segments": len(reused), "gaps": len(gaps)})
+
+                # a transcription cut short by a restart carries on after the last segment its checkpoint holds, the journal is keyed
+                # by the model and the decoded audio so it is found again whatever the file is called
+                checkpoint = Checkpoint(f"asr-{name}-{hashlib.blake2b(audio, digest_size=16).hexdigest()}")
+                recovered = checkpoint.load()
+                resumed_at = max((record.get("offset", record.get("end", 0.0)) for record in recovered), default=0.0)
+                if recovered:
+                    logger.info("resuming transcription from checkpoint", extra={"checkpoint": checkpoint.key, "resumed_at": resumed_at, "duration": round(duration, 3)})
+
+                # transcription is pinned to english, a full transcription reports what the model detected
+                language = "en"
+                segments = list(reused) + [record for record in recovered if "text" in record]
+                remaining = [(max(gap_start, resumed_at), gap_end) for gap_start, gap_end in sorted(gaps) if gap_end > resumed_at]
+                try:
+                    for gap_start, gap_end in remaining:
+                        if gap_start == 0.0 and gap_end == duration:
+                            transcribed, language = self.__segments(audio, checkpoint=checkpoint)
+                        else:
+                            transcribed, _ = self.__segments(audio[int(gap_start * SAMPLE_RATE):int(gap_end * SAMPLE_RATE)], gap_start, checkpoint)
+                        segments.extend(transcribed)
+                        # the silence at the end of a gap has no segment, the offset marks it as done
+                        checkpoint.record({"offset": gap_end})
+                except BaseException:
+                    checkpoint.flush()
+                    raise
+                segments.sort(key=lambda segment: segment["start"])
+
+                # a recording with nothing new in it is already represented by the one it matched
+                if fingerprint_index.enabled and file_id is not None and gaps:
+                    fingerprint_index.add(hashes, times, name, duration, segments, file_id, owner)
+                checkpoint.finish()
+
+            elapsed = time.perf_counter() - start
+            transcribed_seconds = sum(gap_end - gap_start for gap_start, gap_end in remaining)
+            ASR_AUDIO_SECONDS.labels(name).inc(transcribed_seconds)
+            ASR_REUSED_SECONDS.labels(name).inc(sum(segment["end"] - segment["start"] for segment in reused))
+            ASR_RESUMED_SECONDS.labels(name).inc(sum(gap_end - gap_start for gap_start, gap_end in gaps) - transcribed_seconds)
+            if elapsed > 0:
+                ASR_SPEED.labels(name).observe(duration / elapsed)
+
+            return {"language": language, "segments": segments}
             
         except FileNotFoundError as e:
             raise RuntimeError(f"Audio file not found: {e}")
         
         except Exception as e:
-            raise RuntimeError(f"Error transcribing audio: {e}")
\ No newline at end of file
+            raise RuntimeError(f"Error transcribing audio: {e}")
@@ -0,0 +1,400 @@
+import os
+import time
+import queue
+import ctypes
+import codecs
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+import llama_cpp
+
+from enums.DeviceTypes import DeviceTypes
+from enums.LlmModels import LlmModels
+from manager.llamacppManager import LLM_MODELS, LLM_PREFIX_CACHE, LLM_MMAP, ThinkFilter, summary_prompt_parts, clean_summary
+from metrics import track_stage, LLM_TOKENS, LLM_TOKENS_PER_SECOND, LLM_REQUEST_SECONDS, LLM_TIME_TO_FIRST_TOKEN_SECONDS, LLM_ACTIVE_SEQUENCES, LLM_ENGINE_TOKENS_PER_SECOND
+from cpuManager import pinned
+from logger import get_logger
+from utils import model_name
+
+logger = get_logger(__name__)
+
+# number of sequences decoded together, and the KV cache shared by all of them (0 = the model's context length)
+LLM_PARALLEL = int(os.getenv("LLM_PARALLEL", "4"))
+LLM_BATCH_CONTEXT = int(os.getenv("LLM_BATCH_CONTEXT", "0"))
+# most tokens submitted to a single llama_decode call, long prompts are prefilled in chunks of this size
+LLM_BATCH_TOKENS = int(os.getenv("LLM_BATCH_TOKENS", "512"))
+
+# sampling settings matching the LlamaCpp defaults used by LlamaCppManager
+MAX_TOKENS = 2048
+TEMPERATURE = 0.4
+TOP_K = 40
+TOP_P = 0.95
+REPEAT_PENALTY = 1.1
+REPEAT_LAST_N = 64
+
+class _Sequence:
+    def __init__(self, prompt_tokens, shared, stream=False):
+        self.prompt = prompt_tokens
+        self.shared = shared                # leading prompt tokens already in the KV cache under the prefix sequence
+        self.future = Future()
+        self.stream = queue.SimpleQueue() if stream else None     # text of every sampled token, then None
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.cancelled = False
+        self.slot = None
+        self.n_past = 0                     # tokens of this sequence already in the KV cache
+        self.prefilled = 0                  # prompt tokens submitted in the current batch
+        self.output = []
+        self.next_token = None              # sampled token waiting to be decoded
+        self.batch_index = None             # position in the current batch whose logits belong to this sequence
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.rng = np.random.default_rng()
+
+    def close(self, result=None, error=None):
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+        if self.stream is not None:
+            self.stream.put(None)
+
+    @property
+    def reserved(self):
+        # KV cells this sequence may grow to, reserved up front so admitted sequences can always finish
+        return len(self.prompt) - self.shared + MAX_TOKENS
+
+class LlamaCppBatchManager:
+    '''
+    The LlamaCppBatchManager class serves summaries from one llama.cpp context with LLM_PARALLEL sequence slots (continuous batching).
+
+    Callers block in generate_summary while a scheduler thread admits waiting prompts into free slots whenever the shared KV cache has
+    room, prefills them in chunks and advances every active sequence by one token per llama_decode call, so summaries for different
+    files and users share decode steps instead of running one after the other.
+
+    The instruction prefix of the summary prompt is evaluated once at load into a sequence of its own, admitted sequences share its
+    KV cells and only prefill their document.
+    '''
+
+    def __init__(self, name: LlmModels, device: DeviceTypes, parallel: int = LLM_PARALLEL, cpu_budget=None):
+        try:
+            self.__name = name
+            self.__parallel = parallel
+            self.__cpu_budget = cpu_budget
+            self.__threads = None       # thread count waiting to be applied by the scheduler thread
+
+            model_path, context_length = LLM_MODELS.get(self.__name)
+            self.__n_ctx = LLM_BATCH_CONTEXT or context_length
+
+            llama_cpp.llama_backend_init()
+
+            model_params = llama_cpp.llama_model_default_params()
+            model_params.use_mmap = LLM_MMAP
+            if device == "cuda":
+                model_params.n_gpu_layers = 49
+            self.__model = llama_cpp.llama_load_model_from_file(model_path.encode("utf-8"), model_params)
+            if not self.__model:
+                raise RuntimeError(f"Failed to load {model_path}")
+            self.__vocab = llama_cpp.llama_model_get_vocab(self.__model)
+            self.__n_vocab = llama_cpp.llama_vocab_n_tokens(self.__vocab)
+
+            context_params = llama_cpp.llama_context_default_params()
+            context_params.n_ctx = self.__n_ctx
+            context_params.n_batch = LLM_BATCH_TOKENS
+            context_params.n_ubatch = LLM_BATCH_TOKENS
+            context_params.n_seq_max = parallel + 1     # the last sequence id holds the shared prompt prefix
+            context_params.n_threads = context_params.n_threads_batch = (cpu_budget.threads if cpu_budget is not None else None) or os.cpu_count() or 1
+            self.__context = llama_cpp.llama_new_context_with_model(self.__model, context_params)
+            if not self.__context:
+                raise RuntimeError("Failed to create llama.cpp context")
+
+            self.__batch = llama_cpp.llama_batch_init(LLM_BATCH_TOKENS, 0, 1)
+
+            self.__prefix_seq = parallel
+            with pinned(cpu_budget):
+                self.__prefix = self.__evaluate_prefix() if LLM_PREFIX_CACHE else []
+
+        except Exception as e:
+            raise RuntimeError(f"Error initialising LlamaCppBatchManager: {e}")
+
+        self.__waiting = []
+        self.__active = []
+        self.__free_slots = list(range(parallel))
+        self.__condition = threading.Condition()
+        self.__running = True
+        self.__scheduler = threading.Thread(target=self.__schedule, name="llm-batch-scheduler", daemon=True)
+        self.__scheduler.start()
+        if cpu_budget is not None:
+            cpu_budget.on_resize(self.__resize)
+
+    def get_model(self):
+        return self.__name
+
+    # the prompt prefix evaluated at load has already run every layer, with LLM_PREFIX_CACHE=0 the first summary pages the weights in
+    def warm_up(self):
+        pass
+
+    def generate_summary(self, transcript):
+        with track_stage("llm"):
+            result = self.__submit(transcript).future.result()
+
+        return clean_summary(self.__name, result)
+
+    def stream_summary(self, transcript):
+        name = model_name(self.__name)
+        sequence = self.__submit(transcript, stream=True)
+
+        def pieces():
+            yield from iter(sequence.stream.get, None)
+            sequence.future.result()    # raises if the sequence failed
+
+        try:
+            with track_stage("llm"):
+                for i, text in enumerate(ThinkFilter(self.__name).filter(pieces())):
+                    if i == 0:
+                        LLM_TIME_TO_FIRST_TOKEN_SECONDS.labels(name, "batched").observe(time.perf_counter() - sequence.submitted)
+                    yield text
+        finally:
+            # a reader that stops early frees the slot instead of leaving the sequence to run to MAX_TOKENS
+            sequence.cancelled = True
+
+    def __submit(self, transcript, stream=False):
+        prefix, document = summary_prompt_parts(transcript)
+        if self.__prefix:
+            # tokenised apart so the prompt starts with exactly the tokens held by the prefix sequence
+            tokens = self.__prefix + self.__tokenize(document, add_special=False)
+        else:
+            tokens = self.__tokenize(prefix + document)
+        # the last prompt token is always decoded by the sequence itself, generation starts from its logits
+        shared = min(len(self.__prefix), len(tokens) - 1)
+
+        if len(tokens) + MAX_TOKENS > self.__n_ctx:
+            raise RuntimeError(f"Prompt of {len(tokens)} tokens does not fit the {self.__n_ctx} token context")
+
+        sequence = _Sequence(tokens, shared, stream)
+        with self.__condition:
+            if not self.__running:
+                raise RuntimeError("Model has not been loaded.")
+            self.__waiting.append(sequence)
+            self.__condition.notify()
+
+        return sequence
+
+    def unload(self):
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify()
+        self.__scheduler.join()
+
+        llama_cpp.llama_batch_free(self.__batch)
+        llama_cpp.llama_free(self.__context)
+        llama_cpp.llama_free_model(self.__model)
+
+    # budgets are rebalanced from whichever thread loads or unloads a model, the scheduler applies the new count between steps
+    def __resize(self, threads):
+        self.__threads = threads
+
+    # scheduler thread
+    def __schedule(self):
+        name = model_name(self.__name)
+
+        while True:
+            with self.__condition:
+                while self.__running and not self.__waiting and not self.__active:
+                    self.__condition.wait()
+
+                if not self.__running:
+                    for sequence in self.__waiting + self.__active:
+                        sequence.close(error=RuntimeError("Model was unloaded"))
+                    return
+
+                self.__waiting = [sequence for sequence in self.__waiting if not sequence.cancelled]
+                self.__admit()
+
+            for sequence in [sequence for sequence in self.__active if sequence.cancelled]:
+                self.__finish(sequence, error=RuntimeError("Summary was cancelled"))
+
+            LLM_ACTIVE_SEQUENCES.labels(name).set(len(self.__active))
+
+            try:
+                start = time.perf_counter()
+                sampled = self.__step()
+                if sampled:
+                    LLM_ENGINE_TOKENS_PER_SECOND.labels(name).set(sampled / (time.perf_counter() - start))
+            except Exception as e:
+                # a failed decode leaves the KV cache in an unknown state, fail everything in flight and start over
+                logger.error("llm batch step failed", extra={"model": name, "error": str(e)})
+                for sequence in list(self.__active):
+                    self.__finish(sequence, error=e)
+
+    def __admit(self):
+        # first come first served, a long prompt at the head is not overtaken so it can't starve
+        reserved = len(self.__prefix) + sum(sequence.reserved for sequence in self.__active)
+        while self.__waiting and self.__free_slots and reserved + self.__waiting[0].reserved <= self.__n_ctx:
+            sequence = self.__waiting.pop(0)
+            sequence.slot = self.__free_slots.pop(0)
+            sequence.started = time.perf_counter()
+
+            # the slot refers to the prefix cells instead of copying or recomputing them
+            if sequence.shared:
+                llama_cpp.llama_kv_cache_seq_cp(self.__context, self.__prefix_seq, sequence.slot, 0, sequence.shared)
+                sequence.n_past = sequence.shared
+            reserved += sequence.reserved
+            self.__active.append(sequence)
+
+    def __step(self):
+        batch = self.__batch
+        batch.n_tokens = 0
+
+        def add(token, position, slot, logits):
+            i = batch.n_tokens
+            batch.token[i] = token
+            batch.pos[i] = position
+            batch.n_seq_id[i] = 1
+            batch.seq_id[i][0] = slot
+            batch.logits[i] = logits
+            batch.n_tokens += 1
+            return i
+
+        # one token for every sequence that is generating, then fill the rest of the batch with prompt chunks
+        for sequence in self.__active:
+            sequence.batch_index = None
+            if sequence.next_token is not None:
+                sequence.batch_index = add(sequence.next_token, sequence.n_past, sequence.slot, True)
+
+        for sequence in self.__active:
+            remaining = len(sequence.prompt) - sequence.n_past
+            room = LLM_BATCH_TOKENS - batch.n_tokens
+            if sequence.next_token is not None or remaining <= 0 or room <= 0:
+                continue
+
+            chunk = min(remaining, room)
+            for position in range(sequence.n_past, sequence.n_past + chunk):
+                index = add(sequence.prompt[position], position, sequence.slot, position == len(sequence.prompt) - 1)
+            sequence.prefilled = chunk
+
+            # logits are only requested for the last prompt token, that is where generation starts
+            if sequence.n_past + chunk == len(sequence.prompt):
+                sequence.batch_index = index
+
+        if batch.n_tokens == 0:
+            return 0
+
+        threads, self.__threads = self.__threads, None
+        if threads:
+            llama_cpp.llama_set_n_threads(self.__context, threads, threads)
+
+        with pinned(self.__cpu_budget):
+            result = llama_cpp.llama_decode(self.__context, batch)
+        if result != 0:
+            raise RuntimeError(f"llama_decode returned {result}")
+
+        sampled = 0
+        for sequence in list(self.__active):
+            if sequence.next_token is not None:
+                sequence.output.append(sequence.next_token)
+                sequence.n_past += 1
+                sequence.next_token = None
+            elif sequence.prefilled:
+                sequence.n_past += sequence.prefilled
+                sequence.prefilled = 0
+
+            if sequence.batch_index is None:
+                continue
+
+            token = self.__sample(sequence, sequence.batch_index)
+            sampled += 1
+
+            if llama_cpp.llama_vocab_is_eog(self.__vocab, token) or len(sequence.output) >= MAX_TOKENS:
+                self.__finish(sequence)
+            else:
+                sequence.next_token = token
+                if sequence.stream is not None:
+                    sequence.stream.put(sequence.decoder.decode(self.__piece(token)))
+
+        return sampled
+
+    def __sample(self, sequence, index):
+        logits = np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(self.__context, index), shape=(self.__n_vocab,)).copy()
+
+        # repetition penalty over the recent output, the same rule llama.cpp applies
+        recent = np.array(sequence.output[-REPEAT_LAST_N:], dtype=np.int64)
+        if recent.size:
+            penalised = logits[recent]
+            logits[recent] = np.where(penalised > 0, penalised / REPEAT_PENALTY, penalised * REPEAT_PENALTY)
+
+        # top-k, temperature, then top-p over the softmax
+        candidates = np.argpartition(logits, -TOP_K)[-TOP_K:]
+        candidates = candidates[np.argsort(logits[candidates])[::-1]]
+        scaled = logits[candidates].astype(np.float64) / TEMPERATURE
+        probabilities = np.exp(scaled - scaled.max())
+        probabilities /= probabilities.sum()
+
+        keep = int(np.searchsorted(np.cumsum(probabilities), TOP_P)) + 1
+        probabilities = probabilities[:keep] / probabilities[:keep].sum()
+
+        return int(sequence.rng.choice(candidates[:keep], p=probabilities))
+
+    def __finish(self, sequence, error=None):
+        llama_cpp.llama_kv_cache_seq_rm(self.__context, sequence.slot, -1, -1)
+
+        with self.__condition:
+            self.__active.remove(sequence)
+            self.__free_slots.append(sequence.slot)
+
+        if error is not None:
+            sequence.close(error=error)
+            return
+
+        name = model_name(self.__name)
+        elapsed = time.perf_counter() - sequence.started
+        LLM_TOKENS.labels(name, "prompt").inc(len(sequence.prompt))
+        LLM_TOKENS.labels(name, "prompt_cached").inc(sequence.shared)
+        LLM_TOKENS.labels(name, "completion").inc(len(sequence.output))
+        LLM_REQUEST_SECONDS.labels(name, "batched").observe(time.perf_counter() - sequence.submitted)
+        if elapsed > 0:
+            LLM_TOKENS_PER_SECOND.labels(name).observe(len(sequence.output) / elapsed)
+
+        sequence.close(result=self.__detokenize(sequence.output))
+
+    def __evaluate_prefix(self):
+        # runs before the scheduler starts, so the context is still ours alone
+        prefix, _ = summary_prompt_parts("")
+        tokens = self.__tokenize(prefix)
+
+        batch = self.__batch
+        for start in range(0, len(tokens), LLM_BATCH_TOKENS):
+            chunk = tokens[start:start + LLM_BATCH_TOKENS]
+            batch.n_tokens = len(chunk)
+            for i, token in enumerate(chunk):
+                batch.token[i] = token
+                batch.pos[i] = start + i
+                batch.n_seq_id[i] = 1
+                batch.seq_id[i][0] = self.__prefix_seq
+                batch.logits[i] = False
+
+            result = llama_cpp.llama_decode(self.__context, batch)
+            if result != 0:
+                raise RuntimeError(f"llama_decode returned {result} for the prompt prefix")
+
+        return tokens
+
+    # tokenizer helpers
+    def __tokenize(self, text, add_special=True):
+        data = text.encode("utf-8")
+        capacity = len(data) + 2
+        tokens = (llama_cpp.llama_token * capacity)()
+        count = llama_cpp.llama_tokenize(self.__vocab, data, len(data), tokens, capacity, add_special, True)
+        if count < 0:
+            capacity = -count
+            tokens = (llama_cpp.llama_token * capacity)()
+            count = llama_cpp.llama_tokenize(self.__vocab, data, len(data), tokens, capacity, add_special, True)
+        return list(tokens[:count])
+
+    def __piece(self, token):
+        buffer = ctypes.create_string_buffer(256)
+        length = llama_cpp.llama_token_to_piece(self.__vocab, token, buffer, len(buffer), 0, False)
+        return buffer.raw[:length]
+
+    def __detokenize(self, tokens):
+        return b"".join(self.__piece(token) for token in tokens).decode("utf-8", errors="ignore").strip()
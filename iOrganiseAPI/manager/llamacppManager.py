@@ -1,54 +1,225 @@
+import os
 import re
+import time
+import threading
 
 from langchain_community.llms import LlamaCpp
+import llama_cpp
 
 from enums.DeviceTypes import DeviceTypes
 from enums.LlmModels import LlmModels
+from summaryPrompt import summary_prompt_parts, prompt_key
+from metrics import track_stage, LLM_TOKENS, LLM_TOKENS_PER_SECOND, LLM_REQUEST_SECONDS, LLM_TIME_TO_FIRST_TOKEN_SECONDS
+from cpuManager import pinned
+from utils import model_name
 
 LLM_MODELS = {
     "mistral_7b": ("/app/models/mistral_7b/model.bin", 8192),
     "deepseek_14b": ("/app/models/deepseek_14b/model.bin", 16384)
 }
 
+# set to 0 to evaluate the whole prompt for every summary
+LLM_PREFIX_CACHE = os.getenv("LLM_PREFIX_CACHE", "1") == "1"
+# map the GGUF file instead of reading it into memory, the weights are then shared with the page cache and a restart that finds
+# them still cached loads in a fraction of the time
+LLM_MMAP = os.getenv("LLM_MMAP", "1") == "1"
+
+def clean_summary(name, result):
+    # filter out COT tokens when using deepseek 14b, its chain of thought ends at the first </think>, where ThinkFilter starts a
+    # streamed summary too
+    if model_name(name) == "deepseek_14b":
+        result = re.sub(r".*?</think>", "", result, count=1, flags=re.DOTALL)
+
+    return result.strip()
+
+class ThinkFilter:
+    '''
+    The ThinkFilter class applies clean_summary to a summary while it streams: deepseek output is held back until the first </think>
+    has passed, and leading and trailing whitespace is dropped. Output that never closes its chain of thought is released at the end,
+    as clean_summary would keep it.
+    '''
+
+    TAG = "</think>"
+
+    def __init__(self, name):
+        self.__thinking = model_name(name) == "deepseek_14b"
+        self.__held = ""
+        self.__started = False
+
+    def filter(self, pieces):
+        for piece in pieces:
+            text = self.__feed(piece)
+            if text:
+                yield text
+
+        text = self.__flush()
+        if text:
+            yield text
+
+    def __feed(self, text):
+        if self.__thinking:
+            # the tag may arrive split over several tokens, so the whole held text is searched every time
+            self.__held += text
+            end = self.__held.find(self.TAG)
+            if end < 0:
+                return ""
+            self.__thinking = False
+            text, self.__held = self.__held[end + len(self.TAG):], ""
+
+        return self.__visible(text)
+
+    def __flush(self):
+        text, self.__held = self.__held, ""
+        if self.__thinking:
+            self.__thinking = False
+            return self.__visible(text)
+        return ""
+
+    def __visible(self, text):
+        if not self.__started:
+            text = text.lstrip()
+            self.__started = bool(text)
+
+        # trailing whitespace waits for the next text so the stream never ends in it
+        text = self.__held + text
+        stripped = text.rstrip()
+        self.__held = text[len(stripped):]
+        return stripped
+
 class LlamaCppManager:
-    def __init__(self, name: LlmModels, device: DeviceTypes):
+    def __init__(self, name: LlmModels, device: DeviceTypes, cpu_budget=None):
         try:
             self.__name = name
+            self.__cpu_budget = cpu_budget
+            self.__threads = None       # thread count waiting to be applied before the next summary
 
             model_path, context_length = LLM_MODELS.get(self.__name)
             llm_params = {
                 "model_path": model_path,
                 "temperature": 0.4,
                 "max_tokens": 2048,
-                "n_ctx": context_length
+                "n_ctx": context_length,
+                "use_mmap": LLM_MMAP
             }
 
             if device == "cuda":
                 llm_params["n_gpu_layers"] = 49
                 llm_params["n_batch"] = 512
+
+            # prompt evaluation has its own thread count in llama.cpp, both follow the budget
+            if cpu_budget is not None and cpu_budget.threads:
+                llm_params["n_threads"] = cpu_budget.threads
+                llm_params["model_kwargs"] = {"n_threads_batch": cpu_budget.threads}
             
-            self.__llm = LlamaCpp(**llm_params)
+            with pinned(cpu_budget):
+                self.__llm = LlamaCpp(**llm_params)
+            self.__lock = threading.Lock()
+            if cpu_budget is not None:
+                cpu_budget.on_resize(self.__resize)
+            self.__prefix_states = {}   # prompt key -> llama.cpp state right after the instruction prefix
 
         except Exception as e:
             raise RuntimeError(f"Error initialising LlamaCppManager: {e}")
 
     def get_model(self):
         return self.__name
+
+    # evaluating the instruction prefix runs every layer once, which pages the mapped weights in and leaves the prefix state cached
+    def warm_up(self):
+        prefix, _ = summary_prompt_parts("")
+        with self.__lock, pinned(self.__cpu_budget):
+            self.__apply_threads()
+            client = self.__llm.client
+            client.reset()
+            client.eval(client.tokenize(prefix.encode("utf-8"), special=True))
+            if LLM_PREFIX_CACHE:
+                self.__prefix_states.setdefault(prompt_key(), client.save_state())
     
     def generate_summary(self, transcript):
-        prompt = f"""
-        Instructions:
-        Provide me with a short english summary of what is in Transcript using as little words as possible and in bullet point form without adding your own information or repeating Instructions.
+        prefix, document = summary_prompt_parts(transcript)
+        prompt = prefix + document
+
+        # generate the content summary, the llama.cpp context holds a single sequence so concurrent lease holders take turns
+        submitted = time.perf_counter()
+        with self.__lock, pinned(self.__cpu_budget):
+            start = time.perf_counter()
+            self.__apply_threads()
+            with track_stage("llm"):
+                if LLM_PREFIX_CACHE:
+                    self.__restore_prefix(prefix)
+                result = self.__llm.invoke(prompt)
+            self.__record_throughput(prompt, result, time.perf_counter() - start)
+        LLM_REQUEST_SECONDS.labels(model_name(self.__name), "single").observe(time.perf_counter() - submitted)
+
+        return clean_summary(self.__name, result)
+
+    def stream_summary(self, transcript):
+        prefix, document = summary_prompt_parts(transcript)
+        prompt = prefix + document
+        name = model_name(self.__name)
+        output = []
+
+        # each step of the stream may run on a different threadpool thread, and other work runs on that thread between steps, so a
+        # step is pinned on its own rather than the whole stream
+        def generate():
+            chunks = self.__llm.stream(prompt)
+            while True:
+                with pinned(self.__cpu_budget):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                output.append(chunk)
+                yield chunk
+
+        submitted = time.perf_counter()
+        with self.__lock:
+            start = time.perf_counter()
+            self.__apply_threads()
+            with track_stage("llm"):
+                if LLM_PREFIX_CACHE:
+                    with pinned(self.__cpu_budget):
+                        self.__restore_prefix(prefix)
+
+                for i, text in enumerate(ThinkFilter(self.__name).filter(generate())):
+                    if i == 0:
+                        LLM_TIME_TO_FIRST_TOKEN_SECONDS.labels(name, "single").observe(time.perf_counter() - submitted)
+                    yield text
+            self.__record_throughput(prompt, "".join(output), time.perf_counter() - start)
+        LLM_REQUEST_SECONDS.labels(name, "single").observe(time.perf_counter() - submitted)
+
+    # budgets are rebalanced from whichever thread loads or unloads a model, the context only changes between summaries
+    def __resize(self, threads):
+        self.__threads = threads
+
+    # callers must hold the lock
+    def __apply_threads(self):
+        threads, self.__threads = self.__threads, None
+        if threads:
+            llama_cpp.llama_set_n_threads(self.__llm.client.ctx, threads, threads)
+
+    def __restore_prefix(self, prefix):
+        # llama.cpp only evaluates the prompt tokens after the longest match with what its context already holds, so putting the
+        # prefix state back in place leaves just the document to evaluate
+        client = self.__llm.client
+        key = prompt_key()
 
-        Transcript: 
-        {transcript}
-        """
+        state = self.__prefix_states.get(key)
+        if state is None:
+            tokens = client.tokenize(prefix.encode("utf-8"), special=True)
+            client.reset()
+            client.eval(tokens)
+            state = self.__prefix_states[key] = client.save_state()
+        elif list(client.input_ids[:state.n_tokens]) != list(state.input_ids[:state.n_tokens]):
+            client.load_state(state)
 
-        # generate the content summary
-        result = self.__llm.invoke(prompt)
+        LLM_TOKENS.labels(model_name(self.__name), "prompt_cached").inc(state.n_tokens)
 
-        # filter out COT tokens when using deepseek 14b
-        if self.__name == "deepseek_14b":
-            result = re.sub(r".*</think>", "", result, flags=re.DOTALL).strip()
+    def __record_throughput(self, prompt, result, elapsed):
+        name = model_name(self.__name)
+        prompt_tokens = self.__llm.get_num_tokens(prompt)
+        completion_tokens = self.__llm.get_num_tokens(result)
 
-        return result
\ No newline at end of file
+        LLM_TOKENS.labels(name, "prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(name, "completion").inc(completion_tokens)
+        if elapsed > 0:
+            LLM_TOKENS_PER_SECOND.labels(name).observe(completion_tokens / elapsed)
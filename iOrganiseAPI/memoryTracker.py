@@ -0,0 +1,241 @@
+import os
+import time
+import asyncio
+import threading
+
+import psutil
+
+from metrics import PROCESS_RSS_BYTES, MODEL_RSS_BYTES, REQUEST_PEAK_RSS_BYTES, MODEL_ADMISSION_REFUSALS
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+MB = 1024 * 1024
+
+# memory kept free for the API process itself, request buffers and the page cache
+MEMORY_RESERVE = int(os.getenv("MEMORY_RESERVE_MB", "1024")) * MB
+# seconds a model load waits for memory to be released before it is refused (0 refuses immediately)
+MEMORY_ADMISSION_TIMEOUT = float(os.getenv("MEMORY_ADMISSION_TIMEOUT", "0"))
+# how often the background sampler refreshes RSS for per request peaks
+MEMORY_SAMPLE_INTERVAL = float(os.getenv("MEMORY_SAMPLE_INTERVAL_MS", "100")) / 1000
+# resident size relative to the weights on disk when a model has never been loaded before
+MODEL_OVERHEAD_FACTOR = float(os.getenv("MODEL_OVERHEAD_FACTOR", "1.3"))
+
+class InsufficientMemoryError(RuntimeError):
+    def __init__(self, model_key, model, required, available):
+        self.model_key = model_key
+        self.model = model
+        self.required = required
+        self.available = available
+        super().__init__(f"Not enough memory to load {model_key} model {model}: needs {required // MB} MB, {available // MB} MB available")
+
+def _read_int(path):
+    try:
+        with open(path) as cgroup_file:
+            value = cgroup_file.read().strip()
+        return None if value == "max" else int(value)
+    except (OSError, ValueError):
+        return None
+
+def memory_limit():
+    # the container's cgroup limit is what the OOM killer enforces, fall back to physical memory outside a container
+    limit = _read_int("/sys/fs/cgroup/memory.max") or _read_int("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    total = psutil.virtual_memory().total
+    return min(limit, total) if limit else total
+
+def available_memory():
+    limit = _read_int("/sys/fs/cgroup/memory.max") or _read_int("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    usage = _read_int("/sys/fs/cgroup/memory.current") or _read_int("/sys/fs/cgroup/memory/memory.usage_in_bytes")
+    system_available = psutil.virtual_memory().available
+
+    if limit and usage and limit < psutil.virtual_memory().total:
+        return min(limit - usage, system_available)
+    return system_available
+
+def _on_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+def process_rss():
+    return psutil.Process().memory_info().rss
+
+def path_size(path):
+    if not path or not os.path.exists(path):
+        return 0
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+class MemoryTracker:
+    '''
+    The MemoryTracker class keeps per-model memory accounting (RSS delta on load and unload), tracks peak RSS per request and decides
+    whether there is room to load another model.
+    '''
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__freed = threading.Condition()    # notified whenever a model is unloaded or a reservation ends, admit() waits on it
+        self.__resident = {}        # model_key -> accounting record of the model currently loaded under that key
+        self.__observed = {}        # (model_key, model) -> RSS delta of the most recent load, used as the next estimate
+        self.__pending = {}         # model_key -> memory reserved for a load in progress, and whether another load ran alongside it
+        self.__unloads = []         # most recent unload results, to check that memory is actually given back
+        self.__requests = {}        # id -> peak tracking dict of every request in flight
+        self.__recent_peaks = []
+        self.__sampler = None
+
+    # model accounting
+    def estimate(self, model_key, model, weights_path=None):
+        observed = self.__observed.get((model_key, model))
+        if observed:
+            return observed
+        return int(path_size(weights_path) * MODEL_OVERHEAD_FACTOR)
+
+    def admit(self, model_key, model, required, evict=None):
+        '''
+        Blocks until `required` bytes fit under the memory limit, then reserves them until record_load() or cancel_load(), so loads
+        running side by side don't each count on the same free memory. `evict` is called once to let the caller unload idle models.
+        Raises InsufficientMemoryError when the memory does not become available within MEMORY_ADMISSION_TIMEOUT. A load on the
+        event loop thread is refused without waiting, since waiting there would stop the requests that could free the memory.
+        '''
+        deadline = time.monotonic() + (0 if _on_event_loop() else MEMORY_ADMISSION_TIMEOUT)
+        evicted = False
+
+        while True:
+            with self.__lock:
+                available = available_memory() - MEMORY_RESERVE - sum(pending["bytes"] for pending in self.__pending.values())
+                if required <= available:
+                    for pending in self.__pending.values():
+                        pending["overlapped"] = True
+                    self.__pending[model_key] = {"bytes": required, "overlapped": bool(self.__pending)}
+                    return
+
+            if evict and not evicted:
+                evicted = True
+                evict()
+                continue
+
+            if time.monotonic() >= deadline:
+                MODEL_ADMISSION_REFUSALS.labels(model_key, model).inc()
+                logger.warning("model load refused", extra={"model_key": model_key, "model": model, "required_mb": required // MB, "available_mb": available // MB})
+                raise InsufficientMemoryError(model_key, model, required, max(available, 0))
+
+            # woken by an unload or a finished load, memory freed outside the tracker is picked up by checking again every half second
+            with self.__freed:
+                self.__freed.wait(min(0.5, deadline - time.monotonic()))
+
+    def record_load(self, model_key, model, rss_before, rss_after, seconds):
+        delta = max(rss_after - rss_before, 0)
+        with self.__lock:
+            pending = self.__pending.pop(model_key, None)
+            # the RSS of loads that overlapped grew for all of them, the reservation stands in for the model's share and isn't learned
+            overlapped = pending is not None and pending["overlapped"]
+            if overlapped:
+                delta = pending["bytes"]
+            else:
+                self.__observed[(model_key, model)] = delta
+
+            self.__resident[model_key] = {
+                "model_key": model_key,
+                "model": model,
+                "rss_delta_bytes": delta,
+                "load_seconds": round(seconds, 3),
+                "loaded_at": time.time()
+            }
+
+        MODEL_RSS_BYTES.labels(model_key, model).set(delta)
+        self.sample()
+        self.__notify()
+        logger.info("model memory accounted", extra={"model_key": model_key, "model": model, "rss_delta_mb": delta // MB, "overlapped": overlapped})
+
+    # hands back the memory admit() reserved for a load that failed
+    def cancel_load(self, model_key):
+        with self.__lock:
+            self.__pending.pop(model_key, None)
+        self.__notify()
+
+    def __notify(self):
+        with self.__freed:
+            self.__freed.notify_all()
+
+    def record_unload(self, model_key, rss_before, rss_after):
+        with self.__lock:
+            record = self.__resident.pop(model_key, None)
+            if record is None:
+                return
+
+            freed = rss_before - rss_after
+            self.__unloads = (self.__unloads + [{
+                "model_key": model_key,
+                "model": record["model"],
+                "loaded_rss_delta_bytes": record["rss_delta_bytes"],
+                "freed_bytes": freed,
+                "unloaded_at": time.time()
+            }])[-20:]
+
+        MODEL_RSS_BYTES.labels(model_key, record["model"]).set(0)
+        self.sample()
+        self.__notify()
+
+    # request accounting
+    def start_request(self):
+        # the dict is shared with the sampler thread, which raises "peak" while the request is in flight
+        rss = process_rss()
+        stats = {"start": rss, "peak": rss}
+
+        with self.__lock:
+            self.__requests[id(stats)] = stats
+            if self.__sampler is None:
+                self.__sampler = threading.Thread(target=self.__sample_loop, name="memory-sampler", daemon=True)
+                self.__sampler.start()
+
+        return stats
+
+    def finish_request(self, stats, endpoint):
+        self.sample()
+        with self.__lock:
+            self.__requests.pop(id(stats), None)
+            self.__recent_peaks = (self.__recent_peaks + [{"endpoint": endpoint, "peak_rss_bytes": stats["peak"], "start_rss_bytes": stats["start"], "finished_at": time.time()}])[-50:]
+
+        REQUEST_PEAK_RSS_BYTES.labels(endpoint).observe(stats["peak"])
+
+    def sample(self):
+        rss = process_rss()
+        PROCESS_RSS_BYTES.set(rss)
+
+        with self.__lock:
+            for stats in self.__requests.values():
+                stats["peak"] = max(stats["peak"], rss)
+
+        return rss
+
+    def __sample_loop(self):
+        while True:
+            time.sleep(MEMORY_SAMPLE_INTERVAL)
+            if self.__requests:
+                self.sample()
+
+    def snapshot(self):
+        with self.__lock:
+            resident = list(self.__resident.values())
+            unloads = list(self.__unloads)
+            peaks = list(self.__recent_peaks)
+            estimates = {f"{key}:{model}": delta for (key, model), delta in self.__observed.items()}
+            pending = {key: reservation["bytes"] for key, reservation in self.__pending.items()}
+
+        return {
+            "process_rss_bytes": self.sample(),
+            "available_bytes": available_memory(),
+            "limit_bytes": memory_limit(),
+            "reserve_bytes": MEMORY_RESERVE,
+            "resident_models": resident,
+            "resident_models_bytes": sum(record["rss_delta_bytes"] for record in resident),
+            "pending_load_bytes": pending,
+            "observed_load_bytes": estimates,
+            "recent_unloads": unloads,
+            "recent_request_peaks": peaks
+        }
+
+memory_tracker = MemoryTracker()
@@ -0,0 +1,156 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from profiler import span
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+# bucket layouts (seconds) for the different kinds of latency we track
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+WIDE_BUCKETS = FAST_BUCKETS + SLOW_BUCKETS[5:]
+
+# model lifecycle
+MODEL_LOAD_SECONDS = Histogram(
+    "iorganise_model_load_seconds", "Time taken to load a model into memory, cold for its first load in the process",
+    ["model_key", "model", "start"], buckets=SLOW_BUCKETS
+)
+MODELS_LOADED = Gauge("iorganise_models_loaded", "Models currently resident in memory", ["model_key", "model"])
+MODEL_LEASES = Gauge("iorganise_model_leases", "Callers currently holding a lease on a model", ["model_key"])
+CPU_THREADS = Gauge("iorganise_cpu_threads", "Threads assigned to a loaded inference engine", ["model_key"])
+
+# inference
+STAGE_LATENCY_SECONDS = Histogram(
+    "iorganise_stage_latency_seconds", "Latency of a single pipeline stage call",
+    ["stage"], buckets=WIDE_BUCKETS
+)
+STAGE_ERRORS = Counter("iorganise_stage_errors_total", "Pipeline stage calls that raised", ["stage"])
+ASR_AUDIO_SECONDS = Counter("iorganise_asr_audio_seconds_total", "Seconds of audio transcribed", ["model"])
+ASR_REUSED_SECONDS = Counter("iorganise_asr_reused_seconds_total", "Seconds of audio whose transcript was reused from a matching recording", ["model"])
+ASR_RESUMED_SECONDS = Counter("iorganise_asr_resumed_seconds_total", "Seconds of audio whose transcript was recovered from the checkpoint of an interrupted transcription", ["model"])
+SPEECH_PROBES = Counter("iorganise_speech_probes_total", "Audio/video uploads probed for speech before transcription, by verdict", ["verdict"])
+SPEECH_RATIO = Histogram(
+    "iorganise_speech_ratio", "Share of a probed recording that sounds like speech",
+    buckets=(0, 0.01, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1)
+)
+ASR_SPEED = Histogram(
+    "iorganise_asr_audio_seconds_per_wall_second", "Seconds of audio transcribed per wall clock second",
+    ["model"], buckets=(0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+)
+ASR_TIER_DECISIONS = Counter("iorganise_asr_tier_decisions_total", "ASR model chosen for a waiting request, by the model the user asked for", ["requested", "model"])
+ASR_LATENCY_SECONDS = Histogram(
+    "iorganise_asr_latency_seconds", "Time from choosing the ASR model for a waiting request to its transcript",
+    ["model"], buckets=SLOW_BUCKETS
+)
+LLM_TOKENS = Counter("iorganise_llm_tokens_total", "Tokens processed by the LLM", ["model", "kind"])
+LLM_TOKENS_PER_SECOND = Histogram(
+    "iorganise_llm_tokens_per_second", "LLM generation throughput per call",
+    ["model"], buckets=(0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "iorganise_llm_request_seconds", "Time from submitting a summary to receiving it, including queueing",
+    ["model", "engine"], buckets=SLOW_BUCKETS
+)
+LLM_TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "iorganise_llm_time_to_first_visible_token_seconds", "Time from submitting a streamed summary to its first visible token, after any chain of thought",
+    ["model", "engine"], buckets=SLOW_BUCKETS
+)
+PROMPT_COMPRESSION_RATIO = Histogram(
+    "iorganise_prompt_compression_ratio", "Share of the estimated document tokens kept by extractive compression before summarisation",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1)
+)
+LLM_ACTIVE_SEQUENCES = Gauge("iorganise_llm_active_sequences", "Sequences being decoded together by the batched LLM engine", ["model"])
+LLM_ENGINE_TOKENS_PER_SECOND = Gauge("iorganise_llm_engine_tokens_per_second", "Aggregate tokens sampled per second across all sequences in the last decode step", ["model"])
+
+# memory
+PROCESS_RSS_BYTES = Gauge("iorganise_process_rss_bytes", "Resident set size of the API process")
+MODEL_RSS_BYTES = Gauge("iorganise_model_rss_bytes", "RSS growth observed when the model was loaded", ["model_key", "model"])
+MODEL_ADMISSION_REFUSALS = Counter("iorganise_model_admission_refusals_total", "Model loads refused for lack of memory", ["model_key", "model"])
+REQUEST_PEAK_RSS_BYTES = Histogram(
+    "iorganise_request_peak_rss_bytes", "Peak process RSS observed while serving a request",
+    ["endpoint"], buckets=tuple(gb * 2 ** 30 for gb in (0.5, 1, 2, 4, 6, 8, 12, 16, 24, 32, 48, 64))
+)
+
+# queues
+QUEUE_DEPTH = Gauge("iorganise_queue_depth", "Work items waiting to be processed", ["queue"])
+ADMISSION_REJECTIONS = Counter("iorganise_admission_rejections_total", "Requests turned away by admission control", ["model_key", "status"])
+ADMISSION_WAIT_SECONDS = Histogram(
+    "iorganise_admission_wait_seconds", "Time admitted work waited for a free model slot",
+    ["model_key"], buckets=WIDE_BUCKETS
+)
+FAIR_QUEUE_DEPTH = Gauge("iorganise_fair_queue_depth", "Work waiting for a model slot, per owner (user, client address or background)", ["model_key", "owner"])
+FAIR_QUEUE_WAIT_SECONDS = Counter("iorganise_fair_queue_wait_seconds_total", "Seconds work waited for a model slot, per owner", ["model_key", "owner"])
+FAIR_QUEUE_SERVED = Counter("iorganise_fair_queue_served_total", "Work given a model slot, per owner", ["model_key", "owner"])
+ADMISSION_BACKLOG_SECONDS = Gauge("iorganise_admission_backlog_seconds", "Estimated seconds to drain the admitted work of a model", ["model_key"])
+INFERENCE_BATCH_SIZE = Histogram(
+    "iorganise_inference_batch_size", "Requests served together by the inference server",
+    ["model_key"], buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+INFERENCE_QUEUE_SECONDS = Histogram(
+    "iorganise_inference_queue_seconds", "Time a request waited in the inference server queue",
+    ["model_key"], buckets=WIDE_BUCKETS
+)
+INFERENCE_CALL_SECONDS = Histogram(
+    "iorganise_inference_call_seconds", "Round trip of a call from an API worker to the inference server",
+    ["op"], buckets=WIDE_BUCKETS
+)
+PIPELINE_MAKESPAN_SECONDS = Histogram(
+    "iorganise_pipeline_makespan_seconds", "Time from the first to the last file of a batch processed by a pipeline",
+    ["pipeline", "mode"], buckets=SLOW_BUCKETS
+)
+DERIVATIONS = Counter("iorganise_derivations_total", "Uploaded files processed by the background derivation scheduler", ["outcome"])
+DERIVATION_SECONDS = Histogram(
+    "iorganise_derivation_seconds", "Time taken to derive the content, subject and summary of a file in the background",
+    buckets=SLOW_BUCKETS
+)
+
+# http
+REQUEST_SECONDS = Histogram(
+    "iorganise_http_request_seconds", "HTTP request latency",
+    ["method", "endpoint", "status"], buckets=WIDE_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge("iorganise_http_requests_in_flight", "HTTP requests currently being served")
+
+# database
+DB_QUERY_SECONDS = Histogram("iorganise_db_query_seconds", "Latency of a single SQL statement", buckets=FAST_BUCKETS)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "iorganise_db_queries_per_request", "SQL statements executed while serving a request",
+    ["endpoint"], buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+DB_SECONDS_PER_REQUEST = Histogram(
+    "iorganise_db_seconds_per_request", "Time spent in SQL statements while serving a request",
+    ["endpoint"], buckets=FAST_BUCKETS
+)
+
+# per request database accounting, populated by the SQLAlchemy hooks in database.py
+_request_db_stats: ContextVar[Optional[dict]] = ContextVar("request_db_stats", default=None)
+
+def start_request_db_stats():
+    stats = {"queries": 0, "seconds": 0.0}
+    _request_db_stats.set(stats)
+    return stats
+
+def record_db_query(elapsed: float):
+    DB_QUERY_SECONDS.observe(elapsed)
+
+    stats = _request_db_stats.get()
+    if stats is not None:
+        stats["queries"] += 1
+        stats["seconds"] += elapsed
+
+# timing helpers
+@contextmanager
+def track_stage(stage: str, **attributes):
+    start = time.perf_counter()
+    try:
+        with span(stage, **attributes):
+            yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_LATENCY_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+def render_metrics():
+    return generate_latest(), CONTENT_TYPE_LATEST
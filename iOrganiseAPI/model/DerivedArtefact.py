@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, UniqueConstraint, func
+from sqlalchemy.orm import relationship
+from database import Base
+
+class DerivedArtefact(Base):
+    __tablename__ = "derived_artefacts"
+    __table_args__ = (UniqueConstraint("file_id", "stage"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    file_id = Column(Integer, ForeignKey("file_uploads.id", ondelete="CASCADE"), index=True, nullable=False)
+    stage = Column(String(20), nullable=False)
+    producer = Column(String(100), nullable=False)
+    version = Column(String(100), nullable=False)
+    input_hash = Column(String(64), nullable=False)
+    output_hash = Column(String(64), nullable=False)
+    created_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    file_upload = relationship("FileUpload", back_populates="derived_artefacts")
@@ -1,58 +1,220 @@
-from manager.fasterwhisperManager import FasterWhisperManager
-from manager.llamacppManager import LlamaCppManager
-from manager.bertManager import DistilBertManager
+from manager.fasterwhisperManager import FasterWhisperManager, ASR_MODELS
+from manager.llamacppManager import LlamaCppManager, LLM_MODELS
+from manager.bertManager import DistilBertManager, MODEL_PATH as BERT_MODEL_PATH
 from utils import *
+from metrics import MODEL_LOAD_SECONDS, MODELS_LOADED, MODEL_LEASES
+from memoryTracker import memory_tracker, process_rss
+from cpuManager import cpu_manager
+from logger import get_logger
+from profiler import span
+
+import os
+import time
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from fastapi.concurrency import run_in_threadpool
+
+logger = get_logger(__name__)
+
+# "single" runs one summary at a time through langchain, "batched" decodes up to LLM_PARALLEL summaries together
+LLM_ENGINE = os.getenv("LLM_ENGINE", "single")
+if LLM_ENGINE == "batched":
+    from manager.llamacppBatchManager import LlamaCppBatchManager as LlmManager
+else:
+    LlmManager = LlamaCppManager
 
 class ModelLoader():
     '''
     The ModelLoader class is used to manage the loading and unloading of models in memory while keeping track of the models that are currently active.
+
+    Models are handed out as reference counted leases: concurrent callers of the same model share one instance, a model with active leases
+    is never unloaded, and swapping the model under a key waits until every lease on the current one has been released.
     '''
 
     def __init__(self):
         self.__loaded_models = {}   # key-value pair mapping the type of model being loaded to its corresponding variable.
+        self.__leases = {}          # model key -> number of callers currently using the loaded model
+        self.__loading = set()      # model keys with a load in progress
+        self.__pending_unload = set()   # leased model keys that should be unloaded once their last lease is released
+        self.__load_times = {}      # (model key, model) -> seconds of its first (cold) and most recent later (warm) load
+        self.__condition = threading.Condition()
 
-    # model loading functions
-    def load_asr(self, model, device, batch_size, compute_type):
-        model_key = "ASR"
+    # lease functions
+    def acquire_asr(self, model, device, batch_size, compute_type):
+        return self.__acquire("ASR", model, ASR_MODELS.get(model_name(model)), lambda cpu_budget: FasterWhisperManager(model, device, batch_size, compute_type, cpu_budget=cpu_budget))
+
+    def acquire_llm(self, model, device):
+        return self.__acquire("LLM", model, LLM_MODELS.get(model_name(model), (None,))[0], lambda cpu_budget: LlmManager(model, device, cpu_budget=cpu_budget))
+
+    def acquire_bert(self):
+        return self.__acquire("BERT", "distilbert", BERT_MODEL_PATH, lambda cpu_budget: DistilBertManager(cpu_budget=cpu_budget))
+
+    def release(self, model_key):
+        with self.__condition:
+            self.__leases[model_key] -= 1
+            MODEL_LEASES.labels(model_key).set(self.__leases[model_key])
+
+            if self.__leases[model_key] == 0 and model_key in self.__pending_unload:
+                self.__pending_unload.discard(model_key)
+                self.__unload(model_key)
+
+            self.__condition.notify_all()
+
+    @contextmanager
+    def lease(self, model_key, *args):
+        manager = self.__acquirers()[model_key](*args)
+        try:
+            yield manager
+        finally:
+            self.release(model_key)
+
+    # acquiring may wait for other leases to drain, so async callers wait in a worker thread instead of blocking the event loop
+    @asynccontextmanager
+    async def lease_async(self, model_key, *args):
+        manager = await run_in_threadpool(self.__acquirers()[model_key], *args)
+        try:
+            yield manager
+        finally:
+            await run_in_threadpool(self.release, model_key)
+
+    def __acquirers(self):
+        return {"ASR": self.acquire_asr, "LLM": self.acquire_llm, "BERT": self.acquire_bert}
+
+    def __acquire(self, model_key, model, weights_path, factory):
+        with self.__condition:
+            while True:
+                current = self.__loaded_models.get(model_key)
+
+                # share the instance that is already loaded
+                if current is not None and current.get_model() == model:
+                    self.__pending_unload.discard(model_key)
+                    self.__leases[model_key] = self.__leases.get(model_key, 0) + 1
+                    MODEL_LEASES.labels(model_key).set(self.__leases[model_key])
+                    return current
+
+                # a different model (or none) is under this key, it can only be replaced once nobody is using it
+                if model_key not in self.__loading and self.__leases.get(model_key, 0) == 0:
+                    break
+
+                self.__condition.wait()
+
+            self.__loading.add(model_key)
+            if current is not None:
+                self.__unload(model_key)
+
+        # load outside the lock so that leases on other models can still be taken and released meanwhile
+        try:
+            manager = self.__timed_load(model_key, model, weights_path, factory)
+        except Exception:
+            with self.__condition:
+                self.__loading.discard(model_key)
+                self.__condition.notify_all()
+            raise
+
+        with self.__condition:
+            self.__loading.discard(model_key)
+            self.__loaded_models[model_key] = manager
+            self.__leases[model_key] = 1
+            MODEL_LEASES.labels(model_key).set(1)
+            self.__condition.notify_all()
 
-        if model_key not in self.__loaded_models or self.__loaded_models[model_key].get_model() != model:
-            self.del_models(model_key)
-            self.__loaded_models[model_key] = FasterWhisperManager(model, device, batch_size, compute_type)
+        return manager
+
+    # model loading functions, these hand out the model without a lease and are only safe when nothing else shares the loader
+    def load_asr(self, model, device, batch_size, compute_type):
+        with self.lease("ASR", model, device, batch_size, compute_type) as manager:
+            return manager
 
-        return self.__loaded_models.get(model_key)  
-    
     def load_llm(self, model, device):
-        model_key = "LLM"
+        with self.lease("LLM", model, device) as manager:
+            return manager
 
-        if model_key not in self.__loaded_models or self.__loaded_models[model_key].get_model() != model:
-            self.del_models(model_key)
-            self.__loaded_models[model_key] = LlamaCppManager(model, device)
-        
-        return self.__loaded_models.get(model_key)
-    
     def load_bert(self):
-        model_key = "BERT"
+        with self.lease("BERT") as manager:
+            return manager
+
+    # construct a manager once there is enough memory for it, while recording how long the load took and how much memory it used
+    def __timed_load(self, model_key, model, weights_path, factory):
+        model = model_name(model)
+        required = memory_tracker.estimate(model_key, model, weights_path)
+        memory_tracker.admit(model_key, model, required, evict=lambda: self.__evict_all_except(model_key))
+
+        # the engine is sized to its share of the cores as it is created, and the others shrink to make room for it
+        cpu_budget = cpu_manager.acquire(model_key)
+
+        rss_before = process_rss()
+        start = time.perf_counter()
+        try:
+            with span(f"load:{model_key}", model=model):
+                manager = factory(cpu_budget)
+        except Exception:
+            cpu_manager.release(model_key)
+            memory_tracker.cancel_load(model_key)
+            raise
+        elapsed = time.perf_counter() - start
+
+        # the first load in the process reads the weights from wherever they are, later ones usually find them in the page cache
+        with self.__condition:
+            load_times = self.__load_times.setdefault((model_key, model), {})
+            start_kind = "warm" if "cold_seconds" in load_times else "cold"
+            load_times[f"{start_kind}_seconds"] = round(elapsed, 3)
+
+        MODEL_LOAD_SECONDS.labels(model_key, model, start_kind).observe(elapsed)
+        MODELS_LOADED.labels(model_key, model).set(1)
+        memory_tracker.record_load(model_key, model, rss_before, process_rss(), elapsed)
+        logger.info("model loaded", extra={"model_key": model_key, "model": model, "seconds": round(elapsed, 3), "start": start_kind})
+
+        return manager
+
+    # unload every other idle model to make room for the one being loaded, models in use are never evicted
+    def __evict_all_except(self, model_key):
+        with self.__condition:
+            idle = [key for key in self.__loaded_models if key != model_key and self.__leases.get(key, 0) == 0]
+            if idle:
+                logger.info("evicting models to free memory", extra={"model_key": model_key, "evicted": idle})
+            for key in idle:
+                self.__unload(key)
 
-        if model_key not in self.__loaded_models:
-            self.del_models(model_key)
-            self.__loaded_models[model_key] = DistilBertManager()
-        
-        return self.__loaded_models.get(model_key)
-    
     # retrieve model with key
     def get_model(self, model_key):
         return self.__loaded_models.get(model_key)
-    
-    # delete models with keys
-    def del_models(self, *model_keys):
-        for key in model_keys:
-            if key in self.__loaded_models:
-                del self.__loaded_models[key]
+
+    def get_leases(self):
+        with self.__condition:
+            return {key: count for key, count in self.__leases.items() if count}
+
+    def get_load_times(self):
+        with self.__condition:
+            return {f"{model_key}:{model}": dict(times) for (model_key, model), times in self.__load_times.items()}
+
+    # callers must hold the condition
+    def __unload(self, model_key):
+        manager = self.__loaded_models.pop(model_key)
+        MODELS_LOADED.labels(model_key, model_name(manager.get_model())).set(0)
+
+        rss_before = process_rss()
+        if hasattr(manager, "unload"):
+            manager.unload()
+        del manager
         free_memory()
+        memory_tracker.record_unload(model_key, rss_before, process_rss())
+        cpu_manager.release(model_key)
+
+    # delete models with keys, models still leased are unloaded when their last lease is released
+    def del_models(self, *model_keys):
+        with self.__condition:
+            for key in model_keys:
+                if key not in self.__loaded_models:
+                    continue
+
+                if self.__leases.get(key, 0):
+                    self.__pending_unload.add(key)
+                else:
+                    self.__unload(key)
 
     # delete all models currently loaded
     def del_all_models(self):
-        self.__loaded_models.clear()
-        free_memory()
+        with self.__condition:
+            self.del_models(*list(self.__loaded_models))
 
-        return self
\ No newline at end of file
+        return self
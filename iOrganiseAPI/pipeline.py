@@ -0,0 +1,176 @@
+import os
+import time
+import asyncio
+from contextlib import AsyncExitStack
+
+from metrics import QUEUE_DEPTH, STAGE_ERRORS
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# items waiting in front of a stage before the stages feeding it have to wait
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+
+_DONE = object()
+
+class _Stage:
+    def __init__(self, name, work, workers, upstream, resource, bounded):
+        self.name = name
+        self.work = work
+        self.workers = workers
+        self.upstream = upstream
+        self.resource = resource
+        self.bounded = bounded
+        self.queue = None
+        self.closed = None
+        self.opening = None
+        self.opened = False
+        self.value = None
+        self.items = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+
+class Pipeline:
+    '''
+    The Pipeline class runs a batch of items through a DAG of stages connected by bounded queues. Every stage has its own workers and
+    hands each item on as soon as it is done with it, so slow I/O in one stage overlaps with compute in another. work(item, resource)
+    returns the name of the next stage, or None when the item is finished. A stage's resource (a model lease, say) is an async context
+    manager entered when its first item arrives and left once no more items can reach it. A stage whose resource may wait for other
+    stages to close has to be unbounded, or the stages it waits for could block on its full queue. With sequential=True each stage only
+    starts after every stage declared before it has finished, with one worker and unbounded queues, which is how the batch ran before.
+    '''
+
+    def __init__(self, name, queue_size=PIPELINE_QUEUE_SIZE, sequential=False):
+        self.name = name
+        self.queue_size = queue_size
+        self.sequential = sequential
+        self.__stages = {}
+        self.__finished = []
+        self.__failed = []          # (item, stage name, error) of every item a stage raised on, the item goes no further
+
+    def stage(self, name, work, workers=1, upstream=(), resource=None, bounded=True):
+        self.__stages[name] = _Stage(name, work, 1 if self.sequential else workers, tuple(upstream), resource, bounded)
+
+    async def wait_closed(self, *names):
+        await asyncio.gather(*(self.__stages[name].closed.wait() for name in names))
+
+    async def run(self, items):
+        '''
+        Feeds (stage name, item) pairs into the pipeline and returns the finished items once every stage has closed.
+        '''
+        for stage in self.__stages.values():
+            stage.queue = asyncio.Queue(self.queue_size if stage.bounded and not self.sequential else 0)
+            stage.closed = asyncio.Event()
+            stage.opening = asyncio.Lock()
+
+        fed = asyncio.Event()
+        start = time.perf_counter()
+
+        async def feed():
+            try:
+                for name, item in items:
+                    await self.__put(name, item)
+            finally:
+                fed.set()
+
+        runners = [asyncio.create_task(feed())]
+        names = list(self.__stages)
+        for i, name in enumerate(names):
+            # sequential runs wait for every earlier stage, otherwise only for the stages that can still send items here
+            before = names[:i] if self.sequential else self.__stages[name].upstream
+            runners.append(asyncio.create_task(self.__run_stage(self.__stages[name], fed, before, start)))
+
+        try:
+            await asyncio.gather(*runners)
+        finally:
+            for runner in runners:
+                runner.cancel()
+
+        self.makespan = time.perf_counter() - start
+        logger.info("pipeline finished", extra={"pipeline": self.name, "items": len(self.__finished), "seconds": round(self.makespan, 3), "sequential": self.sequential})
+        return self.__finished
+
+    def failure(self, item):
+        '''
+        Returns the name of the stage that failed on an item and its error, or None if no stage did.
+        '''
+        return next(((stage, error) for failed, stage, error in self.__failed if failed is item), None)
+
+    def report(self):
+        return {
+            "makespan": self.makespan,
+            "sequential": self.sequential,
+            "stages": {
+                stage.name: {
+                    "items": stage.items,
+                    "workers": stage.workers,
+                    "busy_seconds": round(stage.busy, 4),
+                    "started": None if stage.started is None else round(stage.started, 4),
+                    "finished": None if stage.finished is None else round(stage.finished, 4)
+                }
+                for stage in self.__stages.values()
+            }
+        }
+
+    async def __put(self, name, item):
+        stage = self.__stages[name]
+        await stage.queue.put(item)
+        QUEUE_DEPTH.labels(f"{self.name}_{name}").set(stage.queue.qsize())
+
+    async def __run_stage(self, stage, fed, before, origin):
+        async with AsyncExitStack() as resources:
+            if self.sequential:
+                await fed.wait()
+                await self.wait_closed(*before)
+
+            workers = [asyncio.create_task(self.__work(stage, resources, origin)) for _ in range(stage.workers)]
+            try:
+                # nothing more can arrive once the items are all fed and every stage feeding this one has closed
+                await fed.wait()
+                await self.wait_closed(*before)
+                await stage.queue.join()
+                for _ in workers:
+                    await stage.queue.put(_DONE)
+                await asyncio.gather(*workers)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+
+        stage.closed.set()
+
+    async def __work(self, stage, resources, origin):
+        while True:
+            item = await stage.queue.get()
+            if item is _DONE:
+                stage.queue.task_done()
+                return
+
+            QUEUE_DEPTH.labels(f"{self.name}_{stage.name}").set(stage.queue.qsize())
+            start = time.perf_counter()
+            if stage.started is None:
+                stage.started = start - origin
+
+            route = None
+            try:
+                # the first item in opens the stage's resource, the others wait for it
+                if stage.resource is not None and not stage.opened:
+                    async with stage.opening:
+                        if not stage.opened:
+                            stage.value = await resources.enter_async_context(stage.resource())
+                            stage.opened = True
+                route = await stage.work(item, stage.value)
+            except Exception as e:
+                STAGE_ERRORS.labels(f"{self.name}_{stage.name}").inc()
+                logger.error("pipeline stage failed", extra={"pipeline": self.name, "stage": stage.name, "error": str(e)})
+                self.__failed.append((item, stage.name, str(e)))
+
+            stage.items += 1
+            stage.busy += time.perf_counter() - start
+            stage.finished = time.perf_counter() - origin
+
+            if route is None:
+                self.__finished.append(item)
+            else:
+                await self.__put(route, item)
+            stage.queue.task_done()
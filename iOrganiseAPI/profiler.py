@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import time
+import threading
+from uuid import uuid4
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.getenv("FILE_STORAGE_PATH", "/app/file_storage"), "_profiles"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+
+# the profile of the request currently being served, None whenever profiling is off
+_active_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("active_profile", default=None)
+
+def _fold(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+class RequestProfile:
+    '''
+    The RequestProfile class samples the stacks of every thread that works on a profiled request and records wall clock spans for
+    pipeline steps. Stacks are kept in the folded format understood by flamegraph.pl/speedscope, spans as Chrome trace events.
+    '''
+
+    def __init__(self, name: str, interval: float = PROFILE_INTERVAL):
+        self.id = uuid4().hex
+        self.name = name
+        self.interval = interval
+        self.spans = []
+        self.stacks = Counter()
+        self.threads = {threading.get_ident()}  # threads join the profile the first time they open a span
+        self.__origin = time.perf_counter()
+        self.__stop = threading.Event()
+        self.__sampler = threading.Thread(target=self.__sample, name=f"profiler-{self.id[:8]}", daemon=True)
+
+    def start(self):
+        self.__sampler.start()
+        return self
+
+    def stop(self):
+        self.__stop.set()
+        self.__sampler.join()
+        self.duration = time.perf_counter() - self.__origin
+
+    def add_span(self, name, start, end, attributes):
+        self.spans.append({
+            "name": name,
+            "tid": threading.get_ident(),
+            "start": start - self.__origin,
+            "end": end - self.__origin,
+            "args": attributes
+        })
+
+    def __sample(self):
+        while not self.__stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self.threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[_fold(frame)] += 1
+
+    # aggregate time per span name, used for the Server-Timing header
+    def span_totals(self):
+        totals = Counter()
+        for span in self.spans:
+            totals[span["name"]] += span["end"] - span["start"]
+        return totals
+
+    def folded(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def trace(self):
+        return {
+            "displayTimeUnit": "ms",
+            "otherData": {"id": self.id, "name": self.name, "interval": self.interval, "samples": sum(self.stacks.values())},
+            "traceEvents": [
+                {
+                    "name": span["name"],
+                    "ph": "X",
+                    "pid": os.getpid(),
+                    "tid": span["tid"],
+                    "ts": span["start"] * 1e6,
+                    "dur": (span["end"] - span["start"]) * 1e6,
+                    "args": span["args"]
+                }
+                for span in self.spans
+            ]
+        }
+
+    def save(self, directory: str = PROFILE_DIR):
+        os.makedirs(directory, exist_ok=True)
+
+        with open(os.path.join(directory, f"{self.id}.folded"), "w") as folded_file:
+            folded_file.write(self.folded())
+        with open(os.path.join(directory, f"{self.id}.trace.json"), "w") as trace_file:
+            json.dump(self.trace(), trace_file, default=str)
+
+        return self.id
+
+@contextmanager
+def span(name: str, **attributes):
+    profile = _active_profile.get()
+
+    # fast path: a single context variable lookup when the request isn't being profiled
+    if profile is None:
+        yield
+        return
+
+    profile.threads.add(threading.get_ident())
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span(name, start, time.perf_counter(), attributes)
+
+def start_profile(name: str) -> RequestProfile:
+    profile = RequestProfile(name).start()
+    _active_profile.set(profile)
+    return profile
+
+def stop_profile(profile: RequestProfile):
+    profile.stop()
+    _active_profile.set(None)
+    return profile.save()
+
+def profile_path(profile_id: str, kind: str):
+    # profile ids are uuid hex strings, anything else could escape the profile directory
+    if not all(c in "0123456789abcdef" for c in profile_id):
+        return None
+
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.{'trace.json' if kind == 'trace' else 'folded'}")
+    return path if os.path.exists(path) else None
@@ -0,0 +1,131 @@
+import os
+import re
+import math
+
+import numpy as np
+
+from metrics import track_stage, PROMPT_COMPRESSION_RATIO
+
+# documents estimated above this many tokens are cut down to their most central segments before summarisation (0 keeps them whole)
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "0"))
+
+# ranking settings: vocabulary cap, TextRank damping, units above which TextRank gives way to centroid scoring, and the similarity
+# above which a unit counts as a repetition of one already kept
+MAX_FEATURES = 4096
+DAMPING = 0.85
+TEXTRANK_MAX_UNITS = 2000
+REDUNDANCY = 0.8
+
+# spoken filler and function words say nothing about the topic, they are left out of the unit vectors
+STOP_WORDS = frozenset("""
+    a an the and or but if then so than as of to in on at by for with from into about over after before between through up down out
+    is are was were be been being am do does did doing have has had having will would can could should shall may might must
+    i me my we us our you your he him his she her it its they them their this that these those there here what which who whom
+    not no yes all any some each every more most other such only own same too very just also again once
+    um uh er erm ah eh hmm mm oh okay ok yeah yep like right well actually basically literally really kind sort know mean guess
+    gonna wanna gotta thing things stuff lot bit going get got let say said see look
+""".split())
+
+SEGMENT_LABEL = re.compile(r"^Segment \d+: ")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|\n+")
+WORD = re.compile(r"[a-z0-9']+")
+
+def estimate_tokens(text):
+    # llama tokenizers average about four characters per token on english text
+    return math.ceil(len(text) / 4)
+
+def split_units(text):
+    # transcripts arrive as one "Segment N: ..." line per segment and are ranked per segment, anything else per sentence
+    lines = [line for line in text.splitlines() if line.strip()]
+    if lines and all(SEGMENT_LABEL.match(line) for line in lines):
+        return lines
+    return [unit.strip() for unit in SENTENCE_BREAK.split(text) if unit.strip()]
+
+def _unit_vectors(units):
+    # sublinear tf-idf over the most frequent content words, one L2 normalised row per unit
+    terms = [[word for word in WORD.findall(SEGMENT_LABEL.sub("", unit).lower()) if word not in STOP_WORDS] for unit in units]
+
+    frequency = {}
+    for words in terms:
+        for word in words:
+            frequency[word] = frequency.get(word, 0) + 1
+    vocabulary = {word: i for i, word in enumerate(sorted(frequency, key=frequency.get, reverse=True)[:MAX_FEATURES])}
+
+    rows = np.array([i for i, words in enumerate(terms) for word in words if word in vocabulary], dtype=np.int64)
+    cols = np.array([vocabulary[word] for words in terms for word in words if word in vocabulary], dtype=np.int64)
+    vectors = np.zeros((len(units), len(vocabulary)), dtype=np.float32)
+    np.add.at(vectors, (rows, cols), 1)
+
+    present = vectors > 0
+    np.log(vectors, out=vectors, where=present)
+    vectors[present] += 1
+    vectors *= (np.log((1 + len(units)) / (1 + present.sum(axis=0))) + 1).astype(np.float32)
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+def _textrank(similarity):
+    np.fill_diagonal(similarity, 0)
+    degree = similarity.sum(axis=1)
+    transition = similarity / np.where(degree > 0, degree, 1)[:, None]
+
+    n = len(similarity)
+    rank = np.full(n, 1 / n, dtype=np.float32)
+    for _ in range(50):
+        updated = (1 - DAMPING) / n + DAMPING * (transition.T @ rank)
+        if np.abs(updated - rank).sum() < 1e-6:
+            return updated
+        rank = updated
+    return rank
+
+def rank_units(units):
+    '''
+    Scores every unit by how central it is to the document: TextRank over the cosine similarity of the units' tf-idf vectors, or the
+    similarity to the document centroid for very long documents. Returns the scores and a function giving a unit's similarities.
+    '''
+    vectors = _unit_vectors(units)
+
+    if len(units) <= TEXTRANK_MAX_UNITS:
+        similarity = vectors @ vectors.T
+        scores = _textrank(similarity.copy())
+        return scores * (vectors.any(axis=1)), lambda i: similarity[i]
+
+    centroid = vectors.mean(axis=0)
+    return vectors @ centroid, lambda i: vectors @ vectors[i]
+
+def compress(text, token_budget=None):
+    '''
+    Keeps the highest ranked units of text, in their original order, up to token_budget estimated tokens. Units repeating one that
+    is already kept and units with no content words are dropped. Text within the budget, or a budget of 0, is returned unchanged.
+    The budget defaults to LLM_PROMPT_TOKEN_BUDGET.
+    '''
+    if token_budget is None:
+        token_budget = LLM_PROMPT_TOKEN_BUDGET
+
+    total = estimate_tokens(text)
+    if token_budget <= 0 or total <= token_budget:
+        return text
+
+    with track_stage("compress"):
+        units = split_units(text)
+        scores, similarities = rank_units(units)
+        costs = [estimate_tokens(unit) + 1 for unit in units]
+
+        kept, used = [], 0
+        closest = np.zeros(len(units), dtype=np.float32)
+        for i in np.argsort(-scores, kind="stable"):
+            if scores[i] <= 0:
+                break
+            if closest[i] > REDUNDANCY or used + costs[i] > token_budget:
+                continue
+            kept.append(i)
+            used += costs[i]
+            np.maximum(closest, similarities(i), out=closest)
+
+        # a budget smaller than every unit still yields the best unit rather than nothing
+        if not kept:
+            kept = [int(np.argmax(scores))]
+
+    compressed = "\n".join(units[i] for i in sorted(kept))
+    PROMPT_COMPRESSION_RATIO.observe(estimate_tokens(compressed) / total)
+    return compressed
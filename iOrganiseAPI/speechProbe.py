@@ -0,0 +1,142 @@
+import os
+import json
+import wave
+import shutil
+import subprocess
+from collections import namedtuple
+
+import numpy as np
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# set to 0 to send every audio/video upload to ASR without probing it first
+SPEECH_PROBE = os.getenv("SPEECH_PROBE", "1") == "1"
+# a recording is only transcribed with at least this many seconds of speech-like audio making up at least this share of it
+SPEECH_MIN_SECONDS = float(os.getenv("SPEECH_MIN_SECONDS", "1"))
+SPEECH_MIN_RATIO = float(os.getenv("SPEECH_MIN_RATIO", "0.05"))
+
+# the audio is mixed down to mono at 8 kHz and cut into 20 ms frames, the level of a frame is its mean power relative to full scale
+SAMPLE_RATE = 8000
+FRAME_SECONDS = 0.02
+CHUNK_BYTES = 1 << 20           # PCM read from ffmpeg at a time
+
+# a frame is active when it is louder than FLOOR_DB and MARGIN_DB above the quietest tenth of the recording, so hiss and room tone
+# don't count however loud the recording was made
+FLOOR_DB = -50
+MARGIN_DB = 10
+# speech stops between syllables and words, so within a second of it a good share of the frames sits well below the second's mean
+# power. music and steady noise rarely dip like that. a second counts as speech when at least LOW_ENERGY_MIN of its frames are below
+# half its mean power (the low energy ratio of Scheirer and Slaney's speech/music discriminator)
+WINDOW_FRAMES = 50
+LOW_ENERGY_MIN = 0.2
+
+Probe = namedtuple("Probe", ["verdict", "duration", "speech_seconds", "speech_ratio"])   # verdict: speech, no_audio, no_speech, unprobed
+
+def _ffprobe(path):
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "stream=codec_type:format=duration", "-of", "json", path],
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    info = json.loads(result.stdout or "{}")
+    has_audio = any(stream.get("codec_type") == "audio" for stream in info.get("streams", []))
+    duration = info.get("format", {}).get("duration")
+    return has_audio, float(duration) if duration not in (None, "N/A") else None
+
+def _ffmpeg_pcm(path):
+    # only the first audio stream is decoded, the video of a screen recording is never touched
+    process = subprocess.Popen(
+        ["ffmpeg", "-v", "error", "-nostdin", "-i", path, "-map", "0:a:0", "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    try:
+        carry = b""
+        while True:
+            data = process.stdout.read(CHUNK_BYTES)
+            if not data:
+                break
+            data, carry = carry + data, b""
+            if len(data) % 2:
+                data, carry = data[:-1], data[-1:]
+            yield np.frombuffer(data, dtype=np.int16).astype(np.float32)
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+def _wav_pcm(wav):
+    # without ffmpeg only 16-bit WAV can be read, frames are then cut at the file's own rate
+    channels = wav.getnchannels()
+    while True:
+        data = wav.readframes(CHUNK_BYTES // (2 * channels))
+        if not data:
+            break
+        yield np.frombuffer(data, dtype=np.int16).astype(np.float32).reshape(-1, channels).mean(axis=1)
+
+def frame_power(chunks, sample_rate):
+    '''
+    Mean power of every FRAME_SECONDS frame of a stream of PCM chunks, relative to a full scale square wave.
+    '''
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    powers, carry = [], np.zeros(0, dtype=np.float32)
+    for chunk in chunks:
+        samples = np.concatenate((carry, chunk)) / 32768.0
+        count = len(samples) // frame
+        powers.append(np.square(samples[:count * frame]).reshape(count, frame).mean(axis=1))
+        carry = samples[count * frame:] * 32768.0
+    return np.concatenate(powers) if powers else np.zeros(0, dtype=np.float32)
+
+def speech_frames(power):
+    '''
+    Marks the frames that look like speech: active frames in a second whose level keeps dipping the way speech does.
+    '''
+    if not len(power):
+        return np.zeros(0, dtype=bool)
+
+    level = 10 * np.log10(power + 1e-12)
+    active = level > max(FLOOR_DB, np.percentile(level, 10) + MARGIN_DB)
+
+    windows = -(-len(power) // WINDOW_FRAMES)
+    padded = np.full(windows * WINDOW_FRAMES, np.nan)
+    padded[:len(power)] = power
+    padded = padded.reshape(windows, WINDOW_FRAMES)
+    low_energy = np.nanmean(padded < 0.5 * np.nanmean(padded, axis=1, keepdims=True), axis=1)
+    return active & np.repeat(low_energy >= LOW_ENERGY_MIN, WINDOW_FRAMES)[:len(power)]
+
+def probe(path):
+    '''
+    Works out whether a recording has speech worth transcribing without loading an ASR model. The streams are read with ffprobe and
+    the first audio stream is decoded to 8 kHz mono, a fraction of the cost of the 16 kHz decode and the model pass of a transcription.
+    A file that can't be probed is transcribed as before.
+    '''
+    try:
+        if shutil.which("ffprobe") and shutil.which("ffmpeg"):
+            has_audio, duration = _ffprobe(path)
+            if not has_audio:
+                return Probe("no_audio", duration, 0.0, 0.0)
+            power = frame_power(_ffmpeg_pcm(path), SAMPLE_RATE)
+        elif path.lower().endswith(".wav"):
+            with wave.open(path, "rb") as wav:
+                if wav.getsampwidth() != 2:
+                    return Probe("unprobed", wav.getnframes() / wav.getframerate(), None, None)
+                duration = wav.getnframes() / wav.getframerate()
+                power = frame_power(_wav_pcm(wav), wav.getframerate())
+        else:
+            return Probe("unprobed", None, None, None)
+    except (OSError, ValueError, EOFError, wave.Error, subprocess.CalledProcessError) as e:
+        logger.warning("speech probe failed", extra={"path": path, "error": str(e)})
+        return Probe("unprobed", None, None, None)
+
+    if duration is None:
+        duration = len(power) * FRAME_SECONDS
+    if not len(power):
+        return Probe("no_audio", duration, 0.0, 0.0)
+
+    speech_seconds = float(speech_frames(power).sum()) * FRAME_SECONDS
+    speech_ratio = speech_seconds / max(len(power) * FRAME_SECONDS, FRAME_SECONDS)
+    verdict = "speech" if speech_seconds >= SPEECH_MIN_SECONDS and speech_ratio >= SPEECH_MIN_RATIO else "no_speech"
+    return Probe(verdict, duration, round(speech_seconds, 2), round(speech_ratio, 4))
+
+def worth_transcribing(result):
+    return result.verdict in ("speech", "unprobed")
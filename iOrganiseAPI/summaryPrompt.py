@@ -0,0 +1,37 @@
+import hashlib
+
+import promptCompressor
+from promptCompressor import compress
+
+# the summarisation prompt is a static instruction prefix followed by the document, so engines can evaluate the prefix once per loaded
+# model and reuse its KV state. change a template only together with its version, cached prefix states are keyed by both.
+SUMMARY_PROMPTS = {
+    "summary_v1": (
+        """
+        Instructions:
+        Provide me with a short english summary of what is in Transcript using as little words as possible and in bullet point form without adding your own information or repeating Instructions.
+
+        Transcript: 
+""",
+        """        {transcript}
+        """
+    )
+}
+SUMMARY_PROMPT_VERSION = "summary_v1"
+
+def summary_prompt_parts(transcript, version=SUMMARY_PROMPT_VERSION):
+    # long documents are cut down to their most central content first when LLM_PROMPT_TOKEN_BUDGET is set
+    prefix, document = SUMMARY_PROMPTS[version]
+    return prefix, document.format(transcript=compress(transcript))
+
+def summary_prompt(transcript, version=SUMMARY_PROMPT_VERSION):
+    return "".join(summary_prompt_parts(transcript, version))
+
+def prompt_key(version=SUMMARY_PROMPT_VERSION):
+    # the digest catches templates edited without a new version
+    return f"{version}:{hashlib.sha256(SUMMARY_PROMPTS[version][0].encode('utf-8')).hexdigest()[:12]}"
+
+def summary_version(version=SUMMARY_PROMPT_VERSION):
+    # what a stored summary was produced with besides the model: the prompt, and the compression budget it was cut down to
+    budget = promptCompressor.LLM_PROMPT_TOKEN_BUDGET
+    return prompt_key(version) + (f"+budget:{budget}" if budget else "")
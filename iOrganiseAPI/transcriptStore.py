@@ -0,0 +1,92 @@
+import os
+import mmap
+import struct
+
+import numpy as np
+
+# file layout, little endian: a header, one fixed size index record per segment, then the UTF-8 text of every segment back to back.
+# the index is read straight out of the memory map, so looking up a time range or a page only touches the pages it needs.
+MAGIC = b"IOTR"
+VERSION = 1
+HEADER = struct.Struct("<4sHHI")    # magic, version, reserved, segment count
+SEGMENT = np.dtype([("start", "<f4"), ("end", "<f4"), ("offset", "<u4"), ("length", "<u4")])
+
+def transcript_path(storage, email, file_name):
+    return os.path.join(storage, email, "transcript_" + file_name + ".bin")
+
+def write_transcript(path, segments):
+    '''
+    Writes transcription segments (dicts with start, end and text) to path. The file is replaced atomically, so readers never map a
+    half written transcript.
+    '''
+    texts = [(segment.get("text") or "").strip().encode("utf-8") for segment in segments]
+
+    index = np.zeros(len(texts), dtype=SEGMENT)
+    index["start"] = [segment.get("start") or 0 for segment in segments]
+    index["end"] = [segment.get("end") or 0 for segment in segments]
+    index["length"] = [len(text) for text in texts]
+    if len(texts):
+        index["offset"][1:] = np.cumsum(index["length"][:-1])
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as transcript:
+        transcript.write(HEADER.pack(MAGIC, VERSION, 0, len(texts)))
+        transcript.write(index.tobytes())
+        transcript.write(b"".join(texts))
+    os.replace(temp_path, path)
+
+    return path
+
+class TranscriptReader:
+    '''
+    The TranscriptReader class maps a transcript written by write_transcript and serves segments by position or by time without
+    reading the rest of the file.
+    '''
+
+    def __init__(self, path):
+        with open(path, "rb") as transcript:
+            self.__map = mmap.mmap(transcript.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, count = HEADER.unpack_from(self.__map)
+        if magic != MAGIC or version != VERSION:
+            self.__map.close()
+            raise ValueError(f"{path} is not a version {VERSION} transcript")
+
+        self.__index = np.frombuffer(self.__map, dtype=SEGMENT, count=count, offset=HEADER.size)
+        self.__text_start = HEADER.size + count * SEGMENT.itemsize
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # the index is a view into the map, it has to go before the map can be closed
+        self.__index = None
+        self.__map.close()
+
+    def __len__(self):
+        return len(self.__index)
+
+    def duration(self):
+        return float(self.__index["end"].max()) if len(self.__index) else 0.0
+
+    def time_range(self, start=None, end=None):
+        # segments overlapping [start, end), found by binary search on their end and start times
+        first = int(np.searchsorted(self.__index["end"], start, side="right")) if start is not None else 0
+        last = int(np.searchsorted(self.__index["start"], end, side="left")) if end is not None else len(self.__index)
+        return first, max(first, last)
+
+    def segments(self, first, last):
+        segments = []
+        for i in range(max(first, 0), min(last, len(self.__index))):
+            record = self.__index[i]
+            begin = self.__text_start + int(record["offset"])
+            segments.append({
+                "index": i,
+                "start": round(float(record["start"]), 3),
+                "end": round(float(record["end"]), 3),
+                "text": self.__map[begin:begin + int(record["length"])].decode("utf-8")
+            })
+        return segments
@@ -2,6 +2,12 @@ from fastapi import HTTPException, UploadFile
 
 import os
 import gc
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
 import tensorflow as tf
@@ -11,7 +17,6 @@ import magic
 
 import fitz
 from typing import Optional
-from docx import Document
 
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
@@ -19,17 +24,26 @@ import jwt
 
 import magic
 
+from logger import get_logger
+from profiler import span
+from promptCompressor import estimate_tokens
+from docxReader import iter_docx_text
+
+logger = get_logger(__name__)
+
+# root directory for uploaded files and derived artefacts
+FILE_STORAGE = os.getenv("FILE_STORAGE_PATH", "/app/file_storage")
+
 def get_file_type(path):
     try:
-        print(f"Checking file type for: {path}")  # Print the path of the file being checked
+        with span("libmagic"):
+            mime = magic.Magic(mime=True)
+            file_type = mime.from_file(path)
         
-        mime = magic.Magic(mime=True)
-        file_type = mime.from_file(path)
-        
-        print(f"File type detected: {file_type}")  # Print the detected mime type
+        logger.debug("file type detected", extra={"path": path, "file_type": file_type})
         return file_type
     except Exception as e:
-        print(f"Error occurred while checking file type for {path}: {str(e)}")  # Print the error if one occurs
+        logger.warning("file type detection failed", extra={"path": path, "error": str(e)})
         return None
 
     
@@ -48,58 +62,43 @@ def is_image(path):
 def is_text(path):
     return
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return text
-
-def extract_text_from_docx(docx_path: str) -> str:
-    doc = Document(docx_path)
-    text = []
-
-    # Extract text from headers FIRST (they appear at the top)
-    for section in doc.sections:
-        if section.header:
-            for para in section.header.paragraphs:
-                text.append(para.text)
-
-    # Extract main document text (paragraphs and tables in order)
-    for para in doc.paragraphs:
-        text.append(para.text)  # Extracting paragraph text
-
-    # Extract table rows in order
-    for table in doc.tables:
-        for row in table.rows:
-            row_text = [cell.text.strip() for cell in row.cells]
-            if any(row_text):  # Ensure there's text in the row
-                text.append(" | ".join(row_text))
-
-    # Extract footers LAST (they appear at the bottom)
-    for section in doc.sections:
-        if section.footer:
-            for para in section.footer.paragraphs:
-                text.append(para.text)
-
-    return "\n".join(filter(None, text))  # Remove empty lines and join
-
-
-def extract_text_from_txt(txt_path: str) -> str:
+def within_budget(blocks, token_budget=None):
+    # takes blocks of text until they reach token_budget estimated tokens, so an extractor can stop reading early (None or 0 takes
+    # them all)
+    tokens = 0
+    for block in blocks:
+        yield block
+        if token_budget:
+            tokens += estimate_tokens(block)
+            if tokens >= token_budget:
+                return
+
+def extract_text_from_pdf(pdf_path: str, token_budget: int = None) -> str:
+    with fitz.open(pdf_path) as doc:
+        return "".join(within_budget((page.get_text() for page in doc), token_budget))
+
+def extract_text_from_docx(docx_path: str, token_budget: int = None) -> str:
+    # headers, the body with its tables in reading order, then footers, streamed from the XML one paragraph or table row at a time
+    return "\n".join(within_budget(iter_docx_text(docx_path), token_budget))
+
+def extract_text_from_txt(txt_path: str, token_budget: int = None) -> str:
     with open(txt_path, 'r', encoding='utf-8') as file:
-        return file.read()
+        # four characters per estimated token, as estimate_tokens counts them
+        return file.read(token_budget * 4) if token_budget else file.read()
 
 # file uploading
 async def save_uploaded_file(email: str, file: UploadFile):
     try:
         file_content = await file.read()
 
-        with tempfile.NamedTemporaryFile(delete=True) as temp_file:
+        with span("save_upload", bytes=len(file_content)), tempfile.NamedTemporaryFile(delete=True) as temp_file:
             temp_file.write(file_content)
-            type = get_file_type(temp_file.name) if get_file_type(temp_file.name) else 'unknown'
+            # libmagic reads the file from disk, small uploads would otherwise still sit in the write buffer
+            temp_file.flush()
+            type = get_file_type(temp_file.name) or 'unknown'
 
         size = file.size
-        path = os.path.join("/app/file_storage", email, file.filename)
+        path = os.path.join(FILE_STORAGE, email, file.filename)
         
         async with aiofiles.open(path, 'wb') as output_file:
             await output_file.write(file_content)
@@ -110,7 +109,16 @@ async def save_uploaded_file(email: str, file: UploadFile):
         raise HTTPException(status_code=500, detail=f"Error saving file to storage: {str(e)}")
 
 # authentication
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor of new hashes, each step doubles the work. hashes made at another cost still verify
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt takes a few hundred milliseconds per call, so it runs on its own few threads instead of the event loop. a login storm then
+# queues for these workers while every other request carries on (0 hashes on the event loop as before)
+AUTH_WORKERS = int(os.getenv("AUTH_WORKERS", "2"))
+# tokens already verified are remembered by digest until they expire, so a request doesn't re-check the signature (0 disables)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+auth_pool = ThreadPoolExecutor(AUTH_WORKERS, thread_name_prefix="bcrypt") if AUTH_WORKERS else None
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -118,6 +126,17 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+async def run_in_auth_pool(fn, *args):
+    if auth_pool is None:
+        return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(auth_pool, fn, *args)
+
+async def hash_password_async(password: str) -> str:
+    return await run_in_auth_pool(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await run_in_auth_pool(verify_password, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     secret_key = os.getenv('SECRET_KEY')
     if not secret_key:
@@ -128,18 +147,46 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, secret_key, algorithm="HS256")
 
+# comma separated emails of users allowed to reach operator only features (profiling, memory accounting...)
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+def is_admin(user) -> bool:
+    return bool(user) and user.email.lower() in ADMIN_EMAILS
+
+_token_cache = OrderedDict()      # sha256 of a verified token -> (user id, expiry timestamp), least recently used first
+_token_cache_lock = threading.Lock()
+
 def verify_jwt_token(token: str):
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    with _token_cache_lock:
+        cached = _token_cache.get(digest)
+        if cached is not None:
+            if cached[1] > time.time():
+                _token_cache.move_to_end(digest)
+                return cached[0]
+            del _token_cache[digest]
+
     try:
         payload = jwt.decode(token, os.getenv("SECRET_KEY"), algorithms="HS256")
         user_id = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid JWT token")
-        return user_id
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid JWT token")
 
+    if TOKEN_CACHE_SIZE and payload.get("exp"):
+        with _token_cache_lock:
+            _token_cache[digest] = (user_id, payload["exp"])
+            while len(_token_cache) > TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    return user_id
+
+# enum members render as "AsrModels.small" under str(), use their value for labels and logs
+def model_name(model) -> str:
+    return str(getattr(model, "value", model))
+
 # memory management
 def free_memory():
     gc.collect()
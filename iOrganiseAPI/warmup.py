@@ -0,0 +1,95 @@
+import os
+import time
+import asyncio
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# models loaded in the background at startup, before the node reports ready, e.g. "ASR:small_sg,BERT,LLM:deepseek_14b" (empty loads
+# nothing and the node is ready at once)
+WARMUP_MODELS = os.getenv("WARMUP_MODELS", "")
+# also run a tiny inference on each warmed model, which pages its weights in and builds whatever the engine builds on first use
+WARMUP_INFERENCE = os.getenv("WARMUP_INFERENCE", "1") == "1"
+
+def warmup_plan(spec=WARMUP_MODELS):
+    # "MODEL_KEY[:model]" pairs, BERT has a single model
+    plan = []
+    for entry in spec.split(","):
+        if entry.strip():
+            model_key, _, model = entry.strip().partition(":")
+            plan.append((model_key.upper(), model or "distilbert"))
+    return plan
+
+class Warmup:
+    '''
+    The Warmup class loads the models an operator expects to be used right after a deploy, one after another in the background,
+    and runs a dummy inference on each so the first real request finds them resident and paged in. It keeps a state per model
+    (pending, loading, ready or failed) with its load and warm-up times for the readiness probe.
+    '''
+
+    def __init__(self, loader, device, compute_type, plan=None, inference=WARMUP_INFERENCE):
+        self.__loader = loader
+        self.__device = device
+        self.__compute_type = compute_type
+        self.__inference = inference
+        self.__plan = warmup_plan() if plan is None else plan
+        self.__states = {f"{model_key}:{model}": {"state": "pending"} for model_key, model in self.__plan}
+        self.__task = None
+
+    def start(self):
+        # started from a startup hook so the task belongs to the running loop
+        if self.__plan and self.__task is None:
+            self.__task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            await asyncio.gather(self.__task, return_exceptions=True)
+            self.__task = None
+
+    def __args(self, model_key, model):
+        if model_key == "ASR":
+            return model, self.__device, 16, self.__compute_type
+        if model_key == "LLM":
+            return model, self.__device
+        return ()
+
+    def __warm(self, model_key, model):
+        state = self.__states[f"{model_key}:{model}"]
+
+        start = time.perf_counter()
+        with self.__loader.lease(model_key, *self.__args(model_key, model)) as manager:
+            state["load_seconds"] = round(time.perf_counter() - start, 3)
+
+            # a model that loaded but failed its dummy inference is still served, the first request just pays for the warm-up
+            if self.__inference:
+                start = time.perf_counter()
+                try:
+                    manager.warm_up()
+                    state["warmup_seconds"] = round(time.perf_counter() - start, 3)
+                except Exception as e:
+                    logger.warning("model warm-up inference failed", extra={"model_key": model_key, "model": model, "error": str(e)})
+
+    async def run(self):
+        for model_key, model in self.__plan:
+            state = self.__states[f"{model_key}:{model}"]
+            state["state"] = "loading"
+            try:
+                await asyncio.to_thread(self.__warm, model_key, model)
+                state["state"] = "ready"
+                logger.info("model warmed up", extra={"model_key": model_key, "model": model, **{key: value for key, value in state.items() if key != "state"}})
+            except Exception as e:
+                state.update({"state": "failed", "error": str(e)})
+                logger.error("model warm-up failed", extra={"model_key": model_key, "model": model, "error": str(e)})
+
+    def is_ready(self):
+        # a failed model is loaded on demand like before, so only models still warming up hold readiness back
+        return all(state["state"] in ("ready", "failed") for state in self.__states.values())
+
+    def snapshot(self):
+        return {
+            "ready": self.is_ready(),
+            "models": {key: dict(state) for key, state in self.__states.items()},
+            "load_times": self.__loader.get_load_times()
+        }